@@ -117,13 +117,24 @@ class AutoUpdater(threading.Thread):
 								haveKeyring = False
 								continue
 							print "import from", name
-							# Get ofx data, update if not empty
-							# It may be an error string, in which case it's ignored
-							ofx = getOfx(p.username, password, brokerage, p.account)
+							# Get ofx data since each account's last import, update if not empty
+							# Error strings are ignored and those accounts keep their watermark
+							today = datetime.date.today()
+							watermarks = p.portPrefs.getOfxWatermarks()
+							ofx = ""
+							imported = []
+							for account, response in getOfxAccounts(p.username, password, brokerage, p.account, watermarks):
+								if isOfxResponse(response):
+									ofx += response
+									imported.append(account)
 							if ofx != "":
 								(numNew, numOld, newTickers) = p.updateFromFile(ofx, app)
 								if numNew > 0 or newTickers:
 									p.portPrefs.setDirty(True)
+								if numNew is not False:
+									for account in imported:
+										watermarks[account] = today
+									p.portPrefs.setOfxWatermarks(watermarks)
 							print "imported"
 
 					# Update time only if not aborted
@@ -1,92 +1,115 @@
 import appGlobal
+import collections
+import operator
 
 from transaction import *
 
 class Basis:
-	"""Implements a basis tracker.  Ticker can be a simple stock ticker or a tuple for tracking options.  An options tuple is (ticker, Transaction.optionCall | Transaction.optionPut, strike, expire)"""
+	"""Implements a basis tracker.  Ticker can be a simple stock ticker or a tuple for tracking options.  An options tuple is (ticker, Transaction.optionCall | Transaction.optionPut, strike, expire)
+	
+	Lots are relieved first in first out unless another method is given.  A specific lot may be relieved by passing its purchase date to remove."""
+	
+	# Lot relief methods
+	fifo = 0
+	lifo = 1
+	highestCost = 2
 
-	# tickers[ticker][pricePerShare] = (datePurchased, quantity)
-	# The (datePurchased, quantity) tuple should be removed once quantity goes to 0
-	def __init__(self):
+	# tickers[ticker] = deque of [datePurchased, quantity, pricePerShare] ordered by datePurchased
+	# shares[ticker] and cost[ticker] are the total quantity and quantity * pricePerShare of every lot
+	# A lot is removed once its quantity goes to 0 and a ticker once it has no lots
+	def __init__(self, method = fifo):
+		self.method = method
 		self.tickers = {}
+		self.shares = {}
+		self.cost = {}
 
 	def add(self, ticker, datePurchased, quantity, pricePerShare):
 		if not ticker in self.tickers:
-			self.tickers[ticker] = {}
-		if not pricePerShare in self.tickers[ticker]:
-			self.tickers[ticker][pricePerShare] = []
-		self.tickers[ticker][pricePerShare].append((datePurchased, quantity))
+			self.tickers[ticker] = collections.deque()
+			self.shares[ticker] = 0
+			self.cost[ticker] = 0
+		lots = self.tickers[ticker]
+		if not lots or lots[-1][0] <= datePurchased:
+			lots.append([datePurchased, quantity, pricePerShare])
+		else:
+			# Purchased before the newest lot, keep lots ordered by date
+			lots.append([datePurchased, quantity, pricePerShare])
+			self.tickers[ticker] = collections.deque(sorted(lots, key = operator.itemgetter(0)))
+		self.shares[ticker] += quantity
+		self.cost[ticker] += quantity * pricePerShare
 
-	def remove(self, ticker, quantity):
+	def remove(self, ticker, quantity, lot = False):
+		"""Remove quantity shares.  If lot is a purchase date shares are removed from that lot first."""
 		if not ticker in self.tickers:
 			#print "no basis for", ticker, quantity
 			return
+		lots = self.tickers[ticker]
+		
+		if lot is not False:
+			for l in list(lots):
+				if quantity <= 1.0e-6:
+					break
+				if l[0] == lot:
+					quantity = self.relieve(ticker, l, quantity)
+		
 		# Keep looping until we have removed all quantity
-		while quantity > 1.0e-6:
-			# Find minimum date
-			minDate = False
-			for ts in self.tickers[ticker].itervalues():
-				for t in ts:
-					if minDate is False or t[0] < minDate:
-						minDate = t[0]
-			if minDate is False:
-				#print "no dates for", ticker
-				return
-
-			# Remove shares from minimum dates
-			removed = 0
-			i = 0
-			for (pricePerShare, ts) in self.tickers[ticker].items():
-				for t in ts:
-					if t[0] != minDate:
-						continue
-					if t[1] <= quantity:
-						# Remove completely
-						removed += t[1]
-						quantity -= t[1]
-						self.tickers[ticker][pricePerShare].remove(t)
-						if len(self.tickers[ticker][pricePerShare]) == 0:
-							del self.tickers[ticker][pricePerShare]
-						if len(self.tickers[ticker]) == 0:
-							del self.tickers[ticker]
-							if quantity > 1.0e-6:
-								app = appGlobal.getApp()
-								if app and app.statusUpdate:
-									app.statusUpdate.addMessage("Left over quantity %s, shares = %f" % (ticker, quantity))
-								return
-					else:
-						# Remove some shares
-						removed += quantity
-						self.tickers[ticker][pricePerShare][i] = (t[0], t[1] - quantity)
-						quantity = 0
-						i += 1
-
-			# Makes ure something was removed
-			if removed == 0:
-				#print "Could not finish basis for", ticker
-				break
+		while quantity > 1.0e-6 and lots:
+			if self.method == Basis.lifo:
+				l = lots[-1]
+			elif self.method == Basis.highestCost:
+				l = max(lots, key = operator.itemgetter(2))
+			else:
+				l = lots[0]
+			quantity = self.relieve(ticker, l, quantity)
+		
+		if not lots:
+			del self.tickers[ticker]
+			del self.shares[ticker]
+			del self.cost[ticker]
+			if quantity > 1.0e-6:
+				app = appGlobal.getApp()
+				if app and app.statusUpdate:
+					app.statusUpdate.addMessage("Left over quantity %s, shares = %f" % (ticker, quantity))
+
+	def relieve(self, ticker, l, quantity):
+		"""Remove up to quantity shares from lot l.  Returns the quantity left to remove."""
+		lots = self.tickers[ticker]
+		if l[1] <= quantity:
+			# Remove completely
+			if l is lots[0]:
+				lots.popleft()
+			elif l is lots[-1]:
+				lots.pop()
+			else:
+				lots.remove(l)
+			self.shares[ticker] -= l[1]
+			self.cost[ticker] -= l[1] * l[2]
+			return quantity - l[1]
+		else:
+			# Remove some shares
+			l[1] -= quantity
+			self.shares[ticker] -= quantity
+			self.cost[ticker] -= quantity * l[2]
+			return 0
+
+	def getLots(self, ticker):
+		"""Return a list of (datePurchased, quantity, pricePerShare) ordered by datePurchased"""
+		if not ticker in self.tickers:
+			return []
+		return [tuple(l) for l in self.tickers[ticker]]
 
 	def getShares(self, ticker):
 		if not ticker in self.tickers:
 			return 0
-		count = 0
-		for ts in self.tickers[ticker].itervalues():
-			for t in ts:
-				count += t[1]
-		return count
+		return self.shares[ticker]
 
 	def getBasis(self, ticker):
 		"""Get the basis per share for a stock or option"""
 		if not ticker in self.tickers:
 			return 0
-		count = 0
-		sum = 0
-		for (pricePerShare, ts) in self.tickers[ticker].items():
-			for t in ts:
-				count += t[1]
-				sum += t[1] * pricePerShare
+		count = self.shares[ticker]
 		if count > 0:
-			return float(sum) / count
+			return float(self.cost[ticker]) / count
 		else:
 			return 0
 
@@ -97,9 +120,7 @@ class Basis:
 			# Check for ticker or for option
 			if ticker and t != ticker and not (isinstance(t, tuple) and t[0] == ticker):
 				continue
-			for (pricePerShare, ts) in self.tickers[t].items():
-				for t in ts:
-					sum += t[1] * pricePerShare
+			sum += self.cost[t]
 		return sum
 
 if __name__ == "__main__":
@@ -196,3 +217,36 @@ if __name__ == "__main__":
 	assert(b.getBasis("A") == 0)
 	assert(b.getTotalBasis("A") == 0)
 	assert(len(b.tickers) == 0)
+
+	print "test 5 - lifo and highest cost"
+	b = Basis(Basis.lifo)
+	b.add("A", "2011-01-01", 10, 20)
+	b.add("A", "2011-01-02", 10, 22)
+	b.add("A", "2011-01-03", 5, 21)
+	b.remove("A", 8)
+	assert(b.getShares("A") == 17)
+	assert(b.getTotalBasis("A") == 354)
+	assert(b.getLots("A") == [("2011-01-01", 10, 20), ("2011-01-02", 7, 22)])
+	b = Basis(Basis.highestCost)
+	b.add("A", "2011-01-01", 10, 20)
+	b.add("A", "2011-01-02", 10, 22)
+	b.add("A", "2011-01-03", 5, 21)
+	b.remove("A", 12)
+	assert(b.getShares("A") == 13)
+	assert(b.getTotalBasis("A") == 263)
+	assert(b.getLots("A") == [("2011-01-01", 10, 20), ("2011-01-03", 3, 21)])
+
+	print "test 6 - specific lot and out of order purchases"
+	b = Basis()
+	b.add("A", "2011-01-02", 10, 22)
+	b.add("A", "2011-01-03", 5, 21)
+	b.add("A", "2011-01-01", 10, 20)
+	assert(b.getLots("A") == [("2011-01-01", 10, 20), ("2011-01-02", 10, 22), ("2011-01-03", 5, 21)])
+	b.remove("A", 12, lot = "2011-01-03")
+	assert(b.getShares("A") == 13)
+	assert(b.getTotalBasis("A") == 280)
+	assert(b.getLots("A") == [("2011-01-01", 3, 20), ("2011-01-02", 10, 22)])
+	b.remove("A", 13)
+	assert(b.getShares("A") == 0)
+	assert(b.getTotalBasis("A") == 0)
+	assert(len(b.tickers) == 0)
@@ -0,0 +1,238 @@
+# Copyright (c) 2006-2010, Jesse Liesch
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the author nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE IMPLIED
+# DISCLAIMED. IN NO EVENT SHALL JESSE LIESCH BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+
+from transaction import *
+from twrr import *
+
+# Rebalancing frequencies for benchmark portfolios
+rebalanceNever = "never"
+rebalanceMonthly = "monthly"
+rebalanceQuarterly = "quarterly"
+rebalanceYearly = "yearly"
+
+def getRebalancePeriod(date, rebalance):
+	'''Return a value that changes whenever a benchmark should be rebalanced'''
+	if rebalance == rebalanceMonthly:
+		return (date.year, date.month)
+	elif rebalance == rebalanceQuarterly:
+		return (date.year, (date.month - 1) / 3)
+	elif rebalance == rebalanceYearly:
+		return date.year
+	return None
+
+def rebuildBenchmark(allocation, prices, dividends, startDate, now, rebalance = rebalanceYearly, status = False):
+	'''Simulate a benchmark portfolio that deposits $10,000 on startDate, buys its allocation,
+	reinvests dividends and rebalances at the start of every rebalance period.
+	
+	allocation is the percentage of each ticker.  prices and dividends are the stock data
+	of each ticker in date order.  Does no database access.
+	
+	Returns (transactions, historyRows) where historyRows has a row per day for each
+	position, __CASH__ and __COMBINED__.  Returns match the generic transaction replay:
+	positions use Twrr and __COMBINED__ compares its value to the $10,000 deposited.'''
+	transactions = []
+	historyRows = []
+	tickers = sorted(allocation)
+	
+	def addTransaction(ticker, date, type, amount, shares = False, pricePerShare = False):
+		transactions.append(Transaction(
+			"__" + str(len(transactions) + 1) + "__",
+			ticker,
+			date,
+			type,
+			amount,
+			shares = shares,
+			pricePerShare = pricePerShare,
+			auto = True))
+	
+	date = datetime.datetime(startDate.year, startDate.month, startDate.day)
+	cash = 10000.0
+	addTransaction("__CASH__", date, Transaction.deposit, cash)
+	
+	priceIndex = dict((ticker, 0) for ticker in tickers)
+	dividendIndex = dict((ticker, 0) for ticker in tickers)
+	close = {}
+	shares = {}
+	
+	# Per position totals
+	invested = {}
+	totalDividends = {}
+	twrrs = {}
+	
+	# Combined totals
+	deposited = cash
+	combinedDividends = 0.0
+	combinedNormSplit = 1.0
+	
+	period = False
+	yieldCount = 0
+	# Like the generic replay, the last day simulated is the day before now
+	end = datetime.datetime(now.year, now.month, now.day)
+	while date < end:
+		yieldCount += 1
+		if yieldCount == 100:
+			yieldCount = 0
+			if status:
+				status.appYield()
+				if status.canceled:
+					break
+		
+		# Latest close on or before today
+		# Positions whose price or shares change today are in active
+		active = {}
+		for ticker in tickers:
+			tickerPrices = prices[ticker]
+			i = priceIndex[ticker]
+			while i < len(tickerPrices) and tickerPrices[i]["date"] <= date:
+				close[ticker] = tickerPrices[i]["close"]
+				active[ticker] = True
+				i += 1
+			priceIndex[ticker] = i
+		for ticker in twrrs:
+			twrrs[ticker].beginTransactions()
+		
+		# Reinvest today's dividends
+		todayDividends = 0.0
+		for ticker in shares:
+			dividend = 0.0
+			
+			tickerDividends = dividends[ticker]
+			i = dividendIndex[ticker]
+			while i < len(tickerDividends) and tickerDividends[i]["date"] < date:
+				i += 1
+			while i < len(tickerDividends) and tickerDividends[i]["date"] == date:
+				if close[ticker] > 0:
+					amount = tickerDividends[i]["value"] * shares[ticker]
+					buyShares = amount / close[ticker]
+					shares[ticker] += buyShares
+					dividend += amount
+					addTransaction(ticker, date, Transaction.dividendReinvest, amount, buyShares, close[ticker])
+					twrrs[ticker].addDividendReinvest(ticker, buyShares, close[ticker])
+					active[ticker] = True
+				i += 1
+			dividendIndex[ticker] = i
+			
+			totalDividends[ticker] += dividend
+			todayDividends += dividend
+		
+		combined = cash
+		for ticker in shares:
+			combined += shares[ticker] * close[ticker]
+		combinedDividends += todayDividends
+		if combined - combinedDividends > 0:
+			combinedNormSplit = (combined - combinedDividends) / deposited
+		
+		# Buy the allocation on the first day and rebalance at the start of every period
+		thisPeriod = getRebalancePeriod(date, rebalance)
+		if period is False or thisPeriod != period:
+			period = thisPeriod
+			for ticker in tickers:
+				if not ticker in close or close[ticker] <= 0:
+					continue
+				
+				finalShares = combined / close[ticker] * allocation[ticker] / 100.0
+				if ticker in shares:
+					buyShares = finalShares - shares[ticker]
+				else:
+					buyShares = finalShares
+					invested[ticker] = 0.0
+					totalDividends[ticker] = 0.0
+					twrrs[ticker] = Twrr()
+					twrrs[ticker].beginTransactions()
+				shares[ticker] = finalShares
+				
+				amount = buyShares * close[ticker]
+				if buyShares > 1.0e-6:
+					addTransaction(ticker, date, Transaction.buy, -amount, buyShares, close[ticker])
+					twrrs[ticker].addShares(ticker, buyShares, close[ticker])
+					active[ticker] = True
+				elif buyShares < -1.0e-6:
+					addTransaction(ticker, date, Transaction.sell, -amount, -buyShares, close[ticker])
+					twrrs[ticker].removeShares(ticker, -buyShares, close[ticker])
+					active[ticker] = True
+				else:
+					amount = 0.0
+				cash -= amount
+				invested[ticker] += amount
+		
+		# Position history
+		day = date.strftime("%Y-%m-%d 00:00:00")
+		for ticker in tickers:
+			if not ticker in shares:
+				continue
+			
+			# Like the generic replay, quiet days leave the return unchanged
+			twrr = twrrs[ticker]
+			if ticker in active:
+				twrr.setValue(ticker, close[ticker])
+				twrr.endTransactions()
+			else:
+				twrr.skipDays(1)
+			
+			value = shares[ticker] * close[ticker]
+			profit = value - invested[ticker]
+			historyRows.append({
+				"date": day,
+				"ticker": ticker,
+				"shares": shares[ticker],
+				"options": 0,
+				"value": value,
+				"normSplit": twrr.getReturnSplit(),
+				"normDividend": twrr.getReturnDiv(),
+				"normFee": twrr.getReturnFee(),
+				"profitSplit": profit - totalDividends[ticker],
+				"profitDividend": profit,
+				"profitFee": profit})
+		historyRows.append({
+			"date": day,
+			"ticker": "__CASH__",
+			"shares": cash,
+			"options": 0,
+			"value": cash,
+			"normSplit": 1.0,
+			"normDividend": 1.0,
+			"normFee": 1.0,
+			"profitSplit": 0.0,
+			"profitDividend": 0.0,
+			"profitFee": 0.0})
+		profit = combined - deposited
+		historyRows.append({
+			"date": day,
+			"ticker": "__COMBINED__",
+			"shares": combined,
+			"options": None,
+			"value": combined,
+			"normSplit": combinedNormSplit,
+			"normDividend": combined / deposited,
+			"normFee": combined / deposited,
+			"profitSplit": profit - combinedDividends,
+			"profitDividend": profit,
+			"profitFee": profit})
+		
+		date += datetime.timedelta(1)
+	
+	return (transactions, historyRows)
@@ -193,7 +193,7 @@ class AllocationModel(EditGridModel):
 
 			if ticker in positions:
 				if total > 0:
-					current = positions[ticker]["value"] / total * 100.0
+					current = positions[ticker]["weight"] * 100.0
 				else:
 					current = 0
 				currentDollar = "$" + locale.format("%.2f", positions[ticker]["value"], True)
@@ -265,27 +265,27 @@ class AllocationModel(EditGridModel):
 			
 			# If this is a brokerage and it has valid history
 			if self.app.portfolio.isBrokerage() and "__CASH__" in positions:
-				# Get last stock data
-				date = self.app.stockData.getLastDate(ticker)
-				if date:
-					value = self.app.stockData.getPrice(ticker, date)
-					if value and differenceDollar != "n/a":
-						cash = positions["__CASH__"]["value"]
-						if cash > 0 and differenceDollar < -cash:
-							differenceDollar = -cash
-						shares = differenceDollar / value["close"]
-						if shares > 0:
-							currentRow.append("Sell %.2f" % shares)
-						elif shares < 0:
-							# Buy up to cash amount of shares if we can't totally rebalance
-							# Or buy rebalancing amount plus remaining balance
-							if differenceDollar > -cash:
-								currentRow.append("Buy %.2f to %.2f" % (abs(shares), cash / value["close"]))
-							else:
-								currentRow.append("Buy %.2f" % abs(shares))
+				# Last stock price is stored in the position snapshot
+				price = False
+				if ticker in positions:
+					price = positions[ticker]["price"]
+				if price and differenceDollar != "n/a":
+					cash = positions["__CASH__"]["value"]
+					if cash > 0 and differenceDollar < -cash:
+						differenceDollar = -cash
+					shares = differenceDollar / price
+					if shares > 0:
+						currentRow.append("Sell %.2f" % shares)
+					elif shares < 0:
+						# Buy up to cash amount of shares if we can't totally rebalance
+						# Or buy rebalancing amount plus remaining balance
+						if differenceDollar > -cash:
+							currentRow.append("Buy %.2f to %.2f" % (abs(shares), cash / price))
 						else:
-							currentRow.append("")
-						currentRow.append(shares)
+							currentRow.append("Buy %.2f" % abs(shares))
+					else:
+						currentRow.append("")
+					currentRow.append(shares)
 				else:
 					currentRow.append("")
 
@@ -214,20 +214,26 @@ class EditRules(QDialog):
 			self.listView.setEditTriggers(QAbstractItemView.NoEditTriggers)
 			self.listView.setSelectionMode(QListView.SingleSelection)
 
-			rules = []
-			for r in self.portfolio.getRules():
-				rules.append(r[0] + " -> " + r[1])
+			rules = self.ruleStrings()
 			self.listModel = QStringListModel(rules)
 
 			self.listView.setModel(self.listModel)
 			self.listView.connect(self.listView.selectionModel(), SIGNAL("selectionChanged(QItemSelection, QItemSelection)"), self.newSelection)
 			self.vert.addWidget(self.listView)
 		else:
-			rules = []
-			for r in self.portfolio.getRules():
-				rules.append(r[0] + " -> " + r[1])
+			rules = self.ruleStrings()
 			self.listModel.setStringList(rules)
 	
+	def ruleStrings(self):
+		'''Describe each rule along with how many uncategorized payees it matches'''
+		rules = []
+		for (rule, category, count) in self.portfolio.runRules(preview = True):
+			if count == 1:
+				rules.append("%s -> %s (1 payee)" % (rule, category))
+			else:
+				rules.append("%s -> %s (%d payees)" % (rule, category, count))
+		return rules
+	
 	def newSelection(self, old, new):
 		self.remove.setEnabled(True)
 		self.selectedRuleIndex = self.listView.selectedIndexes()[0].row()
@@ -258,9 +264,9 @@ class CategoriesModel(EditGridModel):
 
 		# Add category
 		table[0].append("Category");
+		categories = self.portfolio.getCategoryMap()
 		for row in table[1]:
-			c = self.portfolio.getCategory(row[0])
-			row.append(c)
+			row.append(categories.get(row[0], "Uncategorized"))
 
 		# Remove categorized payees
 		rowIndex = 0
@@ -336,14 +342,15 @@ class CategoriesWidget(QWidget):
 	def addCombos(self):
 		portfolio = appGlobal.getApp().portfolio
 		categories = portfolio.getCategories()
+		categoryMap = portfolio.getCategoryMap()
 		for row in range(self.model.rowCount()):
 			index = self.model.createIndex(row, 2)
 			e = QComboBox()
 			e.myIndex = index
 			e.setMinimumSize(e.sizeHint().width() + 50, e.sizeHint().height() + 10)
-			e.addItems(portfolio.getCategories())
+			e.addItems(categories)
 			ticker = self.model.myData[row][0]
-			e.setCurrentIndex(categories.index(portfolio.getCategory(ticker)))
+			e.setCurrentIndex(categories.index(categoryMap.get(ticker, "Uncategorized")))
 			self.table.connect(e, SIGNAL("currentIndexChanged(int)"), EditGrid.editChangedFactory(self.table, e))
 			self.table.setIndexWidget(index, e)
 			if not 2 in self.table.editColumns:
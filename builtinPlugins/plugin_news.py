@@ -26,9 +26,7 @@
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
-import re
-import feedparser
-
+from newsFeed import *
 from editGrid import *
 from statusUpdate import *
 from plugin import *
@@ -272,32 +270,19 @@ class NewsWidget(QWidget):
 			tickers.remove("__CASH__")
 		if "__COMBINED__" in tickers:
 			tickers.remove("__COMBINED__")
+		# Feeds download concurrently, only changed feeds are sent again
+		# Save what was downloaded even if canceled
+		feeds = app.stockData.getNewsFeeds()
+		news = []
 		count = 0
-		for ticker in tickers:
+		for (ticker, rows, etag, modified) in fetchNews(tickers, feeds):
+			news += rows
+			feeds[ticker] = (etag, modified)
+			count += 1
+			status.setStatus("Downloaded news for " + ticker, 100 * count / len(tickers))
 			if status.canceled:
 				break
-
-			status.setStatus("Downloading news for " + ticker, 100 * count / len(tickers))
-			
-			d = feedparser.parse("http://finance.yahoo.com/rss/headline?s=" + ticker)
-			for e in d.entries:
-				d = e.updated_parsed
-				date = "%04d-%02d-%02d %02d:%02d:%02d" % (d.tm_year, d.tm_mon, d.tm_mday, d.tm_hour, d.tm_min, d.tm_sec)
-	
-				# Get link, take from xxx*http if presesnt
-				url = e.link
-				url = url.replace("%3A", ":")
-				h = url.find('*http')
-				if h != -1:
-					url = url[h + 1:]
-	
-				app.stockData.addNews(
-					ticker,
-					date,
-					unicode(e.title),
-					unicode(e.summary),
-					unicode(url))
-			count += 1
+		app.stockData.saveNews(news, feeds)
 
 		self.model.setNews()
 		self.table.resizeRowsToContents()
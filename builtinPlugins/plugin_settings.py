@@ -224,6 +224,15 @@ class PortfolioSettingsWidget(QWidget):
 				self.benchmark.setCurrentIndex(choices.index(portfolio.getBenchmark()))
 			grid.addWidget(self.benchmark, 1, 1)
 			self.connect(self.benchmark, SIGNAL("currentIndexChanged(int)"), self.newBenchmark)
+		elif portfolio.isBenchmark():
+			grid.addWidget(QLabel("<b>Rebalance</b>"), 1, 0)
+			self.rebalanceChoices = [rebalanceNever, rebalanceMonthly, rebalanceQuarterly, rebalanceYearly]
+			self.rebalance = QComboBox()
+			self.rebalance.addItems(["Never", "Monthly", "Quarterly", "Yearly"])
+			if portfolio.portPrefs.getBenchmarkRebalance() in self.rebalanceChoices:
+				self.rebalance.setCurrentIndex(self.rebalanceChoices.index(portfolio.portPrefs.getBenchmarkRebalance()))
+			grid.addWidget(self.rebalance, 1, 1)
+			self.connect(self.rebalance, SIGNAL("currentIndexChanged(int)"), self.newRebalance)
 
 		row = 2
 		if portfolio.isBrokerage():
@@ -483,6 +492,10 @@ class PortfolioSettingsWidget(QWidget):
 		self.app.portfolio = Portfolio(self.app.portfolio.name)
 		self.app.portfolio.readFromDb()
 	
+	def newRebalance(self):
+		self.app.portfolio.portPrefs.setBenchmarkRebalance(self.rebalanceChoices[self.rebalance.currentIndex()])
+		self.app.portfolio.portPrefs.setDirty(True)
+	
 	def newReport(self):
 		summ = self.reportChoices[self.report.currentIndex()]
 		if summ == "Show current year only":
@@ -60,6 +60,7 @@ class Plugin(PluginBase):
 class StockDataModel(EditGridModel):
 	def __init__(self, parent = None, *args): 
 		EditGridModel.__init__(self, parent, *args)
+		self.fetchSize = 500
 		self.ticker = False
 		self.dividends = False
 	
@@ -82,14 +83,18 @@ class StockDataModel(EditGridModel):
 				break
 
 		# Create columns
+		# Numbers are kept as values and formatted when shown
 		cols = ["Date", "Shares"]
+		formats = [False, Transaction.formatFloat]
 		if haveOptions:
 			cols.append("Options")
+			formats.append(Transaction.formatFloat)
 		if self.dividends:
 			cols.append("Value")
 			cols.append("Type")
 			cols.append("Amount")
 			cols.append("Total")
+			formats += [Transaction.formatDollar, False, Transaction.formatDollar, False]
 		else:
 			cols.append("Value")
 			cols.append("Open")
@@ -97,6 +102,8 @@ class StockDataModel(EditGridModel):
 			cols.append("Low")
 			cols.append("Close")
 			cols.append("Volume")
+			formats += [Transaction.formatDollar] * 5
+			formats.append(lambda volume: Transaction.formatFloat(volume, commas = True))
 		self.setColumns(cols)
 		
 		self.priceMap = {}
@@ -117,17 +124,17 @@ class StockDataModel(EditGridModel):
 					newRow = [d["date"]]
 					if d["date"] in positionData:
 						data = positionData[d["date"]]
-						newRow.append(Transaction.formatFloat(data["shares"]))
+						newRow.append(data["shares"])
 						if haveOptions:
-							newRow.append(Transaction.formatFloat(data["options"]))
-						newRow.append(Transaction.formatDollar(data["value"]))
+							newRow.append(data["options"])
+						newRow.append(data["value"])
 					else:
 						newRow.append("")
 						if haveOptions:
 							newRow.append("")
 						newRow.append("")
 					newRow.append("Dividend")
-					newRow.append(Transaction.formatDollar(d["value"]))
+					newRow.append(d["value"])
 					myDiv = app.portfolio.getDividendForDate(self.ticker, d["date"])
 					if myDiv:
 						newRow.append(myDiv.formatTotal())
@@ -167,7 +174,10 @@ class StockDataModel(EditGridModel):
 				# Output missing data
 				while currPos < len(keys) and keys[currPos] > p["date"]:
 					data = positionData[keys[currPos]]
-					row2 = [keys[currPos], Transaction.formatFloat(data["shares"]), Transaction.formatFloat(data["options"]), Transaction.formatDollar(data["value"]), "", "", "", "", ""]
+					row2 = [keys[currPos], data["shares"]]
+					if haveOptions:
+						row2.append(data["options"])
+					row2 += [data["value"], "", "", "", "", ""]
 
 					stockData.append(row2)
 					row += 1
@@ -178,21 +188,21 @@ class StockDataModel(EditGridModel):
 					# Check if held on date
 					if keys and keys[currPos] == p["date"]:
 						data = positionData[p["date"]]
-						newRow.append(Transaction.formatFloat(data["shares"]))
+						newRow.append(data["shares"])
 						if haveOptions:
-							newRow.append(Transaction.formatFloat(data["options"]))
-						newRow.append(Transaction.formatDollar(data["value"]))
+							newRow.append(data["options"])
+						newRow.append(data["value"])
 						currPos += 1
 					else:
 						newRow.append("")
 						if haveOptions:
 							newRow.append("")
 						newRow.append("")
-					newRow.append(Transaction.formatDollar(p["open"]))
-					newRow.append(Transaction.formatDollar(p["high"]))
-					newRow.append(Transaction.formatDollar(p["low"]))
-					newRow.append(Transaction.formatDollar(p["close"]))
-					newRow.append(Transaction.formatFloat(p["volume"], commas = True))
+					newRow.append(p["open"])
+					newRow.append(p["high"])
+					newRow.append(p["low"])
+					newRow.append(p["close"])
+					newRow.append(p["volume"])
 					stockData.append(newRow)
 					self.priceMap[row] = p
 
@@ -202,12 +212,15 @@ class StockDataModel(EditGridModel):
 			# Output remaining data
 			while currPos < len(keys):
 				data = positionData[keys[currPos]]
-				row2 = [keys[currPos], Transaction.formatFloat(data["shares"]), Transaction.formatDollar(data["value"]), "", "", "", "", ""]
+				row2 = [keys[currPos], data["shares"]]
+				if haveOptions:
+					row2.append(data["options"])
+				row2 += [data["value"], "", "", "", "", ""]
 
 				stockData.append(row2)
 				row += 1
 				currPos += 1
-		self.setData(stockData)
+		self.setData(stockData, formats = formats)
 		
 class StockDataWidget(QWidget):
 	def __init__(self, parent):
@@ -403,13 +416,13 @@ class StockDataWidget(QWidget):
 			if self.dividends.isChecked():
 				if row in self.model.dividendMap:
 					div = self.model.dividendMap[row]
-					app.stockData.db.delete("stockDividends", {"ticker": self.model.ticker, "date": div["date"].strftime("%Y-%m-%d %H:%M:%S")})
+					app.stockData.deleteData("stockDividends", self.model.ticker, div["date"])
 				elif row in self.model.splitMap:
 					split = self.model.splitMap[row]
-					app.stockData.db.delete("stockSplits", {"ticker": self.model.ticker, "date": split["date"].strftime("%Y-%m-%d %H:%M:%S")})
+					app.stockData.deleteData("stockSplits", self.model.ticker, split["date"])
 			else:
 				price = self.model.priceMap[row]
-				app.stockData.db.delete("stockData", {"ticker": self.model.ticker, "date": price["date"].strftime("%Y-%m-%d %H:%M:%S")})
+				app.stockData.deleteData("stockData", self.model.ticker, price["date"])
 
 			self.model.setStockData()
 			self.table.resizeColumnsToContents()
@@ -701,9 +714,7 @@ class NewStockData(QDialog):
 				QMessageBox(QMessageBox.Critical, 'Invalid Close', 'Please choose a valid closing price').exec_()
 				return
 
-			data = {"ticker": ticker,
-				"date": date,
-				"close": close}
+			data = {"close": close}
 			if open != "":
 				data["open"] = open
 			if high != "":
@@ -715,12 +726,10 @@ class NewStockData(QDialog):
 			
 			if self.data:
 				# Update existing data
-				self.app.stockData.db.update("stockData", data, where =
-					{"ticker": ticker, 
-					"date": self.data["date"].strftime("%Y-%m-%d %H:%M:%S")})
+				self.app.stockData.saveData("stockData", ticker, dateDatetime, data, self.data["date"])
 			else:
 				# Insert new data
-				self.app.stockData.db.insert("stockData", data)
+				self.app.stockData.saveData("stockData", ticker, dateDatetime, data)
 		elif type == "Dividend" or type == "Split":
 			value = str(self.value.text()).strip(",").strip("$")
 			
@@ -753,24 +762,16 @@ class NewStockData(QDialog):
 				return
 			
 			# Insert or update dividend/split
-			data = {"ticker": ticker,
-				"date": date,
-				"value": value}
+			data = {"value": value}
+			if type == "Dividend":
+				table = "stockDividends"
+			else:
+				table = "stockSplits"
 			if self.data:
 				# Update existing data
-				if type == "Dividend":
-					self.app.stockData.db.update("stockDividends", data, where =
-					{"ticker": ticker, 
-					"date": self.data["date"].strftime("%Y-%m-%d %H:%M:%S")})
-				else:
-					self.app.stockData.db.update("stockSplits", data, where =
-					{"ticker": ticker, 
-					"date": self.data["date"].strftime("%Y-%m-%d %H:%M:%S")})
+				self.app.stockData.saveData(table, ticker, dateDatetime, data, self.data["date"])
 			else:
-				if type == "Dividend":
-					self.app.stockData.db.insert("stockDividends", data)
-				else:
-					self.app.stockData.db.insert("stockSplits", data)
+				self.app.stockData.saveData(table, ticker, dateDatetime, data)
 		
 		#if self.ticker2.GetValue():
 		#	t.setTicker2(self.ticker2.GetValue())
@@ -43,6 +43,20 @@ try:
 except:
 	haveKeyring = False
 
+# Number of transactions sent in each bulk request
+syncBatchSize = 500
+
+def syncSignature(t):
+	'''Return a string that changes whenever a synchronized field of a transaction changes.  Empty values compare equal as in Transaction.__eq__.'''
+	values = []
+	for value in [t.ticker, t.date, t.type, t.total, t.shares, t.pricePerShare, t.fee, t.ticker2, t.subType, t.deleted]:
+		if not value or value == "False":
+			value = False
+		elif type(value) == str:
+			value = unicode(value)
+		values.append(value)
+	return repr(tuple(values))
+
 class SynchronizerPassword(QDialog):
 	def __init__(self, name, parent = None, badPassword = False, badUsername = False):
 		global haveKeyring
@@ -192,114 +206,112 @@ class Synchronizer:
 		
 		try:
 			# Verify that portfolio is available
+			# A portfolio new to the server starts a full synchronization
 			serverPorts = self.getPortfolios()
 			if not self.portfolio.name in serverPorts:
 				self.addPortfolio()
+				self.portfolio.clearSyncState(self.name)
 	
-			status.setStatus("Downloading transactions", 10)
-			
-			serverTransactions = self.getTransactions()
-			localTransactions = self.portfolio.getTransactions(getDeleted = True)
-			localTransactionsDict = {}
-			for t in localTransactions:
+			if not self.syncByIds:
+				raise Exception("sync not supported unless by ids")
+
+			# Download transactions edited on the server since the last sync
+			status.setStatus("Downloading changes", 10)
+			(serverTransactions, watermark) = self.getChanges(self.portfolio.getSyncWatermark(self.name))
+			serverDict = {}
+			for t2 in serverTransactions:
+				# Do not save automatic transactions
+				if t2.auto:
+					continue
+				if t2.uniqueId in serverDict:
+					status.addError("Transaction id is not unique for %s" % t2)
+					continue
+				serverDict[t2.uniqueId] = t2
+
+			# Local transactions changed since they were last synchronized are sent to the server
+			# Local changes take precedence over changes on the server
+			status.setStatus("Synching transactions", 40)
+			synced = self.portfolio.getSyncSignatures(self.name)
+			signatures = {}
+			localDict = {}
+			changed = []
+			for t in self.portfolio.getTransactions(getDeleted = True):
 				if t.auto:
 					continue
-				localTransactionsDict[t.uniqueId] = t
+				localDict[t.uniqueId] = t
+				signature = syncSignature(t)
+				if synced.get(t.uniqueId) == signature:
+					continue
+				
+				t2 = serverDict.get(t.uniqueId)
+				if t2 and syncSignature(t2) == signature:
+					signatures[t.uniqueId] = signature
+				elif t.deleted and not t2 and not t.uniqueId in synced:
+					# Never sent to the server
+					continue
+				else:
+					changed.append(t)
 			
-			# Now consolidate based on ids
-			if self.syncByIds:
-				# Put serverTransactions in a dictionary by id
-				serverDict = {}
-				for t2 in serverTransactions:
-					# Do not save automatic transactions
-					if t2.auto:
-						continue
-					if t2.uniqueId in serverDict:
-						status.addError("Transaction id is not unique for %s" % t2)
-						continue
-					serverDict[t2.uniqueId] = t2
-	
-				# Loop over local transactions, check if not there, deleted, or matching
-				i = 0
-				for t in localTransactions:
-					i += 1
-					status.setStatus("Synching transactions", 10 + 50 * i / len(localTransactions))
-					
-					# Skip automatically generated transactions
-					if t.auto:
-						continue
-					
-					# Look for transaction in dictionary
-					if t.uniqueId in serverDict:
-						found = True
-						t2 = serverDict[t.uniqueId]
-					else:
-						found = False
-						t2 = False
-					
-					# Delete if not deleted
-					# Add if not found
-					# Check for differences
-					try:
-						if t.deleted:
-							# Make sure it's deleted on server
-							# Do not add or update deleted transactions
-							if t2 and not t2.deleted:
-								self.deleteTransaction(t)
-						elif not found:
-							self.addTransaction(t)
-						elif t != t2:
-							self.updateTransaction(t)
-					except Exception, e:
-						status.addException()
-
-				# Loop over server transactions, check if not there, deleted, or matching in local transactions
-				modified = False
-				i = 0
-				for t2 in serverTransactions:
-					i += 1
-					status.setStatus("Synching transactions", 60 + 40 * i / len(serverTransactions))
-
-					# Skip automatically generated transactions
-					if t2.auto:
-						continue
-
-					# look for transaction in dictionary
-					if t2.uniqueId in localTransactionsDict:
-						found = True
-						t = localTransactionsDict[t2.uniqueId]
-					else:
-						found = False
-						t = False
-
-					# Delete if not deleted
-					# Add if not found
-					# Check for differences
-					try:
-						if t2.deleted:
-							# Make sure it's deleted locally
-							# Do not add or update deleted transactions
-							if t and not t.deleted:
-								self.deleteLocalTransaction(t2)
-								modified = True
-						elif not found:
-							self.addLocalTransaction(t2)
-							modified = True
-						elif t != t2:
-							self.updateLocalTransaction(t2)
-							modified = True
-					except Exception, e:
-						status.addException()
-
-					if modified:
-						self.portfolio.portPrefs.setDirty(True)
-
-			else:
-				raise Exception("sync not supported unless by ids")
+			status.setStatus("Uploading %d transactions" % len(changed), 50)
+			for t in self.pushTransactions(changed, synced, status):
+				signatures[t.uniqueId] = syncSignature(t)
+
+			# Save server transactions that differ from local transactions
+			modified = []
+			for t2 in serverDict.values():
+				if t2.uniqueId in signatures:
+					continue
+				t = localDict.get(t2.uniqueId)
+				if not t and t2.deleted:
+					continue
+				signature = syncSignature(t2)
+				if t and syncSignature(t) != signature and synced.get(t.uniqueId) != syncSignature(t):
+					# Changed locally but not uploaded
+					continue
+				if not t or syncSignature(t) != signature:
+					modified.append(t2)
+				signatures[t2.uniqueId] = signature
+
+			status.setStatus("Saving %d transactions" % len(modified), 90)
+			self.portfolio.db.beginTransaction()
+			for t2 in modified:
+				t2.save(self.portfolio.db)
+			self.portfolio.setSyncSignatures(self.name, signatures)
+			if watermark:
+				self.portfolio.setSyncWatermark(self.name, watermark)
+			self.portfolio.db.commitTransaction()
+
+			if modified:
+				self.portfolio.portPrefs.setDirty(True)
 		except Exception, e:
 			status.addException()
 		status.setFinished()
 
+	def pushTransactions(self, transactions, synced, status):
+		'''Send changed local transactions to the server one at a time.  synced is the dictionary of transactions previously sent.  Returns the transactions that were sent.'''
+		ret = []
+		for t in transactions:
+			try:
+				if t.deleted:
+					self.deleteTransaction(t)
+				elif t.uniqueId in synced:
+					# Left unsynchronized so it is sent again once updates are supported
+					if not self.updateTransaction(t):
+						continue
+				else:
+					self.addTransaction(t)
+				ret.append(t)
+			except Exception, e:
+				status.addException()
+		return ret
+
+	def getChanges(self, watermark):
+		'''Return a tuple of (server transactions, new watermark).  Only transactions edited since watermark need to be returned.  Subclasses should override if they support watermarks, the default returns all transactions and no watermark.'''
+		transactions = self.getTransactions()
+		if transactions is None:
+			raise Exception("could not download transactions")
+		return (transactions, "")
+
 	def addLocalTransaction(self, t):
 		t.save(self.portfolio.db)
 		self.portfolio.portPrefs.setDirty(True)
@@ -339,10 +351,10 @@ class Synchronizer:
 		print "delete transaction", transaction
 		pass
 
-	# Subclass should override
+	# Subclass should override, return True if the transaction was updated
 	def updateTransaction(self, transaction):
 		print "update transaction", transaction
-		pass
+		return False
 
 class IcarraSynchronizer(Synchronizer):
 	def __init__(self, portfolio):
@@ -352,6 +364,47 @@ class IcarraSynchronizer(Synchronizer):
 		self.cookie = False
 		self.userId = False
 		self.url = "http://www.icarra2.com/cgi-bin/webClientApi.py"
+		self.bulkSync = True # Cleared if the server does not support syncTransactions
+	
+	def callApi(self, data):
+		'''Post an action to the web client API and return the decoded (success, result) response'''
+		data.update({"userId": self.userId, "cookie": self.cookie, "name": self.portfolio.name})
+		request = urllib2.Request(self.url, urllib.urlencode(data))
+		f = urllib2.urlopen(request)
+		return json.loads(f.read())
+	
+	def parseTransaction(self, t):
+		'''Return a Transaction for a transaction dictionary returned by the server'''
+		return Transaction(
+			uniqueId = t["uniqueId"],
+			ticker = t["ticker"],
+			date = t["date"],
+			transactionType = t["type"],
+			amount = t["total"],
+			shares = t["shares"],
+			pricePerShare = t["pricePerShare"],
+			fee = t["fee"],
+			edited = t["edited"],
+			deleted = t["deleted"],
+			ticker2 = t["ticker2"],
+			subType = t["subType"],
+			auto = t["auto"])
+	
+	def transactionData(self, transaction):
+		'''Return a dictionary of a transaction's values suitable for sending to the server'''
+		return {
+			"uniqueId": transaction.uniqueId,
+			"ticker": transaction.ticker,
+			"date": str(transaction.date),
+			"type": transaction.type,
+			"ticker2": transaction.ticker2,
+			"shares": transaction.shares,
+			"pricePerShare": transaction.pricePerShare,
+			"fee": transaction.fee,
+			"total": transaction.total,
+			"subType": transaction.subType,
+			"deleted": transaction.deleted
+		}
 	
 	def login(self):
 		loggedIn = False
@@ -398,24 +451,42 @@ class IcarraSynchronizer(Synchronizer):
 				raise Exception("bad login")
 			ret = []
 			for t in result[1]:
-				ret.append(Transaction(
-					uniqueId = t["uniqueId"],
-					ticker = t["ticker"],
-					date = t["date"],
-					transactionType = t["type"],
-					amount = t["total"],
-					shares = t["shares"],
-					pricePerShare = t["pricePerShare"],
-					fee = t["fee"],
-					edited = t["edited"],
-					deleted = t["deleted"],
-					ticker2 = t["ticker2"],
-					subType = t["subType"],
-					auto = t["auto"]))
+				ret.append(self.parseTransaction(t))
 			return ret
 		except Exception, e:
 			print "could not get transactions:", e
 
+	def getChanges(self, watermark):
+		# Servers that do not support editedSince return a list of every transaction
+		data = {"action": "getTransactions", "getDeleted": True}
+		if watermark:
+			data["editedSince"] = watermark
+		result = self.callApi(data)
+		if not result[0]:
+			raise Exception("could not get transactions: %s" % result[1])
+		if type(result[1]) == dict:
+			transactions = result[1]["transactions"]
+			watermark = result[1].get("watermark", "")
+		else:
+			transactions = result[1]
+			watermark = ""
+		return ([self.parseTransaction(t) for t in transactions], watermark)
+
+	def pushTransactions(self, transactions, synced, status):
+		# Send transactions in batches, falling back to one request per transaction
+		ret = []
+		for i in range(0, len(transactions), syncBatchSize):
+			batch = transactions[i:i + syncBatchSize]
+			if self.bulkSync:
+				result = self.callApi({"action": "syncTransactions", "transactions": json.dumps([self.transactionData(t) for t in batch])})
+				if result[0]:
+					ret += batch
+					continue
+				print "bulk sync not supported:", result[1]
+				self.bulkSync = False
+			ret += Synchronizer.pushTransactions(self, batch, synced, status)
+		return ret
+
 	def addPortfolio(self):
 		data = {"action": "addPortfolio", "userId": self.userId, "cookie": self.cookie, "name": self.portfolio.name}
 		if self.portfolio.isBenchmark():
@@ -450,13 +521,10 @@ class IcarraSynchronizer(Synchronizer):
 		data["subType"] = transaction.subType
 		query = urllib.urlencode(data)
 		request = urllib2.Request(self.url, query)
-		try:
-			f = urllib2.urlopen(request)
-			result = json.loads(f.read())
-			if not result[0]:
-				raise Exception("bad login " + result[1])
-		except Exception, e:
-			print "could not add transaction:", e
+		f = urllib2.urlopen(request)
+		result = json.loads(f.read())
+		if not result[0]:
+			raise Exception("could not add transaction %s: %s" % (transaction, result[1]))
 
 	def deleteTransaction(self, transaction):
 		data = {"action": "deleteTransaction", "userId": self.userId, "cookie": self.cookie, "name": self.portfolio.name, "uniqueId": transaction.uniqueId}
@@ -469,7 +537,7 @@ class IcarraSynchronizer(Synchronizer):
 
 	def updateTransaction(self, transaction):
 		print "update transaction not implemented", transaction
-		pass
+		return False
 
 class Plugin(PluginBase):
 	def name(self):
@@ -589,3 +657,126 @@ class SyncWidget(QWidget):
 
 		if "icarra" in sync:
 			IcarraSynchronizer(self.app.portfolio).sync()
+
+if __name__ == "__main__":
+	import threading
+	import urlparse
+	import BaseHTTPServer
+	import SocketServer
+	
+	# Server transactions by uniqueId, each stamped with the edit count when it was saved
+	server = {"rows": {}, "edits": 0, "bulk": True}
+	requests = []
+	
+	def saveRow(row):
+		server["edits"] += 1
+		row = dict(row)
+		for key in ["ticker2", "subType", "shares", "pricePerShare", "fee", "total", "deleted"]:
+			row.setdefault(key, False)
+		row["edited"] = False
+		row["auto"] = False
+		row["edit"] = server["edits"]
+		server["rows"][row["uniqueId"]] = row
+	
+	class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+		def do_POST(self):
+			query = dict(urlparse.parse_qsl(self.rfile.read(int(self.headers["Content-Length"]))))
+			action = query["action"]
+			requests.append(action)
+			result = [True, None]
+			if action == "getTransactions":
+				since = int(query.get("editedSince", 0))
+				rows = [row for row in server["rows"].values() if row["edit"] > since]
+				result = [True, {"transactions": rows, "watermark": str(server["edits"])}]
+			elif action == "syncTransactions" and server["bulk"]:
+				for row in json.loads(query["transactions"]):
+					saveRow(row)
+			elif action == "newTransaction":
+				if query["ticker"] == "BAD":
+					result = [False, "invalid ticker"]
+				else:
+					saveRow({"uniqueId": query["uniqueId"], "ticker": query["ticker"], "date": query["date"], "type": int(query["type"])})
+			elif action == "deleteTransaction":
+				row = server["rows"][query["uniqueId"]]
+				row["deleted"] = True
+				saveRow(row)
+			else:
+				result = [False, "unknown action " + action]
+			response = json.dumps(result)
+			self.send_response(200)
+			self.send_header("Content-Length", str(len(response)))
+			self.end_headers()
+			self.wfile.write(response)
+		
+		def log_message(self, *args):
+			pass
+	
+	class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+		daemon_threads = True
+	
+	class StandInPortfolio:
+		name = "Test"
+	
+	class StandInStatus:
+		def __init__(self):
+			self.exceptions = 0
+		
+		def addException(self):
+			self.exceptions += 1
+	
+	def transactions(ids, ticker = "AAA"):
+		return [Transaction(uniqueId, ticker, datetime.datetime(2012, 1, 2), Transaction.buy, -100.0, 1.0, 100.0) for uniqueId in ids]
+	
+	srv = StandInServer(("127.0.0.1", 0), StandInHandler)
+	thread = threading.Thread(target = srv.serve_forever)
+	thread.setDaemon(True)
+	thread.start()
+	s = IcarraSynchronizer(StandInPortfolio())
+	s.url = "http://127.0.0.1:%d/" % srv.server_address[1]
+	
+	print "test1 - delta download"
+	for t in transactions(["s1", "s2", "s3"]):
+		saveRow(s.transactionData(t))
+	(changes, watermark) = s.getChanges("")
+	assert sorted([t.uniqueId for t in changes]) == ["s1", "s2", "s3"]
+	assert watermark == "3"
+	saveRow(s.transactionData(transactions(["s4"])[0]))
+	(changes, watermark) = s.getChanges(watermark)
+	assert [t.uniqueId for t in changes] == ["s4"]
+	assert watermark == "4"
+	(changes, watermark) = s.getChanges(watermark)
+	assert changes == [] and watermark == "4"
+	
+	print "test2 - bulk push"
+	syncBatchSize = 2
+	del requests[:]
+	status = StandInStatus()
+	pushed = transactions(["b1", "b2", "b3", "b4", "b5"])
+	assert s.pushTransactions(pushed, {}, status) == pushed
+	assert requests == ["syncTransactions"] * 3
+	assert all([uniqueId in server["rows"] for uniqueId in ["b1", "b2", "b3", "b4", "b5"]])
+	assert status.exceptions == 0
+	
+	print "test3 - fallback to one request per transaction"
+	server["bulk"] = False
+	del requests[:]
+	added = transactions(["f1"])[0]
+	bad = transactions(["f2"], ticker = "BAD")[0]
+	updated = transactions(["b1"])[0]
+	deleted = transactions(["b2"])[0]
+	deleted.setDeleted()
+	ret = s.pushTransactions([added, bad, updated, deleted], {"b1": "", "b2": ""}, status)
+	
+	# The rejected add and the unsupported update are not reported as sent
+	assert ret == [added, deleted]
+	assert requests == ["syncTransactions", "newTransaction", "newTransaction", "deleteTransaction"]
+	assert status.exceptions == 1
+	assert "f1" in server["rows"] and not "f2" in server["rows"]
+	assert server["rows"]["b2"]["deleted"]
+	
+	# Bulk requests are not attempted again
+	del requests[:]
+	assert [t.uniqueId for t in s.pushTransactions(transactions(["f3"]), {}, status)] == ["f3"]
+	assert requests == ["newTransaction"]
+	
+	srv.shutdown()
@@ -887,6 +887,7 @@ class NewTransaction(QDialog):
 class TransactionModel(EditGridModel):
 	def __init__(self, parent = None, *args): 
 		EditGridModel.__init__(self, parent, *args)
+		self.fetchSize = 500
 		
 		self.showDeleted = False
 		self.ticker = appGlobal.getApp().portfolio.getLastTicker()
@@ -923,6 +924,14 @@ class TransactionModel(EditGridModel):
 		autoSplit = app.portfolio.portPrefs.getAutoSplit()
 		autoDividend = app.portfolio.portPrefs.getAutoDividend()
 
+		# Numbers are kept as values and formatted when shown
+		formats = [False, False, False]
+		if not app.portfolio.isBank():
+			formats += [Transaction.formatFloat, Transaction.formatDollar]
+		formats += [lambda fee: "$" + str(fee), Transaction.formatDollar]
+		if showCash:
+			formats.append(Transaction.formatDollar)
+
 		for t in trans:
 			if not self.ticker or t.ticker == self.ticker or t.ticker2 == self.ticker:
 				self.transactionIds.append(t.uniqueId)
@@ -940,16 +949,25 @@ class TransactionModel(EditGridModel):
 					if t.type in [Transaction.deposit, Transaction.withdrawal, Transaction.dividend, Transaction.adjustment, Transaction.expense, Transaction.split]:
 						row.append("")
 					else:
-						row.append(t.formatShares())
-					row.append(t.formatPricePerShare())
-				row.append(t.formatFee())
-				row.append(t.formatTotal())
+						row.append(abs(t.shares))
+					if not t.pricePerShare or t.pricePerShare == "False":
+						row.append("")
+					else:
+						row.append(t.pricePerShare)
+				if not t.fee or t.fee == "False":
+					row.append("")
+				else:
+					row.append(t.fee)
+				if not t.total or t.type in [Transaction.split]:
+					row.append(t.formatTotal())
+				else:
+					row.append(t.getDisplayTotal())
 				if showCash:
-					row.append(Transaction.formatDollar(t.computedCashValue))
+					row.append(t.computedCashValue)
 
 				self.transactions.append(row)
 
-		self.setData(self.transactions)
+		self.setData(self.transactions, formats = formats)
 
 class TransactionWidget(QWidget):
 	def __init__(self, parent):
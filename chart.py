@@ -75,6 +75,51 @@ def getSummaryChartTypes(portfolio):
 			threeMonthMovers: "Three Month Movers",
 			oneYearMovers: "One Year Movers"}
 
+def decimate(xs, ys, buckets):
+	'''Reduce a series to at most four points per bucket.  The first, last, lowest and highest
+	point of each bucket are kept so spikes survive and lines drawn one bucket per pixel look the
+	same as the full series.  False values in ys are breaks in the data and are kept.'''
+	count = len(xs)
+	if buckets < 1 or count <= 4 * buckets:
+		return (xs, ys)
+	
+	keep = []
+	interval = count / float(buckets)
+	nextFloat = 0.0
+	start = 0
+	while start < count:
+		nextFloat += interval
+		end = min(count, max(start + 1, int(nextFloat)))
+		
+		# Split bucket into runs of data separated by breaks
+		j = start
+		while j < end:
+			if ys[j] is False:
+				# Keep one break, skip the rest
+				keep.append(j)
+				while j < end and ys[j] is False:
+					j += 1
+				continue
+			
+			first = j
+			low = j
+			high = j
+			while j < end and ys[j] is not False:
+				if ys[j] < ys[low]:
+					low = j
+				elif ys[j] > ys[high]:
+					high = j
+				j += 1
+			keep.extend(sorted(set((first, low, high, j - 1))))
+		start = end
+	
+	return ([xs[j] for j in keep], [ys[j] for j in keep])
+
+# Attributes set by Portfolio.drawChart, saved and restored by getSeries and setSeries
+seriesAttributes = ["xs", "ys", "buyXs", "buyYs", "sellXs", "sellYs", "splitXs", "splitYs",
+	"dividendXs", "dividendYs", "dividendValues", "shortXs", "shortYs", "coverXs", "coverYs",
+	"labels", "colors", "dashed", "title", "doGradient", "zeroYAxis", "yAxisType"]
+
 def getChartTypes(portfolio):
 	if portfolio.isBank():
 		return ["Total Value", "Spending", "Monthly Spending"]
@@ -83,9 +128,18 @@ def getChartTypes(portfolio):
 
 class Chart():
 	def __init__(self, parent = None):
+		self.version = 0
 		self.reset()
 	
+	def changed(self):
+		'''Invalidate cached bounds and decimated series.  Called by reset and the add
+		functions, call directly after modifying data or display parameters in place.'''
+		self.version += 1
+		self.bounds = False
+		self.decimated = {}
+	
 	def reset(self):
+		self.changed()
 		self.xs = []
 		self.ys = []
 		self.buyXs = []
@@ -125,6 +179,7 @@ class Chart():
 		self.doGradient = False
 
 	def addXY(self, x, y, label = False, color = (0.0, 0.8, 0.0), dashed = False):
+		self.changed()
 		self.xs.append(x)
 		self.ys.append(y)
 		self.labels.append(label)
@@ -132,28 +187,98 @@ class Chart():
 		self.dashed.append(dashed)
 	
 	def addBuys(self, buyX, buyY):
+		self.changed()
 		self.buyXs = buyX
 		self.buyYs = buyY
 
 	def addSells(self, sellX, sellY):
+		self.changed()
 		self.sellXs = sellX
 		self.sellYs = sellY
 
 	def addSplits(self, splitX, splitY):
+		self.changed()
 		self.splitXs = splitX
 		self.splitYs = splitY
 
 	def addDividends(self, dividendX, dividendY, dividendValues):
+		self.changed()
 		self.dividendXs = dividendX
 		self.dividendYs = dividendY
 		self.dividendValues = dividendValues
 
 	def addShorts(self, shortX, shortY):
+		self.changed()
 		self.shortXs = shortX
 		self.shortYs = shortY
 
 	def addCovers(self, coverX, coverY):
+		self.changed()
 		self.coverXs = coverX
 		self.coverYs = coverY
-
-
+	
+	def getSeries(self):
+		'''Return the data of this chart as a dictionary that can be passed to setSeries'''
+		series = {}
+		for name in seriesAttributes:
+			value = getattr(self, name)
+			if type(value) == list:
+				value = list(value)
+			series[name] = value
+		return series
+	
+	def setSeries(self, series):
+		'''Replace the data of this chart with data from getSeries.  Display parameters are reset.'''
+		self.reset()
+		for name in seriesAttributes:
+			value = series[name]
+			if type(value) == list:
+				value = list(value)
+			setattr(self, name, value)
+	
+	def getBounds(self):
+		'''Return (minX, maxX, minY, maxY, numXs) over all series and dividends'''
+		if self.bounds:
+			return self.bounds
+		
+		# If no xs or ys then assume we have dividends
+		if len(self.xs) and len(self.xs[0]) > 0:
+			minX = self.xs[0][0]
+			maxX = self.xs[0][0]
+			minY = self.ys[0][0]
+			maxY = self.ys[0][0]
+			numXs = 0
+			for x in self.xs:
+				minX = min(minX, min(x))
+				maxX = max(maxX, max(x))
+				numXs = max(numXs, len(x))
+			for y in self.ys:
+				minY = min(minY, min(y))
+				maxY = max(maxY, max(y))
+		else:
+			minX = self.dividendXs[0]
+			maxX = self.dividendXs[0]
+			minY = self.dividendYs[0]
+			maxY = self.dividendYs[0]
+			numXs = len(self.dividendXs)
+		if self.dividendXs:
+			numXs = max(numXs, len(self.dividendXs))
+			minX = min(minX, min(self.dividendXs))
+			maxX = max(maxX, max(self.dividendXs))
+			minY = min(minY, min(self.dividendYs))
+			maxY = max(maxY, max(self.dividendYs))
+		
+		self.bounds = (minX, maxX, minY, maxY, numXs)
+		return self.bounds
+	
+	def getDecimated(self, buckets):
+		'''Return (xs, ys) with every series decimated to buckets, see decimate'''
+		if not buckets in self.decimated:
+			xs = []
+			ys = []
+			for i in range(len(self.xs)):
+				(x, y) = decimate(self.xs[i], self.ys[i], buckets)
+				xs.append(x)
+				ys.append(y)
+			self.decimated[buckets] = (xs, ys)
+		return self.decimated[buckets]
@@ -37,6 +37,10 @@ class ChartWidget(QWidget, chart.Chart):
 		QWidget.__init__(self, parent)
 		chart.Chart.__init__(self)
 		self.setMinimumSize(300, 200)
+		self.pixmap = False
+		self.pixmapKey = False
+		self.paths = False
+		self.pathsKey = False
 	
 	@staticmethod
 	def totalSeconds(td):
@@ -128,43 +132,56 @@ class ChartWidget(QWidget, chart.Chart):
 		else:
 			self.painter.drawText(x, y, string)
 	
+	def getPaths(self, xs, ys, buckets):
+		'''Return a QPainterPath for each series in data coordinates.  Paths are cached until the chart changes.'''
+		if self.pathsKey == (self.version, buckets):
+			return self.paths
+		
+		self.paths = []
+		for i in range(len(xs)):
+			path = QPainterPath()
+			moveTo = True
+			for j in range(len(xs[i])):
+				# Check for break in data, resart lines
+				if ys[i][j] is False:
+					moveTo = True
+					continue
+				
+				if moveTo:
+					path.moveTo(self.totalSeconds(xs[i][j]), ys[i][j])
+					moveTo = False
+				else:
+					path.lineTo(self.totalSeconds(xs[i][j]), ys[i][j])
+			self.paths.append(path)
+		self.pathsKey = (self.version, buckets)
+		return self.paths
+	
 	def paintEvent(self, event):
 		if (len(self.xs) == 0 or len(self.xs[0]) == 0) and len(self.dividendXs) == 0:
 			return
 		
+		# Only draw the chart when its data or size changes
+		# Expose and hover repaints copy the last drawing
+		key = (self.version, self.w, self.h)
+		if self.pixmapKey != key:
+			self.pixmap = QPixmap(self.w, self.h)
+			self.pixmap.fill(Qt.transparent)
+			painter = QPainter(self.pixmap)
+			self.paintChart(painter)
+			painter.end()
+			self.pixmapKey = key
+		
 		painter = QPainter(self)
+		painter.drawPixmap(0, 0, self.pixmap)
+		painter.end()
+	
+	def paintChart(self, painter):
 		self.painter = painter
 
 		self.lastYear = -1
-		xyArray = []
 		
 		# Get min/max x, y
-		# If no xs or ys then assume we have dividends
-		if len(self.xs) and len(self.xs[0]) > 0:
-			minX = self.xs[0][0]
-			maxX = self.xs[0][0]
-			minY = self.ys[0][0]
-			maxY = self.ys[0][0]
-			numXs = 0
-			for x in self.xs:
-				minX = min(minX, min(x))
-				maxX = max(maxX, max(x))
-				numXs = max(numXs, len(x))
-			for y in self.ys:
-				minY = min(minY, min(y))
-				maxY = max(maxY, max(y))
-		else:
-			minX = self.dividendXs[0]
-			maxX = self.dividendXs[0]
-			minY = self.dividendYs[0]
-			maxY = self.dividendYs[0]
-			numXs = len(self.dividendXs)
-		if self.dividendXs:
-			numXs = max(numXs, len(self.dividendXs))
-			minX = min(minX, min(self.dividendXs))
-			maxX = max(maxX, max(self.dividendXs))
-			minY = min(minY, min(self.dividendYs))
-			maxY = max(maxY, max(self.dividendYs))
+		(minX, maxX, minY, maxY, numXs) = self.getBounds()
 		
 		if self.zeroYAxis and minY > 0:
 			minY = 0
@@ -194,48 +211,6 @@ class ChartWidget(QWidget, chart.Chart):
 		spanX = maxX - minX
 		spanY = maxY - minY
 
-		# Trim prices
-		interval = self.pixelsPerPoint * numXs / float(self.chartSpanX)
-		if interval < 1.0:
-				interval = 1.0
-
-		prices = {}
-		xs = []
-		ys = []
-		
-		# Trim data, averaging buckets
-		if interval > 1:
-			for i in range(len(self.xs)):
-				nextX = 0
-				nextXFloat = 0.0
-				xs.append([])
-				ys.append([])
-				bucket = []
-				for j in range(len(self.xs[i])):
-					# If break in data, reset bucket
-					if self.ys[i][j] is False:
-						bucket = []
-					else:
-						bucket.append(self.ys[i][j])
-
-					if j == nextX:
-						xs[i].append(self.xs[i][j])
-						if bucket:
-							ys[i].append(sum(bucket) / len(bucket))
-							bucket = []
-						else:
-							# Break in data
-							ys[i].append(False)
-						nextXFloat += interval
-						nextX = int(nextXFloat)
-				
-				# Add in last point
-				xs[i].append(self.xs[i][-1])
-				ys[i].append(self.ys[i][-1])
-		else:
-			xs = self.xs
-			ys = self.ys
-
 		axesX = self.chartMinX
 		chartWidth = self.chartSpanX
 		axesY = self.h - self.chartMinY
@@ -243,6 +218,13 @@ class ChartWidget(QWidget, chart.Chart):
 
 		if chartWidth <= 0 or chartHeight <= 0:
 			return
+
+		# Decimate data to a power of two buckets, at least one per point of width
+		# Rounding lets resizing reuse cached series and paths
+		buckets = 1
+		while buckets < chartWidth / self.pixelsPerPoint:
+			buckets *= 2
+		(xs, ys) = self.getDecimated(buckets)
 			
 		# Draw legend
 		if self.legend:
@@ -409,37 +391,26 @@ class ChartWidget(QWidget, chart.Chart):
 		
 		painter.setRenderHint(QPainter.Antialiasing)
 
+		# Map paths from data coordinates to the chart
+		paths = self.getPaths(xs, ys, buckets)
+		if spanY > 0:
+			transform = QTransform(chartWidth / spanX, 0, 0, -chartHeight / spanY, axesX - minX * chartWidth / spanX, axesY + minY * chartHeight / spanY)
+		else:
+			transform = QTransform(chartWidth / spanX, 0, 0, 0, axesX - minX * chartWidth / spanX, axesY)
+
 		# If gradient, draw it first
 		if self.doGradient and not oneDataPoint:
-			path = QPainterPath()
+			path = transform.map(paths[0])
 			gradientPath = QPainterPath()
-			moveTo = True
-			for j in range(len(xs[0])):
-				# Check for break in data, resart lines
-				if ys[0][j] is False:
-					moveTo = True
-					continue
-
-				if spanX > 0:
-					x = axesX + (self.totalSeconds(xs[0][j]) - minX) / spanX * (chartWidth + 0)
-				else:
-					x = axesX
-				if spanY > 0:
-					y = axesY - (ys[0][j] - minY) / spanY * chartHeight
-				else:
-					y = axesY
-
-				if moveTo:
-					path.moveTo(x, y)
-					moveTo = False
-				else:
-					path.lineTo(x, y)
 			
 			gradientPath.addPath(path)
 			if spanX > 0:
 				firstX = axesX + (self.totalSeconds(xs[0][0]) - minX) / spanX * (chartWidth + 0)
 			else:
 				firstX = axesX
+			last = path.currentPosition()
+			x = last.x()
+			y = last.y()
 			gradientPath.lineTo(x + 1, y)
 			gradientPath.lineTo(x + 1, axesY)
 			gradientPath.lineTo(firstX, axesY)
@@ -479,27 +450,7 @@ class ChartWidget(QWidget, chart.Chart):
 			painter.setPen(pen)
 			painter.setBrush(QBrush())
 
-			path = QPainterPath()
-			moveTo = True
-			for j in range(len(xs[i])):
-				# Check for break in data, resart lines
-				if ys[i][j] is False:
-					moveTo = True
-					continue
-
-				x = axesX + (self.totalSeconds(xs[i][j]) - minX) / spanX * chartWidth
-				if spanY > 0:
-					y = axesY - (ys[i][j] - minY) / spanY * chartHeight
-				else:
-					y = axesY
-
-				if moveTo:
-					path.moveTo(x, y)
-					moveTo = False
-				else:
-					path.lineTo(x, y)
-
-			painter.drawPath(path)
+			painter.drawPath(transform.map(paths[i]))
 		
 		# Draw a circle if one data point
 		# Note that no line will be drawn
@@ -613,9 +564,6 @@ class ChartWidget(QWidget, chart.Chart):
 				painter.drawConvexPolygon(QPolygonF([QPointF(x, y), QPointF(x + self.transactionSize * 2/3, y + self.transactionSize), QPointF(x - self.transactionSize * 2/3, y + self.transactionSize)]))
 				painter.setPen(QPen(Qt.white))
 				self.drawString("c", x, y + self.transactionSize * 2 / 3, 9, "center middle")
-
-		painter.end()
-		return
 	
 	def resizeEvent(self, event):
 		w = self.size().width()
@@ -0,0 +1,163 @@
+# Copyright (c) 2006-2010, Jesse Liesch
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the author nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE IMPLIED
+# DISCLAIMED. IN NO EVENT SHALL JESSE LIESCH BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+
+from transaction import *
+
+# SQLite julianday() of a date minus its Python ordinal
+julianOrdinalOffset = 1721424.5
+
+def textToDay(text):
+	'''Return the day number (date ordinal) of a "YYYY-MM-DD" or "YYYY-MM-DD HH:MM:SS" string'''
+	return datetime.date(int(text[0:4]), int(text[5:7]), int(text[8:10])).toordinal()
+
+def hasDayLayout(db, table):
+	'''Return True if table stores integer days instead of text dates'''
+	cursor = db.getConn().execute("pragma table_info(" + table + ")")
+	for row in cursor.fetchall():
+		if row["name"] == "day":
+			return True
+	return False
+
+def getDateColumn(db, table):
+	'''Return a DateColumn for the layout table is stored in'''
+	return DateColumn(hasDayLayout(db, table))
+
+class DateColumn:
+	'''Reads and writes the date column of a table in either layout.
+	
+	The text layout stores dates as "YYYY-MM-DD 00:00:00" in a date column of a rowid table
+	with a (ticker, date) index.  The day layout stores date ordinals in a day column of a
+	WITHOUT ROWID table clustered on (ticker, day).  Rows returned to callers always have a
+	datetime in "date".'''
+	def __init__(self, days = False):
+		self.days = days
+		if days:
+			self.name = "day"
+		else:
+			self.name = "date"
+	
+	def fields(self, fields):
+		'''Return checkTable fields for this layout'''
+		if not self.days:
+			return fields
+		ret = []
+		for f in fields:
+			if f["name"] == "date":
+				ret.append({"name": "day", "type": "integer not null"})
+			else:
+				ret.append(f)
+		return ret
+	
+	def index(self, index):
+		'''Return checkTable indexes for this layout.  Day tables are clustered and need none.'''
+		if self.days:
+			return []
+		return index
+	
+	def fromDate(self, date, endOfDay = False):
+		'''Return the stored value of a date.  Pass endOfDay for inclusive upper bounds.'''
+		if self.days:
+			return date.toordinal()
+		if endOfDay:
+			return "%d-%02d-%02d 23:59:59" % (date.year, date.month, date.day)
+		return "%d-%02d-%02d 00:00:00" % (date.year, date.month, date.day)
+	
+	def fromText(self, text):
+		'''Return the stored value of a date string'''
+		if self.days:
+			return textToDay(text)
+		return text
+	
+	def toDate(self, value):
+		'''Return a stored value as a datetime'''
+		if self.days:
+			return datetime.datetime.fromordinal(value)
+		return Transaction.parseDate(value)
+	
+	def toDay(self, value):
+		'''Return a stored value as a day number'''
+		if self.days:
+			return value
+		return textToDay(value)
+	
+	def toText(self, value):
+		'''Return a stored value as a "YYYY-MM-DD 00:00:00" string'''
+		if self.days:
+			return datetime.date.fromordinal(value).strftime("%Y-%m-%d 00:00:00")
+		return value
+	
+	def loadRow(self, row):
+		'''Replace the stored date of a row read from the database with a datetime'''
+		row["date"] = self.toDate(row.pop(self.name))
+		return row
+	
+	def saveRow(self, row):
+		'''Convert the "date" of a row to write from a string or datetime to the stored value'''
+		if self.days:
+			date = row.pop("date")
+			if isinstance(date, basestring):
+				row["day"] = textToDay(date)
+			else:
+				row["day"] = date.toordinal()
+		return row
+	
+	def saveRows(self, rows):
+		for row in rows:
+			self.saveRow(row)
+		return rows
+
+def migrateTable(db, table, fields):
+	'''Rebuild a text layout table in the day layout.  fields are the checkTable fields of the
+	text layout and must include ticker and date.  Rows without a ticker or date are dropped and
+	only the first row of each ticker and day is kept.  Return False if already migrated.'''
+	if hasDayLayout(db, table):
+		return False
+	
+	cols = []
+	create = "create table " + table + "Days (ticker text not null, day integer not null"
+	for f in fields:
+		if f["name"] in ["ticker", "date"]:
+			continue
+		cols.append(f["name"])
+		create += ", " + f["name"] + " " + f["type"]
+	create += ", primary key (ticker, day)) without rowid"
+	
+	copy = "insert or ignore into " + table + "Days (ticker, day"
+	for c in cols:
+		copy += ", " + c
+	copy += ") select ticker, cast(julianday(substr(date, 1, 10)) - %s as integer)" % julianOrdinalOffset
+	for c in cols:
+		copy += ", " + c
+	copy += " from " + table + " where ticker is not null and julianday(substr(date, 1, 10)) is not null order by ticker, date, rowid"
+	
+	db.beginTransaction()
+	db.query(create)
+	db.query(copy)
+	db.query("drop table " + table)
+	db.query("alter table " + table + "Days rename to " + table)
+	db.commitTransaction()
+	return True
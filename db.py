@@ -271,7 +271,27 @@ class Db:
 		insertStr += ")"
 
 		return self.query(insertStr, insertTuple)
-	
+
+	def insertMany(self, table, rows, ignore = False):
+		'''Insert a list of dictionaries with a single statement.  Every row must have the same keys.
+		If ignore is True rows that violate a unique index are skipped.'''
+		if not rows:
+			return
+		keys = rows[0].keys()
+		if ignore:
+			insertStr = "insert or ignore into "
+		else:
+			insertStr = "insert into "
+		insertStr += table + " (" + ", ".join(keys) + ") values ("
+		insertStr += ", ".join([self.getConnParam()] * len(keys)) + ")"
+
+		insertTuples = []
+		for row in rows:
+			insertTuples.append([row[key] for key in keys])
+
+		self.lastQuery = "%s (%d rows)" % (insertStr, len(rows))
+		return self.getConn().executemany(insertStr, insertTuples)
+
 	def update(self, table, data, where):
 		updateStr = "update " + table + " set "
 		updateTuple = []
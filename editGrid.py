@@ -39,35 +39,53 @@ class EditGridModel(QAbstractTableModel):
 		self.sortColumn = False
 		self.sortOrder = False
 		self.rowHeader = False
+		
+		# Optional functions that format typed cells, one per column
+		self.formats = False
+		
+		# Number of rows added each time the view scrolls to the end, False to show all rows
+		self.fetchSize = False
+		self.fetched = 0
+		
+		# Rows in their original order, the sort value of each row by column
+		# and the sorted rows by (column, order).  Cleared when the data changes.
+		self.unsortedRows = []
+		self.sortValues = {}
+		self.sortedRows = {}
 
-	# Sort based on column.  Warning: fancy python here.
 	@staticmethod
-	def mySortKey(*items):
-		i = items[0]
-		def g(obj):
-			val = obj[i]
-			if isinstance(val, str):
-				val = val.strip("$").strip("%").replace(",", "")
-				try:
-					val = float(val)
-				except:
-					pass
-			return val
-		return g
+	def sortValue(val):
+		'''Return the value a cell is sorted by.  Blank cells sort first and strings such as "$1,234" or "5%" sort as numbers.'''
+		if isinstance(val, basestring):
+			val = val.strip("$").strip("%").replace(",", "")
+			if val == "":
+				return (0, val)
+			try:
+				val = float(val)
+			except:
+				pass
+		return (1, val)
 
-	def setData(self, data, reset = True):
+	def setData(self, data, reset = True, formats = False):
+		'''Set the rows of the grid.  Cells are display strings or typed values, typed values are sorted by value.
+		formats is a list with a function for each column returning the display string of a typed value, or False.'''
 		self.myData = data
+		self.formats = formats
 
 		# Append the index of each element as the last value
 		i = 0
 		for row in self.myData:
 			row.append(i)
 			i += 1
+		self.unsortedRows = list(self.myData)
+		self.sortValues = {}
+		self.sortedRows = {}
 		
 		if self.sortColumn:
 			self.sort(self.sortColumn, self.sortOrder)
 		
 		if reset:
+			self.resetFetched()
 			self.reset()
 
 	def setColumns(self, columns):
@@ -80,8 +98,39 @@ class EditGridModel(QAbstractTableModel):
 		self.redGreenRows[row] = True
 	
 	def rowCount(self, parent = None):
+		if self.fetchSize:
+			return self.fetched
 		return len(self.myData)
 	
+	def resetFetched(self):
+		if self.fetchSize:
+			self.fetched = min(self.fetchSize, len(self.myData))
+	
+	def canFetchMore(self, parent):
+		return bool(self.fetchSize) and self.fetched < len(self.myData)
+	
+	def fetchMore(self, parent):
+		count = min(self.fetchSize, len(self.myData) - self.fetched)
+		if count <= 0:
+			return
+		self.beginInsertRows(QModelIndex(), self.fetched, self.fetched + count - 1)
+		self.fetched += count
+		self.endInsertRows()
+	
+	def fetchTo(self, row):
+		'''Make sure row is shown by the view'''
+		while row >= self.rowCount() and self.canFetchMore(QModelIndex()):
+			self.fetchMore(QModelIndex())
+	
+	def formatCell(self, row, column):
+		'''Return the display value of a cell'''
+		val = self.myData[row][column]
+		if self.formats and column < len(self.formats) and self.formats[column] and not isinstance(val, basestring):
+			return self.formats[column](val)
+		elif isinstance(val, datetime.datetime):
+			return val.strftime("%m/%d/%Y")
+		return val
+	
 	def columnCount(self, parent = None):
 		if self.rowHeader:
 			return len(self.myColumns) - 1
@@ -92,22 +141,22 @@ class EditGridModel(QAbstractTableModel):
 		self.sortColumn = column
 		self.sortOrder = order
 		
-		def myCmp(a, b):
-			if a == "":
-				return -1
-			elif b == "":
-				return 1
-			elif a < b:
-				return -1
-			elif a > b:
-				return 1
-			else:
-				return 0
-		
-		self.myData.sort(key = self.mySortKey(column), cmp = myCmp)
-		if order == Qt.DescendingOrder:
-			self.myData.reverse()
+		if not (column, order) in self.sortedRows:
+			if not column in self.sortValues:
+				values = []
+				for row in self.unsortedRows:
+					# The last element is the row number
+					if column < len(row) - 1:
+						values.append(self.sortValue(row[column]))
+					else:
+						values.append((0, ""))
+				self.sortValues[column] = values
+			
+			values = self.sortValues[column]
+			self.sortedRows[(column, order)] = sorted(self.unsortedRows, key = lambda row: values[row[-1]], reverse = order == Qt.DescendingOrder)
+		self.myData = list(self.sortedRows[(column, order)])
 			
+		self.resetFetched()
 		self.reset()
 
 	def headerData(self, col, orientation, role):
@@ -136,10 +185,11 @@ class EditGridModel(QAbstractTableModel):
 				d = self.myData[row]
 				if column < len(d):
 					val = d[column]
-					if val:
+					if val or isinstance(val, (int, float)):
 						# Try converting to float and return positive/negative
 						try:
-							val = val.replace('$', '').replace('%', '').replace(',', '')
+							if isinstance(val, basestring):
+								val = val.replace('$', '').replace('%', '').replace(',', '')
 							val = float(val)
 							if val >= 0:
 								return QVariant(appGlobal.getApp().positiveColor)
@@ -159,14 +209,8 @@ class EditGridModel(QAbstractTableModel):
 			if column in self.myTable.editColumns and row in self.myTable.editColumns[column]:
 				return QVariant()
 
-			d = self.myData[row]
-			if column < len(d):
-				# Return string depending on column
-				val = d[column]
-				if isinstance(val, datetime.datetime):
-					return QVariant(val.strftime("%m/%d/%Y"))
-				else:
-					return QVariant(val)
+			if column < len(self.myData[row]):
+				return QVariant(self.formatCell(row, column))
 		return QVariant()
 	
 	def dataChanged(self, editor, index):
@@ -230,6 +274,7 @@ class EditGrid(QTableView):
 		i = 0;
 		for row in self.model().myData:
 			if row[-1] == index:
+				self.model().fetchTo(i)
 				QTableView.selectRow(self, i)
 			i += 1
 	
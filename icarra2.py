@@ -405,7 +405,7 @@ class Icarra2(QApplication):
 		
 		# Initialize members
 		self.prefs = prefs
-		self.stockData = StockData()
+		self.stockData = StockData(prefs.getBinaryPrices())
 		self.ofxDebugFrame = False
 		self.portfolio = False
 		self.tool = False
@@ -870,6 +870,10 @@ class Icarra2(QApplication):
 		self.errorMutex.release()
 
 if __name__ == '__main__':
+	# The rebuild pool forks, so create it before Qt and the autoUpdater thread start
+	if prefs.getParallelRebuild():
+		startRebuildPool()
+	
 	if "--broker-info" in sys.argv:
 		app = Icarra2(sys.argv)
 	
@@ -939,6 +943,8 @@ if __name__ == '__main__':
 			app.exec_()
 		else:
 			app.quit()
+		stopRebuildPool()
 	except:
 		autoUpdater.stop()
+		stopRebuildPool()
 		raise
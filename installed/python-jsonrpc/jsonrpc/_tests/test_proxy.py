@@ -22,40 +22,135 @@
 import unittest
 import jsonrpc
 
-import urllib
+import gzip
+import time
+import socket
+import httplib
+import threading
+import BaseHTTPServer
+import SocketServer
 
 from StringIO import StringIO
 
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1
+
+    def do_POST(self):
+        server = self.server
+        server.postdata = self.rfile.read(int(self.headers["Content-Length"]))
+        server.connections.add(self.client_address)
+        server.posts += 1
+        if server.drop:
+            # Ran the call but the connection is lost before answering
+            self.close_connection = 1
+            return
+        time.sleep(server.delay)
+        respdata = server.respdata
+        self.send_response(200)
+        if server.gzip and "gzip" in self.headers.get("Accept-Encoding", ""):
+            buffer = StringIO()
+            file = gzip.GzipFile(fileobj=buffer, mode="wb")
+            file.write(respdata)
+            file.close()
+            respdata = buffer.getvalue()
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(respdata)))
+        self.end_headers()
+        self.wfile.write(respdata)
+        if server.closeIdle:
+            # Close the connection without telling the client, as idle servers do
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    # Kept alive connections must not block shutdown
+    daemon_threads = True
+
 class  TestProxy(unittest.TestCase):
 
-    def urlopen(self, url, data):
-        self.postdata = data
-        return StringIO(self.respdata) 
-    
     def setUp(self):
-        self.postdata=""
-        self.urllib_openurl = urllib.urlopen
-        urllib.urlopen = self.urlopen
-        
+        self.server = StandInServer(("127.0.0.1", 0), StandInHandler)
+        self.server.postdata = ""
+        self.server.respdata = ""
+        self.server.gzip = False
+        self.server.connections = set()
+        self.server.posts = 0
+        self.server.drop = False
+        self.server.delay = 0
+        self.server.closeIdle = False
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.url = "http://127.0.0.1:%d/" % self.server.server_address[1]
+
     def tearDown(self):
-        urllib.urlopen = self.urllib_openurl
+        self.server.shutdown()
+        self.server.server_close()
 
     def test_ProvidesProxyMethod(self):
-        s = jsonrpc.ServiceProxy("http://localhost/")
+        s = jsonrpc.ServiceProxy(self.url)
         self.assert_(callable(s.echo))
 
     def test_MethodCallCallsService(self):
         
-        s = jsonrpc.ServiceProxy("http://localhost/")
+        s = jsonrpc.ServiceProxy(self.url)
 
-        self.respdata='{"result":"foobar","error":null,"id":""}'
+        self.server.respdata='{"result":"foobar","error":null,"id":""}'
         echo = s.echo("foobar")
-        self.assertEquals(self.postdata, jsonrpc.dumps({"method":"echo", 'params':['foobar'], 'id':'jsonrpc'}))
+        self.assertEquals(jsonrpc.loads(self.server.postdata), {"method":"echo", 'params':['foobar'], 'id':'jsonrpc'})
         self.assertEquals(echo, 'foobar')
 
-        self.respdata='{"result":null,"error":"MethodNotFound","id":""}'
+        self.server.respdata='{"result":null,"error":"MethodNotFound","id":""}'
         try:
             s.echo("foobar")
         except jsonrpc.JSONRPCException,e:
             self.assertEquals(e.error, "MethodNotFound")
-            
\ No newline at end of file
+
+    def test_ReusesConnection(self):
+        s = jsonrpc.ServiceProxy(self.url)
+        self.server.respdata='{"result":"foobar","error":null,"id":""}'
+        for i in range(3):
+            self.assertEquals(s.echo("foobar"), 'foobar')
+            self.assertEquals(s.service.echo("foobar"), 'foobar')
+        self.assertEquals(len(self.server.connections), 1)
+
+    def test_GzipResponse(self):
+        s = jsonrpc.ServiceProxy(self.url)
+        self.server.gzip = True
+        self.server.respdata='{"result":"%s","error":null,"id":""}' % ("foobar" * 1000)
+        self.assertEquals(s.echo("foobar"), "foobar" * 1000)
+
+    def test_BundledCodec(self):
+        s = jsonrpc.ServiceProxy(self.url, codec=jsonrpc.json)
+        self.server.respdata='{"result":["foo", 1, 2.5],"error":null,"id":""}'
+        self.assertEquals(s.echo(u"f\u00f6\u00f6"), ["foo", 1, 2.5])
+        self.assertEquals(jsonrpc.loads(self.server.postdata.decode("utf-8"))["params"], [u"f\u00f6\u00f6"])
+
+    def test_RetriesDroppedKeepAlive(self):
+        s = jsonrpc.ServiceProxy(self.url)
+        self.server.respdata='{"result":"foobar","error":null,"id":""}'
+        self.server.closeIdle = True
+        for i in range(3):
+            self.assertEquals(s.echo("foobar"), 'foobar')
+            time.sleep(0.05)
+        self.assertEquals(self.server.posts, 3)
+
+    def test_NoRetryOnNewConnection(self):
+        s = jsonrpc.ServiceProxy(self.url)
+        self.server.drop = True
+        self.assertRaises(httplib.BadStatusLine, s.echo, "foobar")
+        self.assertEquals(self.server.posts, 1)
+
+    def test_NoRetryOnTimeout(self):
+        transport = jsonrpc.proxy.HTTPTransport(self.url)
+        s = jsonrpc.ServiceProxy(self.url, transport=transport)
+        self.server.respdata='{"result":"foobar","error":null,"id":""}'
+        self.assertEquals(s.echo("foobar"), 'foobar')
+        transport.getConnection().sock.settimeout(0.1)
+        self.server.delay = 0.3
+        self.assertRaises(socket.timeout, s.echo, "foobar")
+        time.sleep(0.4)
+        self.assertEquals(self.server.posts, 2)
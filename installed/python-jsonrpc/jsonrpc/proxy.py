@@ -19,31 +19,135 @@
   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 """
 
+from __future__ import absolute_import
+
+import errno
+import httplib
+import socket
+import threading
 import urllib
-from jsonrpc.json import dumps, loads
+import urlparse
+import zlib
+
+import jsonrpc.json
+
+# Use the fastest available codec, the bundled one is a fallback
+try:
+    import json as defaultCodec
+except ImportError:
+    try:
+        import simplejson as defaultCodec
+    except ImportError:
+        defaultCodec = jsonrpc.json
 
 class JSONRPCException(Exception):
     def __init__(self, rpcError):
         Exception.__init__(self)
         self.error = rpcError
-        
+
+class HTTPTransport(object):
+    """Posts requests to a service URL over persistent HTTP/1.1 connections.
+    Each thread has its own connection.  Responses may be gzip encoded."""
+
+    def __init__(self, serviceURL):
+        self.serviceURL = serviceURL
+        (scheme, netloc, path, query, fragment) = urlparse.urlsplit(serviceURL)
+        self.scheme = scheme
+        self.host = netloc
+        self.path = urlparse.urlunsplit(("", "", path or "/", query, ""))
+
+        # Honor proxies the same way urllib does
+        proxy = urllib.getproxies().get(scheme)
+        if proxy and scheme == "http" and not urllib.proxy_bypass(netloc.split(":")[0]):
+            self.host = urlparse.urlsplit(proxy)[1] or proxy
+            self.path = serviceURL
+
+        self.local = threading.local()
+
+    def getConnection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            if self.scheme == "https":
+                connection = httplib.HTTPSConnection(self.host)
+            else:
+                connection = httplib.HTTPConnection(self.host)
+            self.local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    def isDroppedConnection(self, e):
+        """Return True if e means the server closed the connection without answering"""
+        if isinstance(e, httplib.BadStatusLine):
+            return True
+        if isinstance(e, socket.timeout):
+            return False
+        return isinstance(e, socket.error) and e.errno in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+    def post(self, postdata):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip",
+            "Connection": "keep-alive"}
+
+        # Servers drop idle keep-alive connections.  The request is sent again
+        # on a new connection only if a reused connection was closed before any
+        # response arrived, otherwise the call may already have run.
+        connection = self.getConnection()
+        reused = connection.sock is not None
+        try:
+            connection.request("POST", self.path, postdata, headers)
+            response = connection.getresponse()
+        except (httplib.HTTPException, socket.error), e:
+            self.close()
+            if not reused or not self.isDroppedConnection(e):
+                raise
+            connection = self.getConnection()
+            try:
+                connection.request("POST", self.path, postdata, headers)
+                response = connection.getresponse()
+            except:
+                self.close()
+                raise
+
+        try:
+            respdata = response.read()
+        except:
+            self.close()
+            raise
+
+        if response.will_close:
+            self.close()
+
+        if response.getheader("content-encoding", "").lower() == "gzip":
+            respdata = zlib.decompress(respdata, 16 + zlib.MAX_WBITS)
+        return respdata
+
 class ServiceProxy(object):
-    def __init__(self, serviceURL, serviceName=None):
+    def __init__(self, serviceURL, serviceName=None, codec=None, transport=None):
+        """codec is any module or object with dumps and loads functions,
+        by default the fastest available JSON module is used."""
         self.__serviceURL = serviceURL
         self.__serviceName = serviceName
+        self.__codec = codec or defaultCodec
+        self.__transport = transport or HTTPTransport(serviceURL)
 
     def __getattr__(self, name):
         if self.__serviceName != None:
             name = "%s.%s" % (self.__serviceName, name)
-        return ServiceProxy(self.__serviceURL, name)
+        return ServiceProxy(self.__serviceURL, name, self.__codec, self.__transport)
 
     def __call__(self, *args):
-         postdata = dumps({"method": self.__serviceName, 'params': args, 'id':'jsonrpc'})
-         respdata = urllib.urlopen(self.__serviceURL, postdata).read()
-         resp = loads(respdata)
+         postdata = self.__codec.dumps({"method": self.__serviceName, 'params': args, 'id':'jsonrpc'})
+         if isinstance(postdata, unicode):
+             postdata = postdata.encode("utf-8")
+         respdata = self.__transport.post(postdata)
+         resp = self.__codec.loads(respdata)
          if resp['error'] != None:
              raise JSONRPCException(resp['error'])
          else:
              return resp['result']
-         
-
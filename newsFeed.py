@@ -0,0 +1,184 @@
+# Copyright (c) 2006-2010, Jesse Liesch
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the author nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE IMPLIED
+# DISCLAIMED. IN NO EVENT SHALL JESSE LIESCH BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# News feeds are downloaded by a bounded pool of threads.  The ETag and Last-Modified
+# values of each ticker's feed are kept so unchanged feeds are answered with a 304.
+import threading
+import Queue
+import feedparser
+
+# Headline feed for a ticker
+newsUrl = "http://finance.yahoo.com/rss/headline?s=%s"
+
+# Number of feeds downloaded at once
+newsThreads = 32
+
+def parseNewsEntry(ticker, e):
+	'''Return a stockNews row for a feedparser entry'''
+	d = e.updated_parsed
+	date = "%04d-%02d-%02d %02d:%02d:%02d" % (d.tm_year, d.tm_mon, d.tm_mday, d.tm_hour, d.tm_min, d.tm_sec)
+
+	# Get link, take from xxx*http if presesnt
+	url = e.link
+	url = url.replace("%3A", ":")
+	h = url.find('*http')
+	if h != -1:
+		url = url[h + 1:]
+
+	return {
+		"ticker": ticker,
+		"date": date,
+		"title": unicode(e.title),
+		"summary": unicode(e.summary),
+		"url": unicode(url)}
+
+def fetchNews(tickers, feeds = {}, url = newsUrl, threads = newsThreads):
+	'''Download the news feed of every ticker concurrently.
+	
+	feeds is a dictionary of (etag, modified) indexed by ticker from earlier downloads.
+	Yields (ticker, rows, etag, modified) in the order feeds finish.  rows is a list of
+	stockNews rows, empty if the feed has not changed or could not be downloaded.
+	Closing the generator stops downloads that have not started.
+	
+	'''
+	pending = Queue.Queue()
+	for ticker in tickers:
+		pending.put(ticker)
+	results = Queue.Queue()
+	stopped = threading.Event()
+	
+	def download():
+		while not stopped.isSet():
+			try:
+				ticker = pending.get_nowait()
+			except Queue.Empty:
+				return
+			(etag, modified) = feeds.get(ticker, (None, None))
+			rows = []
+			try:
+				d = feedparser.parse(url % ticker, etag = etag, modified = modified)
+				for e in d.entries:
+					if e.get("updated_parsed"):
+						rows.append(parseNewsEntry(ticker, e))
+				etag = d.get("etag") or etag
+				modified = d.get("modified") or modified
+			except Exception, e:
+				print "could not get news for", ticker, e
+			results.put((ticker, rows, etag, modified))
+	
+	for i in range(min(threads, len(tickers))):
+		thread = threading.Thread(target = download, name = "news %d" % i)
+		thread.setDaemon(True)
+		thread.start()
+	
+	try:
+		for i in range(len(tickers)):
+			yield results.get()
+	finally:
+		stopped.set()
+
+if __name__ == "__main__":
+	import time
+	import email.utils
+	import BaseHTTPServer
+	import SocketServer
+	
+	# Every feed is quick except one
+	tickers = ["T%d" % i for i in range(60)]
+	delays = dict([(ticker, 0.05) for ticker in tickers])
+	delays["T7"] = 0.5
+	lastModified = email.utils.formatdate(time.time() - 3600, usegmt = True)
+	requests = []
+	
+	class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+		def do_GET(self):
+			ticker = self.path.split("=")[1]
+			etag = '"%s-1"' % ticker
+			requests.append((ticker, self.headers.get("If-None-Match"), self.headers.get("If-Modified-Since")))
+			time.sleep(delays[ticker])
+			if self.headers.get("If-None-Match") == etag:
+				self.send_response(304)
+				self.end_headers()
+				return
+			
+			items = ""
+			for i in range(20):
+				items += "<item><title>%s story %d</title><link>http://news.example.com/%s/%d</link><description>Summary %d</description><pubDate>Mon, %02d Jan 2010 12:00:00 GMT</pubDate></item>" % (ticker, i, ticker, i, i, i + 1)
+			body = "<?xml version=\"1.0\"?><rss version=\"2.0\"><channel><title>%s</title>%s</channel></rss>" % (ticker, items)
+			self.send_response(200)
+			self.send_header("Content-Type", "application/rss+xml")
+			self.send_header("ETag", etag)
+			self.send_header("Last-Modified", lastModified)
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+		
+		def log_message(self, *args):
+			pass
+	
+	class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+		daemon_threads = True
+		request_queue_size = 64
+	
+	server = StandInServer(("127.0.0.1", 0), StandInHandler)
+	thread = threading.Thread(target = server.serve_forever)
+	thread.setDaemon(True)
+	thread.start()
+	url = "http://127.0.0.1:%d/rss?s=%%s" % server.server_address[1]
+	
+	print "test1 - concurrent download"
+	start = time.time()
+	feeds = {}
+	rows = []
+	for (ticker, tickerRows, etag, modified) in fetchNews(tickers, url = url):
+		feeds[ticker] = (etag, modified)
+		rows += tickerRows
+	elapsed = time.time() - start
+	print "  %d feeds in %.2fs, slowest feed %.2fs, serial %.2fs" % (len(tickers), elapsed, max(delays.values()), sum(delays.values()))
+	assert elapsed < sum(delays.values()) / 2
+	assert len(rows) == 20 * len(tickers)
+	assert rows[0]["url"].startswith("http://news.example.com/") and rows[0]["date"].startswith("2010-01-")
+	assert feeds["T3"][0] == '"T3-1"' and tuple(feeds["T3"][1][:6]) == email.utils.parsedate(lastModified)[:6]
+	
+	print "test2 - conditional requests"
+	del requests[:]
+	results = list(fetchNews(tickers, feeds, url = url))
+	assert len(results) == len(tickers)
+	for (ticker, tickerRows, etag, modified) in results:
+		assert tickerRows == []
+		assert (etag, modified) == feeds[ticker]
+	for (ticker, ifNoneMatch, ifModifiedSince) in requests:
+		assert ifNoneMatch == '"%s-1"' % ticker
+		assert ifModifiedSince == lastModified
+	
+	print "test3 - closing stops downloads"
+	del requests[:]
+	news = fetchNews(tickers, url = url, threads = 2)
+	news.next()
+	news.close()
+	time.sleep(0.2)
+	assert len(requests) < len(tickers)
+	
+	server.shutdown()
@@ -24,6 +24,7 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import datetime
+import threading
 import httplib, urllib2, re
 
 ofxErrors = {
@@ -32,6 +33,10 @@ ofxErrors = {
 	15500: "Signon invalid"
 }
 
+# Incremental downloads start this far before an account's watermark
+# so transactions that post late are still picked up
+ofxOverlap = datetime.timedelta(days = 7)
+
 from brokerage import *
 import appGlobal
 
@@ -50,7 +55,7 @@ def logOfx(ofx, input):
 	
 	# Log
 	app = appGlobal.getApp()
-	if app.ofxDebugFrame:
+	if app and app.ofxDebugFrame:
 		app.ofxDebugFrame.add(ofx, input)
 
 def generateOfxHeader():
@@ -69,10 +74,11 @@ def generateInvestRequest(accountId, b, dtstart = False, dtend = False):
 		ret += "<ACCTID>" + str(accountId) + "\n"
 	ret += "</INVACCTFROM>\n<INCTRAN>\n"
 	if dtstart:
-		#ret += "<DTSTART>" + dtstart.strftime("%Y%m%d%H%M%S") + "\n"
-		ret += "<DTEND>" + dtend.strftime("%Y%m%d%H%M%S") + "\n"
+		ret += "<DTSTART>" + dtstart.strftime("%Y%m%d") + "\n"
 	else:
 		ret += "<DTSTART>19000101\n"
+	if dtend:
+		ret += "<DTEND>" + dtend.strftime("%Y%m%d%H%M%S") + "\n"
 	ret += "<INCLUDE>Y\n</INCTRAN>\n<INCOO>Y\n<INCPOS>\n<DTASOF>" + generateDate() + "\n"
 	ret += "<INCLUDE>Y\n</INCPOS>\n<INCBAL>Y\n</INVSTMTRQ>\n</INVSTMTTRNRQ>\n</INVSTMTMSGSRQV1>\n"
 	return ret
@@ -174,7 +180,45 @@ def getAccount(username, password, b):
 		print result
 		return (False, "Account not found")
 
-def getOfx(username, password, brokerage, account, status = False):
+def isOfxResponse(response):
+	'''Return True if response is OFX data rather than an error string from queryServer'''
+	return response.find("<OFX>") != -1
+
+def getOfxAccounts(username, password, brokerage, account, watermarks = {}):
+	'''Download transactions for every account in the comma separated account string.
+	
+	Accounts are downloaded concurrently.  If watermarks maps an account to the date it was last imported only transactions since that date (less ofxOverlap) are requested, otherwise the full history is requested.
+	
+	Returns a list of (account, response) tuples in the order the accounts were given.  A response is either OFX data or an error string.
+	
+	'''
+	accounts = [a.strip() for a in account.split(",") if a.strip()]
+	responses = [""] * len(accounts)
+	
+	def download(i):
+		dtstart = False
+		if accounts[i] in watermarks:
+			dtstart = watermarks[accounts[i]] - ofxOverlap
+		query = generateOfxHeader() + generateSignon(username, password, brokerage) + generateInvestRequest(accounts[i], brokerage, dtstart) + generateOfxFooter()
+		try:
+			responses[i] = queryServer(brokerage.getUrl(), query)
+		except Exception, e:
+			print "OFX download failed for account", accounts[i], e
+
+	if len(accounts) == 1:
+		download(0)
+	else:
+		threads = []
+		for i in range(len(accounts)):
+			thread = threading.Thread(target = download, args = (i,), name = "ofx %d" % i)
+			thread.start()
+			threads.append(thread)
+		for thread in threads:
+			thread.join()
+
+	return zip(accounts, responses)
+
+def getOfx(username, password, brokerage, account, status = False, watermarks = {}):
 	if account == "" or not account:
 		return ""
 	
@@ -182,11 +226,84 @@ def getOfx(username, password, brokerage, account, status = False):
 		status.setStatus("Downloading transaction history", 20)
 	
 	# Download for every account specified
-	accounts = account.split(",")
 	response = ""
-	for a in accounts:
-		a.strip()
-		query = generateOfxHeader() + generateSignon(username, password, brokerage) + generateInvestRequest(a, brokerage) + generateOfxFooter()
-		response += queryServer(brokerage.getUrl(), query)
+	for a, accountResponse in getOfxAccounts(username, password, brokerage, account, watermarks):
+		response += accountResponse
 
 	return response	
+
+if __name__ == "__main__":
+	import time
+	import BaseHTTPServer
+	import SocketServer
+	
+	# One transaction per account per day for three years
+	first = datetime.date.today() - datetime.timedelta(days = 3 * 365)
+	history = [first + datetime.timedelta(days = i) for i in range(3 * 365 + 1)]
+	requests = []
+	
+	class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+		def do_POST(self):
+			query = self.rfile.read(int(self.headers["Content-Length"]))
+			account = re.search("<ACCTID>([^\r\n<]*)", query).group(1)
+			dtstart = re.search("<DTSTART>([0-9]{8})", query).group(1)
+			requests.append((account, dtstart))
+			
+			# Simulate a slow brokerage
+			time.sleep(0.2)
+			response = generateOfxHeader() + "<SIGNONMSGSRSV1>\n<SONRS>\n<STATUS>\n<CODE>0\n</STATUS>\n</SONRS>\n</SIGNONMSGSRSV1>\n<ACCTID>" + account + "\n"
+			for date in history:
+				if date.strftime("%Y%m%d") >= dtstart:
+					response += "<BUYSTOCK><DTTRADE>" + date.strftime("%Y%m%d") + "</BUYSTOCK>\n"
+			response += generateOfxFooter()
+			self.send_response(200)
+			self.send_header("Content-Length", str(len(response)))
+			self.end_headers()
+			self.wfile.write(response)
+		
+		def log_message(self, *args):
+			pass
+	
+	class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+		daemon_threads = True
+	
+	class StandInBrokerage(BrokerageBase):
+		def getUrl(self):
+			return "http://127.0.0.1:%d/" % server.server_address[1]
+	
+	server = StandInServer(("127.0.0.1", 0), StandInHandler)
+	thread = threading.Thread(target = server.serve_forever)
+	thread.setDaemon(True)
+	thread.start()
+	b = StandInBrokerage()
+	
+	print "test1 - full history"
+	start = time.time()
+	results = getOfxAccounts("user", "pass", b, "A1, A2,A3")
+	elapsed = time.time() - start
+	assert [a for a, r in results] == ["A1", "A2", "A3"]
+	for a, r in results:
+		assert isOfxResponse(r)
+		assert r.find("<ACCTID>" + a) != -1
+		assert r.count("<BUYSTOCK>") == len(history)
+	assert sorted(requests) == [("A1", "19000101"), ("A2", "19000101"), ("A3", "19000101")]
+	print "  3 accounts in %.2fs" % elapsed
+	assert elapsed < 0.5
+	
+	print "test2 - incremental from watermarks"
+	del requests[:]
+	yesterday = datetime.date.today() - datetime.timedelta(days = 1)
+	results = getOfxAccounts("user", "pass", b, "A1,A2", {"A1": yesterday})
+	dtstart = (yesterday - ofxOverlap).strftime("%Y%m%d")
+	assert sorted(requests) == [("A1", dtstart), ("A2", "19000101")]
+	full = len(results[1][1])
+	incremental = len(results[0][1])
+	assert results[0][1].count("<BUYSTOCK>") == ofxOverlap.days + 2
+	print "  %d bytes instead of %d" % (incremental, full)
+	
+	print "test3 - getOfx concatenates in account order"
+	ofx = getOfx("user", "pass", b, "A2,A1", watermarks = {"A1": yesterday, "A2": yesterday})
+	assert ofx.find("<ACCTID>A2") < ofx.find("<ACCTID>A1")
+	assert not isOfxResponse(getOfx("user", "pass", b, ""))
+	
+	server.shutdown()
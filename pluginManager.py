@@ -1,90 +1,221 @@
 import sys
 import glob
+import ast
+import json
+import threading
 
 from prefs import *
 import appGlobal
 
+# Bump when the layout of the manifest file changes
+manifestVersion = 1
+
+# Serializes importing and initializing modules from different threads
+loadLock = threading.RLock()
+
+def readManifest(file, className, baseName, defaults):
+	'''Read the return values of the methods in defaults from className in file without
+	importing it.  Every method must return a literal or be inherited from baseName, in
+	which case its value from defaults is used.  Returns None if any value can not be
+	determined statically.'''
+	try:
+		f = open(file)
+		tree = ast.parse(f.read(), file)
+		f.close()
+	except Exception:
+		return None
+
+	for node in tree.body:
+		if isinstance(node, ast.ClassDef) and node.name == className:
+			break
+	else:
+		return None
+	bases = [b.id for b in node.bases if isinstance(b, ast.Name)]
+	if bases != [baseName] or len(node.bases) != 1:
+		return None
+
+	info = dict(defaults)
+	for item in node.body:
+		if not isinstance(item, ast.FunctionDef) or not item.name in defaults:
+			continue
+		del info[item.name]
+		body = [s for s in item.body if not (isinstance(s, ast.Expr) and isinstance(s.value, ast.Str))]
+		if len(body) != 1 or not isinstance(body[0], ast.Return) or not body[0].value:
+			return None
+		try:
+			info[item.name] = ast.literal_eval(body[0].value)
+		except ValueError:
+			return None
+	return info
+
+def importModule(module):
+	__import__(module)
+	return sys.modules[module]
+
+class LazyModule:
+	'''Stands in for a plugin or brokerage until it is first used.  Values recorded in
+	the manifest are answered without importing the module, any other attribute imports
+	it and is passed on to the real object.'''
+	def __init__(self, module, info, builtin, instance = None):
+		self.module = module
+		self.info = info
+		self.builtin = builtin
+		self.instance = instance
+		self.loaded = False
+
+	def isLoaded(self):
+		return self.loaded
+
+	def create(self, module):
+		'''Return a new instance of the object defined in module'''
+		pass
+
+	def prepare(self, instance):
+		'''Called once before the object is first used'''
+		pass
+
+	def load(self):
+		loadLock.acquire()
+		try:
+			if not self.loaded:
+				if not self.instance:
+					self.instance = self.create(importModule(self.module))
+				self.instance.builtin = self.builtin
+				self.prepare(self.instance)
+				self.loaded = True
+		finally:
+			loadLock.release()
+		return self.instance
+
+	def __getattr__(self, attr):
+		# Do not import for special methods such as __nonzero__
+		if attr.startswith("__"):
+			raise AttributeError(attr)
+		return getattr(self.load(), attr)
+
+class LazyPlugin(LazyModule):
+	manifestClass = "Plugin"
+	manifestBase = "PluginBase"
+	manifestDefaults = {"name": None, "forInvestment": True, "forBank": True}
+
+	def name(self):
+		return self.info["name"]
+
+	def forInvestment(self):
+		return self.info["forInvestment"]
+
+	def forBank(self):
+		return self.info["forBank"]
+
+	def create(self, module):
+		return module.Plugin()
+
+	def prepare(self, instance):
+		instance.initialize()
+
+class LazyBrokerage(LazyModule):
+	manifestClass = "Brokerage"
+	manifestBase = "BrokerageBase"
+	manifestDefaults = {"getName": "", "getOrg": "", "getFid": ""}
+
+	def getName(self):
+		return self.info["getName"]
+
+	def getOrg(self):
+		return self.info["getOrg"]
+
+	def getFid(self):
+		return self.info["getFid"]
+
+	def create(self, module):
+		return module.Brokerage()
+
 class PluginManager:
+	'''Keeps track of all plugins and brokerages.  Modules are listed in a manifest
+	cached in the prefs directory and are only imported when first used.'''
 	def __init__(self):
 		self.plugins = {}
 		self.brokerages = {}
 
-		# Load all plugins in user plugins path
 		prefsRoot = Prefs.prefsRootPath()
-		sys.path.append(prefsRoot + 'plugins')
-		path = os.path.join(prefsRoot, "plugins/plugin_*.py")
-		for file in glob.glob(path):
-			plugin = file.replace(prefsRoot + 'plugins', '')
-			plugin = plugin.replace('/', '')
-			plugin = plugin.replace('\\', '')
-			plugin = plugin.replace('.py', '')
-			__import__(plugin)
-			self.plugins[plugin] = sys.modules[plugin].Plugin()
-			self.plugins[plugin].builtin = False
-
-		# Load all plugins in builtin path
+		userPath = os.path.join(prefsRoot, 'plugins')
 		pluginPath = os.path.join(appGlobal.getPath(), 'builtinPlugins')
+		sys.path.append(userPath)
 		sys.path.append(pluginPath)
-		for file in glob.glob(pluginPath + '/plugin_*.py'):
-			plugin = os.path.basename(file)
-			plugin = plugin.replace('/', '')
-			plugin = plugin.replace('\\', '')
-			plugin = plugin.replace('.py', '')
-			__import__(plugin)
-			self.plugins[plugin] = sys.modules[plugin].Plugin()
-			self.plugins[plugin].builtin = True
-
-		# Check for duplicate names
-		names = {}
-		for p, plugin in self.plugins.items():
-			if plugin.name() in names:
-				print "Duplicate plugin name", plugin.name()
-				sys.exit()
-			names[plugin.name()] = True
 
-		for p, plugin in self.plugins.items():
-			plugin.initialize()
+		self.manifestPath = os.path.join(prefsRoot, 'pluginManifest.json')
+		self.loadManifest()
+		oldManifest = self.manifest
+		self.manifest = {}
 
-		# Check for duplicate names
-		names = {}
-		for p, plugin in self.plugins.items():
-			if plugin.name() in names:
-				print "Duplicate plugin name", plugin.name()
-				sys.exit()
-			names[plugin.name()] = True
-		
-		# Load all brokerages in user plugins path
-		path = os.path.join(prefsRoot, "plugins/brokerage_*.py")
-		for file in glob.glob(path):
-			brokerage = file.replace(prefsRoot + 'plugins', '')
-			brokerage = brokerage.replace('/', '')
-			brokerage = brokerage.replace('\\', '')
-			brokerage = brokerage.replace('.py', '')
-			__import__(brokerage)
-			self.brokerages[brokerage] = sys.modules[brokerage].Brokerage()
-			self.brokerages[brokerage].builtin = False
-
-		# Load all brokerages in builtin path
-		for file in glob.glob('builtinPlugins/brokerage_*.py'):
-			brokerage = file.replace('builtinPlugins', '')
-			brokerage = brokerage.replace('/', '')
-			brokerage = brokerage.replace('\\', '')
-			brokerage = brokerage.replace('.py', '')
-			__import__(brokerage)
-			self.brokerages[brokerage] = sys.modules[brokerage].Brokerage()
-			self.brokerages[brokerage].builtin = True
-
-		# Check for duplicate names
-		names = {}
-		for b, brokerage in self.brokerages.items():
-			if brokerage.getName() in names:
-				print "Duplicate brokerage name", brokerage.getName()
-				sys.exit()
-			names[brokerage.getName()] = True
+		# User plugins and brokerages take precedence over builtin ones
+		self.scan(self.plugins, os.path.join(userPath, 'plugin_*.py'), LazyPlugin, False, oldManifest)
+		self.scan(self.plugins, os.path.join(pluginPath, 'plugin_*.py'), LazyPlugin, True, oldManifest)
+		self.scan(self.brokerages, os.path.join(userPath, 'brokerage_*.py'), LazyBrokerage, False, oldManifest)
+		self.scan(self.brokerages, os.path.join(pluginPath, 'brokerage_*.py'), LazyBrokerage, True, oldManifest)
+
+		if self.manifest != oldManifest:
+			self.saveManifest()
+
+		self.checkDuplicates(self.plugins, "plugin", lambda p: p.name())
+		self.checkDuplicates(self.brokerages, "brokerage", lambda b: b.getName())
 
 	def __del__(self):
 		for p in self.plugins:
-			self.plugins[p].finalize()
+			if self.plugins[p].isLoaded():
+				self.plugins[p].finalize()
+
+	def loadManifest(self):
+		self.manifest = {}
+		try:
+			f = open(self.manifestPath)
+			data = json.load(f)
+			f.close()
+			if data.get("version") == manifestVersion:
+				self.manifest = data["files"]
+		except Exception:
+			pass
+
+	def saveManifest(self):
+		try:
+			f = open(self.manifestPath, "w")
+			json.dump({"version": manifestVersion, "files": self.manifest}, f)
+			f.close()
+		except Exception, e:
+			print "Could not save plugin manifest", e
+
+	def scan(self, modules, pattern, lazyClass, builtin, oldManifest):
+		'''Add a lazyClass for every file matching pattern.  Manifest entries are reused
+		if the file has not been modified, otherwise the file is read again.'''
+		for file in glob.glob(pattern):
+			module = os.path.splitext(os.path.basename(file))[0]
+			if module in modules:
+				continue
+			mtime = os.path.getmtime(file)
+			instance = None
+
+			entry = oldManifest.get(file)
+			if not entry or entry["mtime"] != mtime:
+				info = readManifest(file, lazyClass.manifestClass, lazyClass.manifestBase, lazyClass.manifestDefaults)
+				if info is None:
+					# Not readable statically, import it to ask
+					instance = lazyClass(module, {}, builtin).create(importModule(module))
+					info = {}
+					for method in lazyClass.manifestDefaults:
+						info[method] = getattr(instance, method)()
+				entry = {"mtime": mtime, "info": info}
+
+			self.manifest[file] = entry
+			modules[module] = lazyClass(module, entry["info"], builtin, instance)
+
+	def checkDuplicates(self, modules, kind, getName):
+		names = {}
+		for m, module in modules.items():
+			name = getName(module)
+			if name in names:
+				print "Duplicate " + kind + " name", name
+				sys.exit()
+			names[name] = True
 
 	def isPlugin(self, name):
 		for p, plugin in self.plugins.items():
@@ -110,8 +241,8 @@ class PluginManager:
 		return ret
 	
 	def isBrokerage(self, name):
-		for p, brokerage in self.brokeragess.items():
-			if brokerage.name == name:
+		for p, brokerage in self.brokerages.items():
+			if brokerage.getName() == name:
 				return True
 		return False
 
@@ -131,4 +262,3 @@ class PluginManager:
 		for n in names:
 			ret.append(self.brokerages[n])
 		return ret
-
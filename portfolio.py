@@ -29,6 +29,11 @@ from fileFormats import *
 from userprice import *
 from positionCheck import *
 from twrr import *
+from positionRebuild import *
+from positionReconcile import *
+from benchmarkRebuild import *
+from dayStorage import *
+from ruleMatcher import *
 import irr
 
 import prefs
@@ -38,28 +43,22 @@ try:
 except:
 	haveAutoUpdater = False
 import chart
+try:
+	import multiprocessing
+	haveMultiprocessing = True
+except:
+	haveMultiprocessing = False
 
+import sys
 import time
 import datetime
 import os
 import copy
 import operator
 import uuid
-
-def floatCompare(a, b):
-	'''Return the ratio of two floating point numbers.  Return value is always greater than 0 unless both numbers are 0 in which case this function returns 0.'''
-	if a > b:
-		num = a
-		den = b
-	else:
-		num = b
-		den = a
-	if num == 0 and den == 0:
-		return 0
-	elif den == 0:
-		return 1e9
-	else:
-		return num / den
+import bisect
+import collections
+import threading
 
 class TransactionErrorCheck:
 	'''Implements a detected error for one transaction'''
@@ -100,6 +99,7 @@ class PortfolioPrefs(prefs.Prefs):
 		prefs.Prefs.__init__(self, db)
 		
 		self.checkDefaults("dirty", "True")
+		self.checkDefaults("lastRebuild", "")
 		self.checkDefaults("positionIncSplits", "False")
 		self.checkDefaults("positionIncDividends", "True")
 		self.checkDefaults("positionIncFees", "False")
@@ -109,6 +109,7 @@ class PortfolioPrefs(prefs.Prefs):
 		self.checkDefaults("performanceCurrent", "False")
 		self.checkDefaults("performanceDividends", "True")
 		self.checkDefaults("lastImport", "ofx")
+		self.checkDefaults("ofxWatermarks", "")
 		self.checkDefaults("combinedComponents", "")
 		self.checkDefaults("brokerage", "False")
 		self.checkDefaults("sync", "")
@@ -116,6 +117,7 @@ class PortfolioPrefs(prefs.Prefs):
 		self.checkDefaults("autoSplit", "False")
 		self.checkDefaults("autoDividend", "False")
 		self.checkDefaults("autoDividendReinvest", "False")
+		self.checkDefaults("benchmarkRebalance", rebalanceYearly)
 
 	def getTransactionId(self):
 		'''Return a random transaction id'''
@@ -125,6 +127,10 @@ class PortfolioPrefs(prefs.Prefs):
 		'''Return True if this portfolio is dirty (needs to be rebuilt)'''
 		return self.getPreference("dirty") == "True"
 
+	def getLastRebuild(self):
+		'''Return the time this portfolio was last rebuilt as a string.  Empty if never rebuilt.'''
+		return self.getPreference("lastRebuild")
+
 	def getPositionIncSplits(self):
 		'''Return True if the chart should include split adjusted returns'''
 		return self.getPreference("positionIncSplits") == "True"
@@ -161,6 +167,15 @@ class PortfolioPrefs(prefs.Prefs):
 		'''Return the datetime of the last transaction import'''
 		return self.getPreference("lastImport")
 
+	def getOfxWatermarks(self):
+		'''Return a dictionary mapping each OFX account to the date of its last successful import'''
+		watermarks = {}
+		for item in self.getPreference("ofxWatermarks").split(","):
+			if "=" in item:
+				(account, date) = item.rsplit("=", 1)
+				watermarks[account] = datetime.datetime.strptime(date, "%Y-%m-%d").date()
+		return watermarks
+
 	def getCombinedComponents(self):
 		'''Return the sub-portfolios for a combined portfolio'''
 		if not self.getPreference("combinedComponents"):
@@ -197,10 +212,21 @@ class PortfolioPrefs(prefs.Prefs):
 		'''Return True if this portfolio should automatically reinvest dividends'''
 		return self.getPreference("autoDividendReinvest") == "True"
 
+	def getBenchmarkRebalance(self):
+		'''Return how often a benchmark portfolio is rebalanced: never, monthly, quarterly or yearly'''
+		return self.getPreference("benchmarkRebalance")
+
 	def setDirty(self, dirty):
 		self.db.beginTransaction()
 		self.db.update("prefs", {"value": dirty}, {"name": "dirty"})
 		self.db.commitTransaction()
+		clearChartCache()
+
+	def setLastRebuild(self):
+		self.db.beginTransaction()
+		self.db.update("prefs", {"value": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")}, {"name": "lastRebuild"})
+		self.db.commitTransaction()
+		clearChartCache()
 
 	def setPositionIncSplits(self, inc):
 		self.db.beginTransaction()
@@ -247,6 +273,12 @@ class PortfolioPrefs(prefs.Prefs):
 		self.db.update("prefs", {"value": value}, {"name": "lastImport"})
 		self.db.commitTransaction()
 
+	def setOfxWatermarks(self, watermarks):
+		value = ",".join(["%s=%s" % (account, watermarks[account].strftime("%Y-%m-%d")) for account in sorted(watermarks)])
+		self.db.beginTransaction()
+		self.db.update("prefs", {"value": value}, {"name": "ofxWatermarks"})
+		self.db.commitTransaction()
+
 	def setCombinedComponents(self, value):
 		self.db.beginTransaction()
 		self.db.update("prefs", {"value": value}, {"name": "combinedComponents"})
@@ -287,6 +319,229 @@ class PortfolioPrefs(prefs.Prefs):
 		self.db.update("prefs", {"value": value}, {"name": "autoDividendReinvest"})
 		self.db.commitTransaction()
 
+	def setBenchmarkRebalance(self, value):
+		self.db.beginTransaction()
+		self.db.update("prefs", {"value": value}, {"name": "benchmarkRebalance"})
+		self.db.commitTransaction()
+
+# Daily value and returns of each position.  See dayStorage for the optional integer day layout.
+positionHistoryFields = [
+	{"name": "date", "type": "datetime"},
+	{"name": "ticker", "type": "text"},
+	{"name": "shares", "type": "float"},
+	{"name": "options", "type": "float"},
+	{"name": "value", "type": "float"},
+	{"name": "normSplit", "type": "float"},
+	{"name": "normDividend", "type": "float"},
+	{"name": "normFee", "type": "float"},
+	{"name": "profitSplit", "type": "float"},
+	{"name": "profitDividend", "type": "float"},
+	{"name": "profitFee", "type": "float"}]
+
+def migratePositionsToDays(db):
+	'''Convert the positionHistory table of a portfolio database to the integer day layout.  Return True if it changed.'''
+	return migrateTable(db, "positionHistory", positionHistoryFields)
+
+# Latest row of each ticker in positionHistory, maintained by updateCurrentPositions
+currentPositionsFields = [
+	{"name": "ticker", "type": "text"},
+	{"name": "date", "type": "datetime"},
+	{"name": "shares", "type": "float"},
+	{"name": "value", "type": "float"},
+	{"name": "price", "type": "float"},
+	{"name": "weight", "type": "float"}]
+
+# Process pool shared by every rebuild, see startRebuildPool
+rebuildPool = False
+
+def startRebuildPool():
+	'''Create the process pool used by rebuildPositionHistory.  Creating a pool forks the
+	process, so this must be called at startup before Qt or any other thread is running.'''
+	global rebuildPool
+	if rebuildPool or not haveMultiprocessing or getattr(sys, "frozen", False):
+		return
+	try:
+		processes = multiprocessing.cpu_count()
+		if processes >= 2:
+			rebuildPool = multiprocessing.Pool(processes)
+	except Exception:
+		rebuildPool = False
+
+def stopRebuildPool():
+	global rebuildPool
+	if rebuildPool:
+		rebuildPool.terminate()
+		rebuildPool = False
+
+# Benchmark histories computed by Portfolio.getBenchmarkHistory
+# Key is (portfolio database, benchmark database), value is ((portfolio last rebuild, benchmark last rebuild), history)
+benchmarkHistoryCache = {}
+
+class LruCache:
+	'''A dictionary holding only the most recently used entries.  generation changes every time the cache is cleared.
+	The cache is cleared from the update thread while the GUI thread reads it.'''
+	def __init__(self, size):
+		self.size = size
+		self.items = collections.OrderedDict()
+		self.generation = 0
+		self.lock = threading.Lock()
+	
+	def get(self, key):
+		'''Return the value for key or False'''
+		self.lock.acquire()
+		try:
+			try:
+				value = self.items.pop(key)
+			except KeyError:
+				return False
+			self.items[key] = value
+			return value
+		finally:
+			self.lock.release()
+	
+	def set(self, key, value, generation = False):
+		'''Add an entry.  If generation is given the entry is only added if the cache has not been cleared since.'''
+		self.lock.acquire()
+		try:
+			if not generation is False and generation != self.generation:
+				return
+			self.items.pop(key, None)
+			self.items[key] = value
+			while len(self.items) > self.size:
+				self.items.popitem(last = False)
+		finally:
+			self.lock.release()
+	
+	def clear(self):
+		self.lock.acquire()
+		try:
+			self.generation += 1
+			self.items.clear()
+		finally:
+			self.lock.release()
+
+# Full position histories used by Portfolio.getChartHistory
+# Key is (portfolio database, ticker), value is (history, sorted dates)
+chartHistoryCache = LruCache(32)
+
+# Charts drawn by Portfolio.drawChart, key is the portfolio database and drawChart parameters
+chartSeriesCache = LruCache(16)
+
+def clearChartCache():
+	'''Forget cached charts.  Called when any portfolio is rebuilt or marked dirty, which may change its charts or charts using it as a benchmark.'''
+	chartHistoryCache.clear()
+	chartSeriesCache.clear()
+
+def updateCurrentPositions(db, getPrice = False):
+	'''Replace the currentPositions table with the last row of every ticker in positionHistory.
+	
+	getPrice is an optional function returning the latest price of a ticker or False.
+	The weight of each active position is its share of the total positive value.'''
+	dates = getDateColumn(db, "positionHistory")
+	cursor = db.getConn().execute("select ticker, shares, value, max(" + dates.name + ") as maxDate from positionHistory group by ticker")
+	rows = cursor.fetchall()
+	for row in rows:
+		row["maxDate"] = dates.toText(row["maxDate"])
+	
+	maxDate = "0000-00-00"
+	for row in rows:
+		if row["maxDate"] > maxDate:
+			maxDate = row["maxDate"]
+	
+	total = 0.0
+	for row in rows:
+		if row["maxDate"] == maxDate and row["ticker"] != "__COMBINED__" and row["value"] > 0.0:
+			total += row["value"]
+	
+	snapshot = []
+	for row in rows:
+		price = None
+		if getPrice:
+			price = getPrice(row["ticker"])
+			if not price:
+				price = None
+
+		weight = 0.0
+		if row["maxDate"] == maxDate and row["ticker"] != "__COMBINED__" and total > 0.0:
+			weight = row["value"] / total
+
+		snapshot.append({
+			"ticker": row["ticker"],
+			"date": row["maxDate"],
+			"shares": row["shares"],
+			"value": row["value"],
+			"price": price,
+			"weight": weight})
+	
+	db.delete("currentPositions")
+	db.insertMany("currentPositions", snapshot)
+
+def migrateDataToDays():
+	'''Convert stocks.db and every portfolio in the data directory to the integer day layout.
+	Run with "python portfolio.py migrate" while Icarra is closed.'''
+	import stockData
+	
+	root = prefs.Prefs.prefsRootPath()
+	for f in sorted(os.listdir(root)):
+		path = os.path.join(root, f)
+		if f == "stocks.db":
+			migrate = stockData.migrateStocksToDays
+		elif f.startswith("portfolio_") and f.endswith(".db"):
+			migrate = migratePositionsToDays
+		else:
+			continue
+		
+		size = os.path.getsize(path)
+		db = Db(path)
+		if migrate(db):
+			db.query("vacuum")
+			print "%s: %d KB -> %d KB" % (f, size / 1024, os.path.getsize(path) / 1024)
+		else:
+			print "%s: already migrated" % f
+		db.close()
+
+def benchmarkPositions(years = 20, tickers = 20, runs = 20):
+	'''Time reading current positions with a group by over positionHistory and from the currentPositions snapshot'''
+	import tempfile
+	
+	(handle, path) = tempfile.mkstemp(suffix = ".db")
+	os.close(handle)
+	try:
+		db = Db(path)
+		db.checkTable("positionHistory", [
+			{"name": "date", "type": "datetime"},
+			{"name": "ticker", "type": "text"},
+			{"name": "shares", "type": "float"},
+			{"name": "value", "type": "float"}],
+			index = [{"name": "positionHistoryIndex", "cols": ["ticker, date"]}])
+		db.checkTable("currentPositions", currentPositionsFields)
+
+		db.beginTransaction()
+		date = datetime.datetime.now() - datetime.timedelta(years * 365)
+		for day in range(years * 365):
+			rows = []
+			for i in range(tickers):
+				rows.append({"date": date.strftime("%Y-%m-%d 00:00:00"), "ticker": "T%d" % i, "shares": 10.0, "value": 10.0 * (i + 1)})
+			db.insertMany("positionHistory", rows)
+			date += datetime.timedelta(1)
+		updateCurrentPositions(db)
+		db.commitTransaction()
+		
+		start = time.time()
+		for i in range(runs):
+			db.getConn().execute("select ticker, shares, value, max(date) as maxDate from positionHistory group by ticker").fetchall()
+		groupBy = (time.time() - start) / runs
+		
+		start = time.time()
+		for i in range(runs):
+			db.select("currentPositions").fetchall()
+		snapshot = (time.time() - start) / runs
+
+		print "%d years of %d tickers: group by %.2f ms, snapshot %.2f ms" % (years, tickers, groupBy * 1000, snapshot * 1000)
+		db.close()
+	finally:
+		os.remove(path)
+
 class Portfolio:
 	'''Implements all functions needed for managing portfolios.
 	
@@ -366,19 +621,20 @@ class Portfolio:
 			{"name": "shares", "type": "float"},
 			{"name": "value", "type": "float"}])
 
-		self.db.checkTable("positionHistory", [
-			{"name": "date", "type": "datetime"},
-			{"name": "ticker", "type": "text"},
-			{"name": "shares", "type": "float"},
-			{"name": "options", "type": "float"},
-			{"name": "value", "type": "float"},
-			{"name": "normSplit", "type": "float"},
-			{"name": "normDividend", "type": "float"},
-			{"name": "normFee", "type": "float"},
-			{"name": "profitSplit", "type": "float"},
-			{"name": "profitDividend", "type": "float"},
-			{"name": "profitFee", "type": "float"}],
-			index = [{"name": "positionHistoryIndex", "cols": ["ticker, date"]}])
+		self.historyDates = getDateColumn(self.db, "positionHistory")
+		self.db.checkTable("positionHistory", self.historyDates.fields(positionHistoryFields),
+			index = self.historyDates.index([{"name": "positionHistoryIndex", "cols": ["ticker, date"]}]))
+		
+		# Benchmark history is no longer stored, see getBenchmarkHistory
+		# Only delete rows left by older versions so opening does not need to write
+		if self.db.select("positionHistory", where = {"ticker": "__BENCHMARK__"}, limit = 1).fetchone():
+			self.db.delete("positionHistory", {"ticker": "__BENCHMARK__"})
+		
+		self.db.checkTable("currentPositions", currentPositionsFields)
+		self.currentPositions = False
+		
+		# Benchmark portfolio, see getBenchmarkPortfolio
+		self.benchmarkPortfolio = False
 		
 		self.db.checkTable("allocation", [
 			{"name": "ticker", "type": "text"},
@@ -409,16 +665,32 @@ class Portfolio:
 			{"name": "type", "type": "integer"}],
 			unique = [{"name": "tickerIndex", "cols": ["ticker"]}])
 
+		self.db.checkTable("syncState", [
+			{"name": "service", "type": "text"},
+			{"name": "uniqueId", "type": "text"},
+			{"name": "signature", "type": "text"}],
+			unique = [{"name": "serviceIdIndex", "cols": ["service", "uniqueId"]}])
+
+		self.db.checkTable("syncWatermarks", [
+			{"name": "service", "type": "text"},
+			{"name": "watermark", "type": "text"}],
+			unique = [{"name": "serviceIndex", "cols": ["service"]}])
+
 		self.db.commitTransaction()
 		
 		# List of transactions
 		self.transactions = []
 		
-		# List of user prices
+		# List of user prices, also indexed by ticker
 		self.userPrices = []
+		self.userPricesByTicker = {}
+		
+		# Option prices, see getOptionPrices
+		self.optionPrices = False
 		
 	def close(self):
 		'''Close this portfolio's database'''
+		self.closeBenchmarkPortfolio()
 		self.db.close()
 	
 	def strToDatetime(self, date, zeroHMS = False):
@@ -530,6 +802,7 @@ class Portfolio:
 		res = self.db.select("transactions")
 		
 		self.transactions = []
+		self.optionPrices = False
 		for row in res.fetchall():
 			t = Transaction(
 				uniqueId = row["uniqueId"],
@@ -554,6 +827,8 @@ class Portfolio:
 	
 		res = self.db.select("userPrices")
 		
+		self.userPrices = []
+		self.userPricesByTicker = {}
 		for row in res.fetchall():
 			ticker = row["ticker"]
 			p = UserPrice(
@@ -561,6 +836,7 @@ class Portfolio:
 				ticker,
 				row["price"])
 			self.userPrices.append(p)
+			self.userPricesByTicker.setdefault(ticker.upper(), []).append(p)
 	
 	def getTickers(self, includeAllocation = False):
 		'''Return a list of all tickers in this portfolio.  If includeAllocation is true then values from the allocation table will be included.  Otherwise tickers will be taken strictly from transactions.  This list includes __CASH__ but does not include __COMBINED__ and __BENCHMARK__.'''
@@ -706,12 +982,73 @@ class Portfolio:
 			return row["category"]
 		return "Uncategorized"
 	
+	def getCategoryMap(self):
+		'''Return the category of every categorized payee as a dictionary indexed by ticker.  Payees missing from the dictionary are Uncategorized.'''
+		ret = {}
+		cursor = self.db.select("categories")
+		for row in cursor.fetchall():
+			if not row["ticker"] in ret:
+				ret[row["ticker"]] = row["category"]
+		return ret
+	
 	def setCategory(self, ticker, category):
 		'''Update a spending category'''
 		self.db.beginTransaction()
 		self.db.insertOrUpdate("categories", {"ticker": ticker, "category": category}, {"ticker": ticker})
 		self.db.commitTransaction()
 	
+	def setCategories(self, categories):
+		'''Update many spending categories in one transaction.  categories is a dictionary indexed by ticker.'''
+		if not categories:
+			return
+		existing = self.getCategoryMap()
+		self.db.beginTransaction()
+		for ticker in categories:
+			if ticker in existing:
+				self.db.delete("categories", {"ticker": ticker})
+		self.db.insertMany("categories", [{"ticker": ticker, "category": categories[ticker]} for ticker in sorted(categories)])
+		self.db.commitTransaction()
+	
+	def getSyncSignatures(self, service):
+		'''Return the signature of every transaction last synchronized with an online service as a dictionary indexed by uniqueId'''
+		ret = {}
+		cursor = self.db.select("syncState", where = {"service": service})
+		for row in cursor.fetchall():
+			ret[row["uniqueId"]] = row["signature"]
+		return ret
+	
+	def setSyncSignatures(self, service, signatures):
+		'''Record the signatures of transactions synchronized with an online service in one transaction.  signatures is a dictionary indexed by uniqueId.'''
+		if not signatures:
+			return
+		existing = self.getSyncSignatures(service)
+		self.db.beginTransaction()
+		for uniqueId in signatures:
+			if uniqueId in existing:
+				self.db.delete("syncState", {"service": service, "uniqueId": uniqueId})
+		self.db.insertMany("syncState", [{"service": service, "uniqueId": uniqueId, "signature": signatures[uniqueId]} for uniqueId in sorted(signatures)])
+		self.db.commitTransaction()
+	
+	def getSyncWatermark(self, service):
+		'''Return the server watermark of the last synchronization with an online service.  Empty if never synchronized.'''
+		cursor = self.db.select("syncWatermarks", where = {"service": service})
+		row = cursor.fetchone()
+		if row:
+			return row["watermark"]
+		return ""
+	
+	def setSyncWatermark(self, service, watermark):
+		self.db.beginTransaction()
+		self.db.insertOrUpdate("syncWatermarks", {"service": service, "watermark": watermark}, {"service": service})
+		self.db.commitTransaction()
+	
+	def clearSyncState(self, service):
+		'''Forget all synchronization with an online service so the next sync compares every transaction'''
+		self.db.beginTransaction()
+		self.db.delete("syncState", {"service": service})
+		self.db.delete("syncWatermarks", {"service": service})
+		self.db.commitTransaction()
+	
 	def ignoreTransactionCheck(self, error):
 		'''Ignore a transaction check'''
 		self.db.beginTransaction()
@@ -733,6 +1070,27 @@ class Portfolio:
 	def setBenchmark(self, benchmark):
 		'''Change this portfolio's benchmark'''
 		self.db.update("prefs", {"value": benchmark}, {"name": "benchmark"})
+		self.closeBenchmarkPortfolio()
+		clearChartCache()
+
+	def getBenchmarkPortfolio(self):
+		'''Return the Portfolio for this portfolio's benchmark or False if it does not exist.
+		The benchmark is opened once and kept until the benchmark changes or this portfolio is closed.'''
+		name = self.getBenchmark()
+		if self.benchmarkPortfolio and self.benchmarkPortfolio.name == name:
+			return self.benchmarkPortfolio
+		
+		self.closeBenchmarkPortfolio()
+		app = appGlobal.getApp()
+		if not app or not os.path.exists(app.prefs.getPortfolioPath(name)):
+			return False
+		self.benchmarkPortfolio = Portfolio(name)
+		return self.benchmarkPortfolio
+
+	def closeBenchmarkPortfolio(self):
+		if self.benchmarkPortfolio:
+			self.benchmarkPortfolio.close()
+			self.benchmarkPortfolio = False
 
 	def getSummaryYears(self):
 		'''Return the number of years to show summary data.  Value may be thisYear, lastYear or allYears.'''
@@ -772,10 +1130,10 @@ class Portfolio:
 
 	def getEndDate(self):
 		'''Return the ending date of this portfolio (last date of position history)'''
-		cursor = self.db.select("positionHistory", orderBy = "date desc", limit = 1)
+		cursor = self.db.select("positionHistory", orderBy = self.historyDates.name + " desc", limit = 1)
 		row = cursor.fetchone()
 		if row:
-			return Transaction.parseDate(row["date"])
+			return self.historyDates.toDate(row[self.historyDates.name])
 		return False		
 
 	def getLastTransactionDate(self):
@@ -911,18 +1269,44 @@ class Portfolio:
 	
 	def getUserPrices(self, ticker):
 		'''Return the user prices for this ticker.  User prices are zzz'''
-		retPrices = []
-		
-		ticker = ticker.upper()
+		return list(self.userPricesByTicker.get(ticker.upper(), []))
+	
+	def getOptionPrices(self):
+		'''Return an OptionPrices index of this portfolio's option transactions and user prices.
+		The index is built when first needed after transactions are read.'''
+		if self.optionPrices:
+			return self.optionPrices
+		
+		self.optionPrices = OptionPrices()
+		contracts = {}
+		for t in self.getTransactions(ascending = True):
+			if t.type in [Transaction.buyToOpen, Transaction.buyToClose, Transaction.sellToOpen, Transaction.sellToClose]:
+				self.optionPrices.add(t.ticker, t.optionExpire, t.optionStrike, t.subType, t.date, t.pricePerShare)
+				contracts[t.formatTicker().upper()] = t
+		
+		# User prices entered for a contract override transaction prices on the same day
 		for p in self.userPrices:
-			if p.ticker.upper() == ticker:
-				retPrices.append(p)
+			if p.ticker.upper() in contracts:
+				t = contracts[p.ticker.upper()]
+				self.optionPrices.add(t.ticker, t.optionExpire, t.optionStrike, t.subType, self.strToDatetime(p.date, zeroHMS = True), p.price)
 		
-		return retPrices
-	
+		return self.optionPrices
+
 	def addUserAndTransactionPrices(self, ticker, prices, optionPrices, transactions):
-		'''Add user prices and prices based on transactions to existing stock data'''
-		userPrices = self.getUserPrices(ticker)
+		'''Add user prices and prices based on transactions to existing stock data.
+		prices must be in date order.  User prices are used before transaction prices
+		and stock data is used before either.'''
+		# Dates that already have a price
+		dates = set()
+		for p in prices:
+			dates.add(p["date"])
+		
+		newPrices = []
+		for p in self.getUserPrices(ticker):
+			date = self.strToDatetime(p.date, zeroHMS = True)
+			if not date in dates:
+				dates.add(date)
+				newPrices.append({'volume': 0, 'high': p.price, 'low': p.price, 'date': date, 'close': p.price, 'open': p.price})
 		
 		# Use buys/sells to add to user price
 		for t in transactions:
@@ -943,26 +1327,25 @@ class Portfolio:
 							optionPrices[t.formatTicker()] = []
 						optionPrices[t.formatTicker()].append({'volume': 0, 'high': price, 'low': price, 'date': t.date, 'close': price, 'open': price})
 					else:
-						userPrices.append(UserPrice(t.date, t.ticker, price))
-
-		# Add user prices and transaction prices to prices array
-		appended = False
-		for p in userPrices:
-			date = self.strToDatetime(p.date, zeroHMS = True)
+						date = datetime.datetime(t.date.year, t.date.month, t.date.day)
+						if not date in dates:
+							dates.add(date)
+							newPrices.append({'volume': 0, 'high': price, 'low': price, 'date': date, 'close': price, 'open': price})
 
-			# Check if date is already there
-			found = False
-			for p2 in prices:
-				if p2["date"] == date:
-					found = True
-					break
-			if not found:
-				appended = True
-				prices.append({'volume': 0, 'high': p.price, 'low': p.price, 'date': date, 'close': p.price, 'open': p.price})
+		if not newPrices:
+			return
 		
-		# If we added prices, sort by date
-		if appended:
-			prices.sort(key = lambda p: p['date'])
+		# Merge the new prices into prices in date order
+		newPrices.sort(key = lambda p: p['date'])
+		merged = []
+		i = 0
+		for p in newPrices:
+			while i < len(prices) and prices[i]['date'] < p['date']:
+				merged.append(prices[i])
+				i += 1
+			merged.append(p)
+		merged.extend(prices[i:])
+		prices[:] = merged
 		
 	
 	def getPositionCheck(self, ticker):
@@ -1006,56 +1389,198 @@ class Portfolio:
 
 	def getPositionHistory(self, ticker, startDate = False):
 		'''Return the computed position history for the given ticker.  May filter based on an optional start date.'''
+		if ticker == "__BENCHMARK__":
+			history = self.getBenchmarkHistory()
+			if not startDate:
+				return dict(history)
+			startDate = datetime.datetime(startDate.year, startDate.month, startDate.day)
+			return dict((date, row) for (date, row) in history.items() if date >= startDate)
+
 		where = {"ticker": ticker}
 		if startDate:
-			where["date >="] = "%d-%02d-%02d 00:00:00" % (startDate.year, startDate.month, startDate.day)
+			where[self.historyDates.name + " >="] = self.historyDates.fromDate(startDate)
 		cursor = self.db.select("positionHistory", where = where)
 		
 		ret = {}
 		for row in cursor.fetchall():
-			row["date"] = self.strToDatetime(row["date"])
+			self.historyDates.loadRow(row)
 			ret[row["date"]] = row
 		
 		return ret
 	
+	def getChartHistory(self, ticker, startDate = False):
+		'''Return (history, dates) where history is getPositionHistory(ticker, startDate) and dates is its sorted keys.
+		The full history of a ticker is kept in memory so charts of other periods only slice it.  Rows must not be modified.'''
+		if ticker == "__BENCHMARK__":
+			history = self.getBenchmarkHistory()
+			dates = sorted(history)
+		else:
+			key = (self.db.name, ticker)
+			cached = chartHistoryCache.get(key)
+			if cached:
+				(history, dates) = cached
+			else:
+				generation = chartHistoryCache.generation
+				history = self.getPositionHistory(ticker)
+				dates = sorted(history)
+				chartHistoryCache.set(key, (history, dates), generation)
+		
+		if startDate:
+			startDate = datetime.datetime(startDate.year, startDate.month, startDate.day)
+			dates = dates[bisect.bisect_left(dates, startDate):]
+			history = dict((date, history[date]) for date in dates)
+		return (history, dates)
+	
 	def getPositionOnDate(self, ticker, date):
 		'''Return the position history on a specific date.'''
-		cursor = self.db.select("positionHistory", where = {"ticker": ticker, "date": date.strftime("%Y-%m-%d %H:%M:%S")})
+		if ticker == "__BENCHMARK__":
+			row = self.getBenchmarkHistory().get(date)
+			if not row:
+				return False
+			return row.copy()
+
+		cursor = self.db.select("positionHistory", where = {"ticker": ticker, self.historyDates.name: self.historyDates.fromDate(date)})
 		
 		row = cursor.fetchone()
 		if not row:
 			return False
 		
-		row["date"] = self.strToDatetime(row["date"])
-
-		return row
+		return self.historyDates.loadRow(row)
 	
+	def getBenchmarkHistory(self):
+		'''Return the value of this portfolio's deposits and withdrawals invested in its benchmark.
+		The result is indexed by date like getPositionHistory with a ticker of __BENCHMARK__.
+		
+		The history is computed when first needed and cached until this portfolio or its
+		benchmark is rebuilt, so changing the benchmark does not require a rebuild.'''
+		if self.isBenchmark() or self.isBank():
+			return {}
+		benchmark = self.getBenchmarkPortfolio()
+		if not benchmark:
+			return {}
+		
+		key = (self.db.name, benchmark.db.name)
+		rebuilt = (self.portPrefs.getLastRebuild(), benchmark.portPrefs.getLastRebuild())
+		if key in benchmarkHistoryCache and benchmarkHistoryCache[key][0] == rebuilt:
+			return benchmarkHistoryCache[key][1]
+
+		if not self.transactions:
+			self.readFromDb()
+		cashTransactions = self.getTransactions("__CASH__", ascending = True, buysToCash = False)
+		name = self.historyDates.name
+		cursor = self.db.select("positionHistory", where = {"ticker": "__COMBINED__"}, what = name, orderBy = name)
+		dates = [self.historyDates.toDate(row[name]) for row in cursor.fetchall()]
+		benchmarkValues = benchmark.getPositionHistory("__COMBINED__")
+
+		history = {}
+		currentCashTrans = 0
+		benchmarkShares = 0
+		totalCashIn = 0
+		first = True
+		for date in dates:
+			endOfDay = datetime.datetime(date.year, date.month, date.day, 23, 59, 59)
+			
+			# Update deposited/withdrawn money
+			cashInToday = 0
+			while currentCashTrans < len(cashTransactions) and cashTransactions[currentCashTrans].date <= endOfDay:
+				t = cashTransactions[currentCashTrans]
+				if t.type in [Transaction.deposit, Transaction.transferIn]:
+					cashInToday += abs(t.total)
+				elif t.type in [Transaction.withdrawal, Transaction.transferOut]:
+					cashInToday -= abs(t.total)
+				currentCashTrans += 1
+			
+			# Buy or sell shares
+			if cashInToday != 0:
+				totalCashIn += cashInToday
+				if date in benchmarkValues and benchmarkValues[date]['value'] != 0:
+					benchmarkShares += cashInToday / benchmarkValues[date]['value']
+			
+			# Update values
+			if date in benchmarkValues:
+				value = benchmarkShares * benchmarkValues[date]['value']
+				
+				if first:
+					first = False
+					firstNormSplit = benchmarkValues[date]['normSplit']
+					firstNormDividend = benchmarkValues[date]['normDividend']
+					firstNormFee = benchmarkValues[date]['normFee']
+
+				history[date] = {
+					"date": date,
+					"ticker": "__BENCHMARK__",
+					"shares": benchmarkShares,
+					"options": None,
+					"value": value,
+					"normSplit": benchmarkValues[date]['normSplit'] / firstNormSplit,
+					"normDividend": benchmarkValues[date]['normDividend'] / firstNormDividend,
+					"normFee": benchmarkValues[date]['normFee'] / firstNormFee,
+					"profitSplit": value - totalCashIn,
+					"profitDividend": value - totalCashIn,
+					"profitFee": value - totalCashIn}
+		
+		benchmarkHistoryCache[key] = (rebuilt, history)
+		return history
+
 	def getPositions(self, current = False):
-		'''Return a list of all positions.  Pass current as True to return only active positions.'''
-		cursor = self.db.getConn().execute("select ticker, shares, value, max(date) as maxDate from positionHistory group by ticker")
+		'''Return a list of all positions.  Pass current as True to return only active positions.
 		
-		rows = []
-		for row in cursor.fetchall():
-			rows.append(row)
+		Positions are read from the currentPositions snapshot and kept in memory until the next rebuild.'''
+		rebuilt = self.portPrefs.getLastRebuild()
+		if not self.currentPositions or self.currentPositions[0] != rebuilt:
+			rows = self.db.select("currentPositions", orderBy = "ticker").fetchall()
+			
+			# Portfolios rebuilt before the snapshot existed
+			if not rows and self.db.select("positionHistory", limit = 1).fetchone():
+				self.rebuildCurrentPositions()
+				rows = self.db.select("currentPositions", orderBy = "ticker").fetchall()
+			
+			self.currentPositions = (rebuilt, rows)
+		rows = self.currentPositions[1]
 
 		if current:
 			maxDate = "0000-00-00"
 			
 			for row in rows:
-				if row["maxDate"] > maxDate:
-					maxDate = row["maxDate"]
+				if row["date"] > maxDate:
+					maxDate = row["date"]
 		
 		ret = {}
 		for row in rows:
-			if not current or row["maxDate"] == maxDate:
+			if not current or row["date"] == maxDate:
 				ret[row["ticker"]] = row
 			
 		return ret
 	
+	def rebuildCurrentPositions(self):
+		'''Update the currentPositions snapshot from positionHistory.  Called at the end of a rebuild.'''
+		getPrice = False
+		if self.isBrokerage() and appGlobal.getApp():
+			stockData = appGlobal.getApp().stockData
+			def getPrice(ticker):
+				date = stockData.getLastDate(ticker)
+				if date:
+					value = stockData.getPrice(ticker, date)
+					if value:
+						return value["close"]
+				return False
+
+		self.db.beginTransaction()
+		updateCurrentPositions(self.db, getPrice)
+		self.db.commitTransaction()
+		self.currentPositions = False
+	
 	def getPositionFirstLast(self, ticker):
 		'''Return the first and last date of the position's history.  The first date is typically the first transaction date.  The last date is typically today.'''
+		if ticker == "__BENCHMARK__":
+			history = self.getBenchmarkHistory()
+			if not history:
+				return False
+			return (min(history), max(history))
+
 		conn = self.db.getConn()
-		select = "select min(date) as minDate, max(date) as maxDate from positionHistory where ticker=?"
+		name = self.historyDates.name
+		select = "select min(" + name + ") as minDate, max(" + name + ") as maxDate from positionHistory where ticker=?"
 		cursor = conn.execute(select, [ticker])
 		
 		row = cursor.fetchone()
@@ -1065,8 +1590,8 @@ class Portfolio:
 		if row['minDate'] is None or row['maxDate'] is None:
 			return False
 		
-		d1 = self.strToDatetime(row['minDate'])
-		d2 = self.strToDatetime(row['maxDate'])
+		d1 = self.historyDates.toDate(row['minDate'])
+		d2 = self.historyDates.toDate(row['maxDate'])
 		return (d1, d2)
 	
 	def sumInflow(self, first, last, ticker = False):
@@ -1317,26 +1842,32 @@ class Portfolio:
 		#print ticker, ret, val1, val2, years, days, first, last
 		return (ret, years)
 	
-	def runRules(self):
-		'''Run banking rules for this portfolio.  Assigns categories to spending.'''
-		rules = self.getRules()
+	def runRules(self, preview = False):
+		'''Run banking rules for this portfolio.  Assigns categories to uncategorized spending.
+		A payee is given the category of the last rule that matches it, see RuleMatcher.
 		
-		# First build unique tickers
+		If preview is True no categories are changed.  Instead a list of (rule, category, count)
+		is returned where count is how many uncategorized payees the rule matches.'''
+		matcher = RuleMatcher(self.getRules())
+		
+		# First build unique uncategorized tickers
+		categories = self.getCategoryMap()
 		tickers = {}
 		for t in self.getTransactions():
 			if not t.isBankSpending():
 				continue
-			tickers[t.ticker] = t
+			if categories.get(t.ticker, "Uncategorized") == "Uncategorized":
+				tickers[t.ticker] = t
+		
+		if preview:
+			return matcher.preview(tickers.keys())
 		
-		# Try to match for all uncategorized
+		newCategories = {}
 		for t in tickers:
-			if self.getCategory(t) != "Uncategorized":
-				continue
-			
-			# r[0] is the rule, r[1] is the category
-			for r in rules:
-				if re.match(".*" + r[0] + ".*", t, re.IGNORECASE):
-					self.setCategory(t, r[1])
+			match = matcher.match(t)
+			if match:
+				newCategories[t] = match[1]
+		self.setCategories(newCategories)
 	
 	def getAllocation(self):
 		'''Return the allocation for this portfolio.  Returns a dictionary[ticker] = percentage.'''
@@ -1357,204 +1888,39 @@ class Portfolio:
 		else:
 			self.db.insert("allocation", {"ticker": newTicker, "percentage": percent})
 	
-	def rebuildBenchmarkTransactions(self, stockData, status):
-		'''Rebuild transfer in, dividend reinvest and rebalance transactions for a benchmark portfolio'''
+	def rebuildBenchmarkHistory(self, stockData, status):
+		'''Rebuild the transactions and position history of a benchmark portfolio.  See benchmarkRebuild.rebuildBenchmark.'''
 		if status:
-			status.setStatus("Rebuilding Benchmark Transactions", 0)
-		self.db.beginTransaction()
+			status.setStatus("Rebuilding Benchmark", 0)
 		self.db.delete("transactions")
 		
-		positions = self.getAllocation()
-		if not positions:
-			return
-
-		ticker = positions.keys()[0]
+		allocation = self.getAllocation()
 		
-		# Compute start date of portfolio
-		first = True
-		for ticker in positions:
-			if first:
-				firstDate = stockData.getFirstDate(ticker)
-				if firstDate:
-					first = False
-					date = firstDate
-			else:
-				firstDate = stockData.getFirstDate(ticker)
-				if firstDate and firstDate > date:
-					date = firstDate
+		# The benchmark starts once every ticker has stock data
+		startDate = False
+		prices = {}
+		dividends = {}
+		for ticker in allocation:
+			prices[ticker] = stockData.getPrices(ticker)
+			dividends[ticker] = stockData.getDividends(ticker)
+			if prices[ticker]:
+				firstDate = prices[ticker][0]["date"]
+				if not startDate or firstDate > startDate:
+					startDate = firstDate
 		
 		# No stock data found
-		if first:
+		if not startDate:
 			return
-
-		date = datetime.datetime(date.year, date.month, date.day, 0, 0, 0)
-		currentYear = -1
 		
 		# Get last second of today's date
 		now = datetime.datetime.now()
 		now = datetime.datetime(now.year, now.month, now.day, 23, 59, 59)
-
-		transactionId = 1
-		# Deposit $10,000
-		t = Transaction(
-			"__" + str(transactionId) + "__",
-			"__CASH__",
-			date,
-			Transaction.deposit,
-			10000,
-			auto = True)
-		cash = 10000
-		t.save(self.db)
-		transactionId += 1
-		
-		stockPrices = {}
-		currentStockPrice = {}
-		stockDividends = {}
-		currentStockDividend = {}
-		for ticker in positions:
-			stockPrices[ticker] = stockData.getPrices(ticker)
-			currentStockPrice[ticker] = 0
-			stockDividends[ticker] = stockData.getDividends(ticker)
-			currentStockDividend[ticker] = 0
-		
-		value = 0.0
-		shares = {}
-		stockVal = {}
+		
 		if status:
-			status.setStatus("Rebuilding Benchmark Transactions", 20)
-		yieldCount = 0
-		while date < now:
-			yieldCount += 1
-			if yieldCount == 100:
-				yieldCount = 0
-				if status:
-					status.appYield()
-					if status.canceled:
-						break
-
-			# Get current price
-			while currentStockPrice[ticker] < len(stockPrices[ticker]) and stockPrices[ticker][currentStockPrice[ticker]]["date"] < date:
-				currentStockPrice[ticker] += 1
-			if currentStockPrice[ticker] < len(stockPrices[ticker]) and stockPrices[ticker][currentStockPrice[ticker]]["date"] == date:
-				val = stockPrices[ticker][currentStockPrice[ticker]]
-				stockVal[ticker] = val
-
-			# Compute value if we own shares
-			if shares:
-				newValue = 0.0
-				doNewValue = False
-				for ticker in shares:
-					# Get current dividend
-					# Possible bug if multiple dividends on the same day
-					while currentStockDividend[ticker] < len(stockDividends[ticker]) and stockDividends[ticker][currentStockDividend[ticker]]["date"] < date:
-						currentStockDividend[ticker] += 1
-					if val["close"] > 0 and currentStockDividend[ticker] < len(stockDividends[ticker]) and stockDividends[ticker][currentStockDividend[ticker]]["date"] == date:
-						div = stockDividends[ticker][currentStockDividend[ticker]]
-
-						amount = div["value"] * shares[ticker]
-						buyShares = amount / val["close"]
-						shares[ticker] += buyShares
-
-						t = Transaction(
-							"__" + str(transactionId) + "__",
-							ticker,
-							date,
-							Transaction.dividendReinvest,
-							amount,
-							shares = buyShares,
-							pricePerShare = val["close"],
-							auto = True)
-						t.save(self.db)
-						transactionId += 1
-					
-					newValue += shares[ticker] * val["close"]
-					doNewValue = True
-				if doNewValue:
-					value = newValue + cash
-					#print date, newValue
-					
-			# Rebalance on the first transaction and on the first of every year
-			if date.year != currentYear:
-				# Rebalance if data is available today (exchanges are open)
-				#if stockVal:
-				currentYear = date.year
-				
-				if not shares:
-					# Original purchase
-					for ticker in positions:
-						if ticker not in stockVal:
-							continue
-						close = stockVal[ticker]["close"]
-						if close <= 0:
-							continue
-							
-						# Buy allocation for portfolio value of $10,000
-						buyShares = 10000.0 / close * positions[ticker] / 100.0
-						amount = buyShares * close
-						shares[ticker] = buyShares
-
-						t = Transaction(
-							"__" + str(transactionId) + "__",
-							ticker,
-							date,
-							Transaction.buy,
-							-amount,
-							shares = buyShares,
-							pricePerShare = close,
-							auto = True)
-						cash -= amount
-						t.save(self.db)
-						transactionId += 1
-				elif value:
-					for ticker in positions:
-						if ticker not in stockVal:
-							continue
-						close = stockVal[ticker]["close"]
-						if close <= 0:
-							continue
-							
-						# Buy allocation for portfolio value of $value
-						finalShares = value / close * positions[ticker] / 100.0
-						if ticker in shares:
-							buyShares = finalShares - shares[ticker]
-							shares[ticker] = finalShares
-						else:
-							buyShares = finalShares
-							shares[ticker] = finalShares
-						
-						# amount is < 0 for sell, > 0 for buy
-						amount = buyShares * close
-						
-						if buyShares > 1.0e-6:
-							t = Transaction(
-								"__" + str(transactionId) + "__",
-								ticker,
-								date,
-								Transaction.buy,
-								amount,
-								shares = buyShares,
-								pricePerShare = close,
-								auto = True)
-							cash -= amount
-							t.save(self.db)
-							transactionId += 1
-						elif buyShares < -1.0e-6:
-							t = Transaction(
-								"__" + str(transactionId) + "__",
-								ticker,
-								date,
-								Transaction.sell,
-								amount,
-								shares = buyShares,
-								pricePerShare = close,
-								auto = True)
-							cash -= amount # amount is < 0 for sell
-							t.save(self.db)
-							transactionId += 1
-			
-			date += datetime.timedelta(1)
-
-		self.db.commitTransaction()
+			status.setStatus("Rebuilding Benchmark", 20)
+		(transactions, historyRows) = rebuildBenchmark(allocation, prices, dividends, startDate, now, self.portPrefs.getBenchmarkRebalance(), status)
+		self.db.insertMany("transactions", [t.getSaveData() for t in transactions])
+		self.db.insertMany("positionHistory", self.historyDates.saveRows(historyRows))
 	
 	def rebuildCombinedTransactions(self, update):
 		'''Rebuild a combined portfolio's transactions by aggregating all transactions from sub-portfolios'''
@@ -1721,123 +2087,90 @@ class Portfolio:
 		autoDividendReinvest = self.portPrefs.getAutoDividendReinvest()
 		
 		# Remove all dividend and split transactions
-		if autoSplit:
-			for t in transactions[:]:
-				if t.type in [Transaction.split, Transaction.stockDividend] and not t.auto:
-					transactions.remove(t)
-		if autoDividend:
-			for t in transactions[:]:
-				if t.type in [Transaction.dividend, Transaction.dividendReinvest] and not t.auto:
-					transactions.remove(t)
-		
-		if not transactions:
+		kept = []
+		for t in transactions:
+			if autoSplit and t.type in [Transaction.split, Transaction.stockDividend] and not t.auto:
+				continue
+			if autoDividend and t.type in [Transaction.dividend, Transaction.dividendReinvest] and not t.auto:
+				continue
+			kept.append(t)
+		
+		if not kept:
+			transactions[:] = kept
 			return
 
-		# Add auto split transactions
-		splits = appGlobal.getApp().stockData.getSplits(ticker, transactions[0].date)
-		dividends = appGlobal.getApp().stockData.getDividends(ticker, transactions[0].date)
+		stockData = appGlobal.getApp().stockData
+		splits = stockData.getSplits(ticker, kept[0].date)
+		dividends = stockData.getDividends(ticker, kept[0].date)
+		if autoDividendReinvest and dividends:
+			dividendPrices = stockData.getPricesAt(ticker, [d["date"] for d in dividends], 7)
+		
+		# Merge auto split and dividend transactions with the remaining transactions in date order
+		# Splits come before dividends on the same date
+		merged = []
+		autoTransactions = []
 		shares = 0
-		i = 0
 		splitIndex = 0
 		dividendIndex = 0
-		for t in transactions:
-			while splitIndex < len(splits) and splits[splitIndex]["date"] < t.date:
-				shares *= splits[splitIndex]["value"]
-				
-				# Add auto split
-				t2 = Transaction(
-					False,
-					ticker,
-					splits[splitIndex]["date"],
-					Transaction.split,
-					splits[splitIndex]["value"],
-					auto = True)
-				t2.save(self.db)
-				transactions.insert(i, t2)
-				
-				splitIndex += 1
-
-			while dividendIndex < len(dividends) and dividends[dividendIndex]["date"] < t.date:
-				# Add auto dividend
-				if autoDividendReinvest:
-					price = appGlobal.getApp().stockData.getNearestPrice(ticker, dividends[dividendIndex]["date"])
-					if price and price["close"] > 0.0:
-						buyShares = shares * dividends[dividendIndex]["value"] / price["close"]
-						shares += buyShares
-					else:
-						buyShares = False
+		for t in kept + [False]:
+			while splitIndex < len(splits) or dividendIndex < len(dividends):
+				if splitIndex < len(splits) and (dividendIndex >= len(dividends) or splits[splitIndex]["date"] <= dividends[dividendIndex]["date"]):
+					split = splits[splitIndex]
+					if t and split["date"] >= t.date:
+						break
+					shares *= split["value"]
 					
 					t2 = Transaction(
 						False,
 						ticker,
-						dividends[dividendIndex]["date"],
-						Transaction.dividendReinvest,
-						amount = shares * dividends[dividendIndex]["value"],
-						shares = buyShares,
+						split["date"],
+						Transaction.split,
+						split["value"],
 						auto = True)
+					splitIndex += 1
 				else:
-					t2 = Transaction(
-						False,
-						ticker,
-						dividends[dividendIndex]["date"],
-						Transaction.dividend,
-						shares * dividends[dividendIndex]["value"],
-						auto = True)
-				t2.save(self.db)
-				transactions.insert(i, t2)
+					dividend = dividends[dividendIndex]
+					if t and dividend["date"] >= t.date:
+						break
+					if autoDividendReinvest:
+						price = dividendPrices[dividend["date"]]
+						if price and price["close"] > 0.0:
+							buyShares = shares * dividend["value"] / price["close"]
+							shares += buyShares
+						else:
+							buyShares = False
+						
+						t2 = Transaction(
+							False,
+							ticker,
+							dividend["date"],
+							Transaction.dividendReinvest,
+							amount = shares * dividend["value"],
+							shares = buyShares,
+							auto = True)
+					else:
+						t2 = Transaction(
+							False,
+							ticker,
+							dividend["date"],
+							Transaction.dividend,
+							shares * dividend["value"],
+							auto = True)
+					dividendIndex += 1
 				
-				dividendIndex += 1
-
+				merged.append(t2)
+				autoTransactions.append(t2)
+			
+			if not t:
+				break
+			merged.append(t)
 			if t.type in [Transaction.buy, Transaction.transferIn]:
 				shares += t.getShares()
 			elif t.type in [Transaction.sell, Transaction.transferOut]:
 				shares -= t.getShares()
-			
-			i += 1
-		
-		# Apply any remaining split and dividend transactions
-		while splitIndex < len(splits) or dividendIndex < len(dividends):
-			if splitIndex < len(splits) and (dividendIndex >= len(dividends) or splits[splitIndex]["date"] <= dividends[dividendIndex]["date"]):
-				t2 = Transaction(
-					False,
-					ticker,
-					splits[splitIndex]["date"],
-					Transaction.split,
-					splits[splitIndex]["value"],
-					auto = True)
-				t2.save(self.db)
-				transactions.append(t2)
-				
-				splitIndex += 1
-			else:
-				if autoDividendReinvest:
-					price = appGlobal.getApp().stockData.getNearestPrice(ticker, dividends[dividendIndex]["date"])
-					if price and price["close"] > 0.0:
-						buyShares = shares * dividends[dividendIndex]["value"] / price["close"]
-						shares += buyShares
-					else:
-						buyShares = False
-					
-					t2 = Transaction(
-						False,
-						ticker,
-						dividends[dividendIndex]["date"],
-						Transaction.dividendReinvest,
-						amount = shares * dividends[dividendIndex]["value"],
-						shares = buyShares,
-						auto = True)
-				else:
-					t2 = Transaction(
-						False,
-						ticker,
-						dividends[dividendIndex]["date"],
-						Transaction.dividend,
-						shares * dividends[dividendIndex]["value"],
-						auto = True)
-				t2.save(self.db)
-				transactions.append(t2)
-				
-				dividendIndex += 1
+		
+		transactions[:] = merged
+		self.db.insertMany("transactions", [t.getSaveData() for t in autoTransactions])
 
 	def rebuildBankPositionHistory(self, update = False):
 		'''Rebuild the position history for a bank portfolio'''
@@ -1946,7 +2279,7 @@ class Portfolio:
 
 						currentTrans += 1
 
-					self.db.insert("positionHistory", {
+					self.db.insert("positionHistory", self.historyDates.saveRow({
 						"date": date.strftime("%Y-%m-%d 00:00:00"),
 						"ticker": ticker,
 						"shares": value,
@@ -1957,13 +2290,17 @@ class Portfolio:
 						"normFee": normFee,
 						"profitSplit": 0,
 						"profitDividend": profitDividend,
-						"profitFee": profitFee})
+						"profitFee": profitFee}))
 
 					date += datetime.timedelta(1)
 			
 			# The cash position is the combined position
-			query = "insert into positionHistory (date, ticker, shares, options, value, normSplit, normDividend, normFee, profitSplit, profitDividend, profitFee) select date, '__COMBINED__', shares, options, value, normSplit, normDividend, normFee, profitSplit, profitDividend, profitFee from positionHistory where ticker='__CASH__'"
+			name = self.historyDates.name
+			query = "insert into positionHistory (" + name + ", ticker, shares, options, value, normSplit, normDividend, normFee, profitSplit, profitDividend, profitFee) select " + name + ", '__COMBINED__', shares, options, value, normSplit, normDividend, normFee, profitSplit, profitDividend, profitFee from positionHistory where ticker='__CASH__'"
 			self.db.query(query)
+			
+			self.rebuildCurrentPositions()
+			self.portPrefs.setLastRebuild()
 		except Exception:
 			self.db.rollbackTransaction()
 			if update:
@@ -1975,347 +2312,52 @@ class Portfolio:
 		self.db.commitTransaction()
 		appGlobal.getApp().endBigTask()
 
-	def rebuildPositionHistory(self, stockData, update = False):
-		'''Rebuild the position history for a brokerage, benchmark or combined portfolio'''
-		# TODO: do not combine individual days
-		def addToBasis(ticker, d, s, pps):
-			if ticker not in basis:
-				basis[ticker] = {}
-			if d in basis[ticker]:
-				# Update basis for this day
-				(oldShares, oldPricePerShare) = basis[ticker][d]
-				newShares = s + oldShares
-				if newShares == 0:
-					self.db.rollbackTransaction()
-					appGlobal.getApp().endBigTask()
-					raise Exception("Added shares to 0")
-				newPricePerShare = (oldShares * oldPricePerShare + s * pps) / newShares
-				basis[ticker][d] = (newShares, newPricePerShare)
-			else:
-				basis[ticker][d] = (s, pps)
-		
-			# Update combined basis
-			d = datetime.datetime(d.year, d.month, d.day)
-			if not d in combinedBasis:
-				combinedBasis[d] = 0.0
-			combinedBasis[d] += abs(s * pps)
-		
-		def getShares(ticker):
-			if not ticker in basis:
-				return 0
-			
-			s = 0
-			for d in basis[ticker]:
-				s += basis[ticker][d][0]
-			return s
-		
-		def getBasis(ticker, update = False, shareCount = False):
-			if not ticker in basis:
-				return 0
-		
-			basisVal = 0
-			basisShares = 0
-			if shareCount:
-				# Use up all shares in shareCount
-				for d in basis[ticker]:
-					(s, pps) = basis[ticker][d]
-					if s > shareCount:
-						basisVal += shareCount * pps
-						basisShares += shareCount
-						shareCount -= shareCount
-						break
-					else:
-						basisVal += s * pps
-						basisShares += s
-						shareCount -= s
-				if update and shareCount > 0:
-					update.addError("Invalid share count for " + ticker)
-			else:
-				# Compute over all shares
-				for d in basis[ticker]:
-					(s, pps) = basis[ticker][d]
-					basisVal += s * pps
-					basisShares += s
-			
-			if basisShares == 0:
-				return 0
-			else:
-				return basisVal / basisShares
-
-		def getBasisValue(ticker):
-			if not ticker in basis:
-				return 0
-		
-			val = 0
-			# Compute over all shares
-			for d in basis[ticker]:
-				(s, pps) = basis[ticker][d]
-				val += s * pps
-			
-			return val
-
-		def removeFromBasis(ticker, remove):
-			while ticker in basis and len(basis[ticker]) > 0 and abs(remove) > 0:
-				(s, pricePerShare) = basis[ticker][basis[ticker].keys()[0]]
-				if abs(s) > abs(remove):
-					basis[ticker][basis[ticker].keys()[0]] = (s - remove, pricePerShare)
-					remove = 0
-
-					# Update combined basis
-					d = datetime.datetime(t.date.year, t.date.month, t.date.day)
-					if not d in combinedBasis:
-						combinedBasis[d] = 0.0
-					else:
-						combinedBasis[d] -= abs(remove * pricePerShare)
+	def getRebuildPool(self, tickers):
+		'''Return the process pool for rebuilding positions, or False to rebuild positions one at a time.
+		The pool is only available if startRebuildPool was called at startup.'''
+		if not rebuildPool:
+			return False
+		if len(tickers) < 8 or not appGlobal.getApp().prefs.getParallelRebuild():
+			return False
+		return rebuildPool
+
+	def getRebuildLookups(self, stockData, ticker, transactions):
+		'''Return the database lookups needed by rebuildPosition for a ticker.
+		The first is the nearest price of transactions without a price per share,
+		the second is the prior position of a ticker change.  Both are indexed by
+		transaction index.'''
+		nearestPrices = {}
+		tickerChangePositions = {}
+		priceDates = []
+		for i in range(len(transactions)):
+			t = transactions[i]
+			if t.pricePerShare < 1.0e-6:
+				if t.type in [Transaction.buy, Transaction.transferIn]:
+					needPrice = True
+				elif t.type == Transaction.dividendReinvest:
+					needPrice = not (t.getTotalIgnoreFee() > 0 and t.shares > 0)
+				elif t.type == Transaction.transferOut:
+					needPrice = not t.getTotalIgnoreFee() > 0
 				else:
-					del basis[ticker][basis[ticker].keys()[0]]
-					remove -= s
+					needPrice = False
+				if needPrice:
+					nearestPrices[i] = t.date
+					priceDates.append(t.date)
 
-					# Update combined basis
-					d = datetime.datetime(t.date.year, t.date.month, t.date.day)
-					if not d in combinedBasis:
-						combinedBasis[d] = 0.0
-					else:
-						combinedBasis[d] -= abs(s * pricePerShare)
-			if abs(remove) > 1.0e-6:
-				if update:
-					if ticker in basis:
-						update.addError("Could not finish basis for %s %s %s" % (ticker, remove, basis[ticker]))
-					else:
-						update.addError("Could not finish basis for %s %s (no basis)" % (ticker, remove))
-			
-		def adjustBasisStockDividend(ticker, adjustShares):
-			"""Add or remove shares from basis"""
-			shares = getShares(ticker)
-			if shares == 0:
-				if update:
-					update.addError("Split but zero shares for " + ticker)
-				return
-			shareFactor = (shares + adjustShares) / shares
-			if shareFactor == 0:
-				if update:
-					update.addError("Split to zero shares for " + ticker)
-				return
-			
-			for d in basis[ticker]:
-				(s, pps) = basis[ticker][d]
-				basis[ticker][d] = (s * shareFactor, pps / shareFactor)
-		
-		def adjustBasisValue(ticker, percent):
-			"""Modify basis value by percent"""
-			for d in basis[ticker]:
-				(s, pps) = basis[ticker][d]
-				basis[ticker][d] = (s, pps * percent)
-		
-		def dumpOptionsBasis():
-			print "options dump"
-			for d in longOptionsBasis:
-				for i in range(len(longOptionsBasis[d])):
-					(ignoreTicker, s, pps, strike, expire) = longOptionsBasis[d][i]
-					print "long ", ignoreTicker, s, strike, expire, "pps", pps
-			for d in shortOptionsBasis:
-				for i in range(len(shortOptionsBasis[d])):
-					(ignoreTicker, s, pps, strike, expire) = shortOptionsBasis[d][i]
-					print "short", ignoreTicker, s, strike, expire, "pps", pps
-
-		# TODO: do not combine individual days
-		def addToOptionsBasis(ticker, d, s, pps, strike, expire):
-			# Decide whether short or long
-			if s > 0:
-				b = longOptionsBasis
-			else:
-				b = shortOptionsBasis
-			
-			if d in b:
-				# Update basis for this day
-				b[d].append((ticker, s, pps, strike, expire))
-			else:
-				b[d] = [(ticker, s, pps, strike, expire)]
-		
-			# Update combined basis
-			# TODO: Should this be done?
-			d = datetime.datetime(d.year, d.month, d.day)
-			if not d in combinedBasis:
-				combinedBasis[d] = 0.0
-			combinedBasis[d] += abs(s * pps)
-		
-		def getOptionsShares(ticker):
-			s = 0
-			for d in longOptionsBasis:
-				for i in range(len(longOptionsBasis[d])):
-					s += longOptionsBasis[d][i][1]
-			for d in shortOptionsBasis:
-				for i in range(len(shortOptionsBasis[d])):
-					s += abs(shortOptionsBasis[d][i][1])
-			return s
-		
-		def getOptionsBasis(ticker, update = False):
-			basisVal = 0
-			basisShares = 0
-			# Compute over all shares
-			for d in longOptionsBasis:
-				for i in range(len(longOptionsBasis[d])):
-					(ignoreTicker, s, pps, strike, expire) = longOptionsBasis[d][i]
-					basisVal += s * pps
-					basisShares += s
-			for d in shortOptionsBasis:
-				for i in range(len(shortOptionsBasis[d])):
-					(ignoreTicker, s, pps, strike, expire) = shortOptionsBasis[d][i]
-					basisVal += s * pps
-					basisShares += s
-			
-			if basisShares == 0:
-				return 0
-			else:
-				return basisVal / basisShares
-
-		def getOptionsBasisValue(ticker, update = False):
-			basisVal = 0
-			# Compute over all shares
-			for d in longOptionsBasis:
-				for i in range(len(longOptionsBasis[d])):
-					(ignoreTicker, s, pps, strike, expire) = longOptionsBasis[d][i]
-					basisVal += s * pps
-			for d in shortOptionsBasis:
-				for i in range(len(shortOptionsBasis[d])):
-					(ignoreTicker, s, pps, strike, expire) = shortOptionsBasis[d][i]
-					basisVal += s * pps
-			
-			return basisVal
-		
-		def getOptionsValue(ticker):
-			value = 0.0
-			
-			for d in longOptionsBasis:
-				for i in range(len(longOptionsBasis[d])):
-					(optionTicker, s, pps, strike, expire) = longOptionsBasis[d][i]
-					
-					# TODO: Determine price for this option
-					price = pps
-					
-					value += s * price
+			# Only the first transaction of a ticker may be a ticker change
+			if i == 0 and t.type == Transaction.tickerChange and t.ticker != ticker:
+				tickerChangePositions[i] = self.getPositionOnDate(t.ticker, t.date - datetime.timedelta(1))
 
-			for d in shortOptionsBasis:
-				for i in range(len(shortOptionsBasis[d])):
-					(optionTicker, s, pps, strike, expire) = shortOptionsBasis[d][i]
+		# Look up all prices with one query
+		if priceDates:
+			prices = stockData.getPricesAt(ticker, priceDates, 7)
+			for i in nearestPrices:
+				nearestPrices[i] = prices[nearestPrices[i]]
 
-					# TODO: Determine price for this option
-					price = pps
+		return (nearestPrices, tickerChangePositions)
 
-					value += (pps - price) * s
-			
-			return value
-		
-		def getSpecificOptionsBasis(optionStrike, optionExpire):
-			basisVal = 0
-			basisShares = 0
-			# Compute over matching shares
-			for d in longOptionsBasis:
-				for i in range(len(longOptionsBasis[d])):
-					(ignoreTicker, s, pps, strike, expire) = longOptionsBasis[d][i]
-					if strike == optionStrike and expire == optionExpire:
-						basisVal += s * pps
-						basisShares += s
-			for d in shortOptionsBasis:
-				for i in range(len(shortOptionsBasis[d])):
-					(ignoreTicker, s, pps, strike, expire) = shortOptionsBasis[d][i]
-					if strike == optionStrike and expire == optionExpire:
-						basisVal += s * pps
-						basisShares += s
-			
-			if basisShares == 0:
-				return 0
-			else:
-				return basisVal / basisShares
-
-		def expireOptions(ticker, optionStrike, optionExpire, date):
-			for thisBasis in [longOptionsBasis, shortOptionsBasis]:
-				for d in thisBasis:
-					for i in range(len(thisBasis[d])):
-						(thisTicker, s, pps, strike, expire) = thisBasis[d][i]
-						if ticker.endswith("call"):
-							optionType = Transaction.optionCall
-						else:
-							optionType = Transaction.optionPut
-						price = appGlobal.getApp().stockData.getOptionPrice(thisTicker, optionExpire, optionStrike, date, optionType)
-						if ticker == thisTicker and strike == optionStrike and expire == optionExpire:
-							if s < 0:
-								# Sell to open / buy to close
-								#twrr.removeShares(thisTicker + " shares", abs(s) * 100, optionStrike)
-								twrr.coverShares(thisTicker, abs(s), 0)
-							else:
-								# Buy to open / sell to close
-								#twrr.removeShares(thisTicker + " shares", abs(s) * 100, optionStrike)
-								twrr.removeShares(thisTicker, abs(s), 0)
-							removeFromOptionsBasis(thisTicker, s, strike, expire)
-
-		def checkOptionsExpiration(ticker, date):
-			# Return True if expired an option
-			expired = False
-			
-			for thisBasis in [longOptionsBasis, shortOptionsBasis]:
-				for d in thisBasis:
-					for i in range(len(thisBasis[d])):
-					#while i < len(thisBasis[d]):
-						(thisTicker, s, pps, strike, expire) = thisBasis[d][i]
-						# Expire 2 days after the friday
-						date2 = datetime.datetime(date.year, date.month, date.day)
-						expire2 = datetime.datetime(expire.year, expire.month, expire.day) + datetime.timedelta(days = 2)
-						if date2 >= expire2:
-							expired = True
-							expireOptions(ticker, strike, expire, date)
-							'''removeFromOptionsBasis(thisTicker, s, strike, expire)
-							if s > 0:
-								# Buy to open
-								twrr.removeShares(thisTicker, abs(s), 0)
-							elif s < 0:
-								# Sell to open
-								twrr.coverShares(thisTicker, abs(s) * 100, strike)
-								twrr.removeSharesNoPrice(thisTicker + "income", abs(s))'''
-			
-			return expired
-		
-		def removeFromOptionsBasis(ticker, remove, strike, expire):
-			if remove > 0:
-				thisBasis = longOptionsBasis
-			else:
-				thisBasis = shortOptionsBasis
-			
-			for d in thisBasis:
-				i = 0
-				while d in thisBasis and i < len(thisBasis[d]) and abs(remove) > 1.0e-6:
-					(optionTicker, s, pps, str, e) = thisBasis[d][i]
-					# Check for right ticker, strike price, expiration
-					if ticker != optionTicker or (str - strike) > 1.0e-6 or e != expire:
-						i += 1
-						continue
-					
-					if abs(s) > abs(remove):
-						thisBasis[d][i] = (ticker, s - remove, pps, str, e)
-						remove = 0
-	
-						# Update combined basis
-						upd = datetime.datetime(t.date.year, t.date.month, t.date.day)
-						if not upd in combinedBasis:
-							combinedBasis[upd] = 0.0
-						else:
-							combinedBasis[upd] -= abs(remove * pps)
-						i += 1
-					else:
-						# Remove all of basis
-						del thisBasis[d][i]
-						remove -= s
-	
-						# Update combined basis
-						upd = datetime.datetime(t.date.year, t.date.month, t.date.day)
-						if not remove in combinedBasis:
-							combinedBasis[upd] = 0.0
-						else:
-							combinedBasis[upd] -= abs(s * pps)
-			if abs(remove) > 1.0e-6:
-				if update:
-					update.addError("Could not finish options basis for %s remove %f strike %f expire %s" % (ticker, remove, strike, expire))
-		
+	def rebuildPositionHistory(self, stockData, update = False):
+		'''Rebuild the position history for a brokerage, benchmark or combined portfolio'''
 		if self.isBank():
 			self.rebuildBankPositionHistory(update)
 			return
@@ -2343,18 +2385,27 @@ class Portfolio:
 				if update:
 					update.addMessage("No transactions found")
 					update.setSubTask(100)
+				self.rebuildCurrentPositions()
+				self.portPrefs.setLastRebuild()
 				self.portPrefs.setDirty(False)
 				self.db.commitTransaction()
 				appGlobal.getApp().endBigTask()
 				return
 			
+			# Benchmarks are simulated directly from stock data
 			if self.isBenchmark():
 				if update:
-					update.setSubTask(60)
-				self.rebuildBenchmarkTransactions(stockData, update)
+					update.setSubTask(100)
+				self.rebuildBenchmarkHistory(stockData, update)
 				self.readFromDb()
+				self.rebuildCurrentPositions()
+				self.portPrefs.setLastRebuild()
+				self.portPrefs.setDirty(False)
+				self.db.commitTransaction()
+				appGlobal.getApp().endBigTask()
 				if update:
-					update.finishSubTask()
+					update.finishSubTask("Finished rebuilding " + self.name)
+				return
 	
 			if update:
 				update.setSubTask(100)
@@ -2373,12 +2424,23 @@ class Portfolio:
 			# Total combined value indexed by date
 			combinedValue = {}
 			
-			# Basis dictionary key is ticker, dictionary of date, content is list of (shares, price per share)
-			basis = {}
-	
-			# Total combined basis indexed by date
-			# First pass through = individual basis adjustments
-			combinedBasis = {}
+			def mergePosition(transactions, result, log = False):
+				(historyRows, dailyValues, pricedTransactions) = result
+				
+				# Keep prices looked up during the rebuild
+				for (i, pricePerShare, total) in pricedTransactions:
+					transactions[i].pricePerShare = pricePerShare
+					transactions[i].total = total
+				
+				self.db.insertMany("positionHistory", self.historyDates.saveRows(historyRows))
+				for (d, value) in dailyValues:
+					if d in combinedValue:
+						combinedValue[d] += value
+					else:
+						combinedValue[d] = value
+				
+				if log and update:
+					log.replay(update)
 	
 			tickers = self.getTickers(includeAllocation = True)
 	
@@ -2417,6 +2479,12 @@ class Portfolio:
 			# cashToAdd[date] = deposit amount
 			cashToAdd = {}
 	
+			# Positions are simulated independently, in a process pool if available, and merged
+			# back in ticker order so the result does not depend on which process finishes first.
+			# Cash and tickers created by a spinoff or ticker change depend on the positions before
+			# them so wait for everything before those is merged.
+			pool = self.getRebuildPool(tickers)
+			pending = []
 			count = 0
 			for ticker in tickers:
 				if update:
@@ -2425,20 +2493,21 @@ class Portfolio:
 						break
 				count += 1
 				
+				if ticker == "__CASH__" or ticker in moveBack:
+					for (pendingTransactions, pendingResult) in pending:
+						mergePosition(pendingTransactions, *pendingResult.get())
+					pending = []
+				
 				#if update:
 				#	if ticker == "__CASH__":
 				#		update.addMessage("Computing cash position")
 				#	else:
 				#		update.addMessage("Computing position " + ticker)
 				transactions = self.getTransactions(ticker, ascending = True)
-				
-				# Options basis key is date, content is list of (shares, price per share, strike, expire)
-				longOptionsBasis = {}
-				shortOptionsBasis = {}
-				
+			
 				if self.portPrefs.getAutoAdjust():
 					self.addPositionCheckTransactions(ticker, transactions, portfolioFirstDate, cashToAdd, update)
-				
+			
 				if self.portPrefs.getAutoSplit() or self.portPrefs.getAutoDividend():
 					self.addAutoSplitDividendTransactions(ticker, transactions, update)
 
@@ -2479,11 +2548,11 @@ class Portfolio:
 									-amount,
 									auto = True)
 							t2.save(self.db)
-						
+					
 						# Re-read transactions from database
 						self.readFromDb()
 						transactions = self.getTransactions(ticker, ascending = True)
-				
+			
 				# If no transactions for a stock, skip
 				# The cash position may have no transactions if all we have is a transfer in
 				if not transactions and ticker != "__CASH__":
@@ -2514,398 +2583,16 @@ class Portfolio:
 					if not prices and not optionPrices:
 						# Still no data, ignore
 						continue
-	
-				# Loop through first date until now
-				currentTrans = 0
-				currentPrice = 0
-				# Begin on first transaction.  Always begin cash on portfolio first date.
-				if transactions and ticker != "__CASH__":
-					date = transactions[0].getDate()
-				else:
-					date = portfolioFirstDate
-				date = datetime.datetime(date.year, date.month, date.day, 23, 59, 59)
-				price = False
-				shares = 0.0
-				value = 0.0
-				adjustedValue = 0.0
-				totalFees = 0
-				totalDividends = 0
-				totalProfit = 0 # Profit after fees
-				yieldCount = 0
-				doneWithTicker = False
-				twrr = Twrr() # Time weighted rate of return
-				if ticker == "__CASH__":
-					twrr.addShares("__CASH__", 0, 1)
-				while date < now and not doneWithTicker:
-					yieldCount += 1
-					if yieldCount == 100:
-						yieldCount = 0
-						if update:
-							update.appYield()
-							if update.canceled:
-								break
-					totalTrans = 0
-					todayDividends = 0
-					twrr.beginTransactions()
-					while currentTrans < len(transactions) and transactions[currentTrans].getDate() <= date and not doneWithTicker:
-						t = transactions[currentTrans]
-						
-						# Check that first transaction is a buy or transferIn (if not cash), or a spinoff or tickerChange and we are ticker2
-						if currentTrans == 0 and ticker != "__CASH__":
-							if not t.type in [Transaction.buy, Transaction.short, Transaction.buyToOpen, Transaction.sellToOpen, Transaction.transferIn] and ((t.type != Transaction.spinoff and t.type != Transaction.tickerChange) or t.ticker2 != ticker):
-								if update:
-									update.addError("The first transaction for %s does not add to its shares.  Ignoring position." % ticker)
-								doneWithTicker = True
-								break
-						currentTrans += 1
-						totalTrans += 1
-	
-						if t.type == Transaction.deposit:
-							shares += t.getTotal()
-							twrr.addShares(ticker, t.getTotal(), 1)
-						elif t.type == Transaction.withdrawal:
-							shares += t.getTotal()
-							twrr.removeShares(ticker, -t.getTotal(), 1)
-						elif t.type == Transaction.buy or t.type == Transaction.transferIn:
-							# Lookup price if unavailable
-							if t.pricePerShare < 1.0e-6:
-								p = stockData.getNearestPrice(ticker, t.date)
-								if p:
-									t.pricePerShare = p["close"]
-									t.setTotal(t.pricePerShare * abs(t.shares) - t.getFee())
-								else:
-									if update:
-										update.addError("Buy transaction has no price per share %s" % t)
-									continue
-	
-							totalProfit -= abs(t.total)
-							twrr.addShares(t.formatTicker(), t.getShares(), t.pricePerShare)							
-
-							# Check for transfer in option
-							if t.isOption():
-								# Add to basis tracker
-								addToOptionsBasis(t.formatTicker(), t.date, t.shares, t.pricePerShare, t.optionStrike, t.optionExpire)
-							else:
-								shares += abs(t.shares)
-
-								# Add to basis tracker
-								addToBasis(ticker, t.date, t.shares, t.pricePerShare)
-						elif t.type == Transaction.sell:
-							if shares <= 0:
-								if update:
-									update.addError("Sell transaction but no shares %s" % t)
-								continue
-							shares -= abs(t.shares)
-							totalProfit += t.getTotal()
-							twrr.removeShares(ticker, t.getShares(), t.pricePerShare)
-							
-							# Remove t.shares from basis tracker
-							removeFromBasis(ticker, abs(t.shares))
-						elif t.type == Transaction.buyToOpen:
-							totalProfit -= abs(t.total)
-							# Use formatTicker() because it includes strike, option
-							#twrr.addShares(t.formatTicker() + " shares", t.getShares() * 100, t.optionStrike)
-							twrr.addShares(t.formatTicker(), t.getShares(), t.pricePerShare)
-							
-							# Add to basis tracker
-							addToOptionsBasis(t.formatTicker(), t.date, t.shares, t.pricePerShare, t.optionStrike, t.optionExpire)
-						elif t.type == Transaction.sellToClose:
-							totalProfit += t.getTotal()
-							#twrr.removeShares(t.formatTicker() + " shares", t.getShares() * 100, t.optionStrike)
-							twrr.removeShares(t.formatTicker(), t.getShares(), t.pricePerShare)
-							
-							# Remove t.shares from basis tracker
-							removeFromOptionsBasis(t.formatTicker(), abs(t.shares), t.optionStrike, t.optionExpire)
-						elif t.type == Transaction.short:
-							# Lookup price if unavailable
-							if not t.pricePerShare:
-								if update:
-									update.addError("Transaction has no price per share %s" % t)
-								continue
-	
-							# Shorts reduce shares and add to basis
-							shares -= abs(t.shares)
-							totalProfit += t.getTotal()
-							twrr.shortShares(ticker, t.getShares(), t.pricePerShare)
-							
-							# Add to basis tracker
-							addToBasis(ticker, t.date, -abs(t.shares), t.pricePerShare)
-						elif t.type == Transaction.cover:
-							if shares >= 0:
-								if update:
-									update.addError("Cover transaction but no shares %s" % t)
-								continue
-
-							# Cover adds to shares and removes from basis
-							shares += abs(t.shares)
-							twrr.coverShares(ticker, t.getShares(), t.pricePerShare)
-							
-							# Remove t.shares from basis tracker
-							totalProfit += t.getTotal()
-							removeFromBasis(ticker, -abs(t.shares))
-						elif t.type == Transaction.sellToOpen:
-							# Shorts reduce shares and add to basis
-							totalProfit += t.getTotal()
-							
-							# For sellToOpen we track 2 positions: One is exposure to the underlying stock,
-							# the other is the value of the options.  Assume 100 shares per option.
-							#twrr.addShares(t.formatTicker() + " shares", t.getShares() * 100, t.optionStrike)
-							twrr.shortShares(t.formatTicker(), t.getShares(), t.pricePerShare)
-							
-							# Add to basis tracker
-							addToOptionsBasis(t.formatTicker(), t.date, -abs(t.shares), t.pricePerShare, t.optionStrike, t.optionExpire)
-						elif t.type == Transaction.buyToClose:
-							#twrr.removeShares(t.formatTicker() + " shares", t.getShares() * 100, t.optionStrike)
-							twrr.coverShares(t.formatTicker(), t.getShares(), t.pricePerShare)
-							
-							# Remove t.shares from basis tracker
-							totalProfit += t.getTotal()
-							removeFromOptionsBasis(t.formatTicker(), -abs(t.shares), t.optionStrike, t.optionExpire)
-						elif t.type in [Transaction.assign, Transaction.exercise, Transaction.expire]:
-							expireOptions(t.formatTicker(), t.optionStrike, t.optionExpire, t.date)
-						elif t.type == Transaction.dividend:
-							todayDividends += t.getTotalIgnoreFee()
-							twrr.addDividend(t.getTotalIgnoreFee())
-							if ticker == "__CASH__":
-								twrr.addShares(ticker, t.getTotalIgnoreFee(), 1)
-							# Fee will be subtracted from todayDividends later
-							if t.getFee():
-								todayDividends += t.getFee()
-						elif t.type == Transaction.expense:
-							# Note: Fees for all transactions are handled somewhere else
-							# Here we only keep track of fees from the total
-							if t.total:
-								if t.fee:
-									thisFee = abs(t.total) - abs(t.fee)
-								else:
-									thisFee = abs(t.total)
-								totalFees += thisFee
-								totalProfit -= thisFee
-							else:
-								totalProfit -= t.getFee()
-						elif t.type == Transaction.dividendReinvest:
-							if t.pricePerShare < 1.0e-6:
-								if t.getTotalIgnoreFee() > 0 and t.shares > 0:
-									t.pricePerShare = t.getTotalIgnoreFee() / t.shares
-								else:
-									p = stockData.getNearestPrice(ticker, t.date)
-									if p:
-										t.pricePerShare = p["close"]
-									else:
-										if update:
-											update.addError("Dividend reinvest transaction has no price per share %s" % t)
-										continue
-							
-							# Add to today's dividends, but don't count as profit
-							# Because we are increasing share count
-							shares += abs(t.shares)
-							todayDividends += t.getTotalIgnoreFee()
-							totalProfit -= t.getTotalIgnoreFee()
-							twrr.addDividendReinvest(ticker, t.getShares(), t.pricePerShare)
-	
-							# Add to basis tracker
-							addToBasis(ticker, t.date, t.shares, t.pricePerShare)
-						elif t.type == Transaction.transferOut:
-							if t.pricePerShare < 1.0e-6:
-								if t.getTotalIgnoreFee() > 0:
-									t.pricePerShare = t.getTotalIgnoreFee() / t.shares
-								elif price:
-									# Use last price data
-									t.pricePerShare = price
-								else:
-									p = stockData.getNearestPrice(ticker, t.date)
-									if p:
-										t.pricePerShare = p["close"]
-									else:
-										if update:
-											update.addError("transaction has no price per share %s" % t)
-										continue
-							
-							totalProfit += t.getTotal()
-							twrr.removeShares(t.formatTicker(), t.getShares(), t.pricePerShare)
-
-							if t.isOption():
-								# Remove t.shares from basis tracker
-								removeFromOptionsBasis(t.formatTicker(), abs(t.shares), t.optionStrike, t.optionExpire)
-							else:
-								shares -= abs(t.shares)
-
-								# Remove t.shares from basis tracker
-								removeFromBasis(ticker, abs(t.shares))
-						elif t.type in [Transaction.stockDividend, Transaction.split]:
-							if t.type == Transaction.stockDividend:
-								adjustShares = t.shares
-							elif t.getTotal() > 0:
-								# A 2-1 split has a value of 2.0
-								adjustShares = math.floor(shares * (t.getTotal() - 1.0))
-							else:
-								raise Exception("Invalid split value for %s" % t)
-							shares += adjustShares
-							adjustBasisStockDividend(ticker, adjustShares)
-							
-							twrr.stockDividendShares(ticker, adjustShares)
-						elif t.type == Transaction.adjustment:
-							adjustedValue += t.getTotal()
-							twrr.addAdjustment(t.getTotal())
-						elif t.type == Transaction.spinoff:
-							# Determine price per share
-							if t.pricePerShare:
-								pps = t.pricePerShare
-							else:
-								if update:
-									update.addError("Transaction has no price per share: %s" % t)
-								continue
-	
-							# Dividend if ticker, buy if ticker2
-							if t.ticker == ticker:
-								spinoffValue = t.shares * pps
-								if value > 0:
-									basisValue = getBasisValue(ticker)
-									totalProfit += spinoffValue
-									twrr.adjustBasis(ticker, spinoffValue)
-									
-									# Adjust basis
-									percent = (basisValue - spinoffValue) / basisValue
-									if percent < 0:
-										percent = 0
-									if percent >= 0:
-										adjustBasisValue(ticker, percent)
-									elif update:
-										update.addError("adjust basis for spinoff, percent less than 0: %f - %f" % (basisValue, spinoffValue))
-							else:
-								shares += abs(t.shares)
-								totalProfit -= pps
-								twrr.addShares(ticker, t.getShares(), pps)
-								
-								# TODO: Handle for options?
-								addToBasis(ticker, t.date, t.shares, pps)
-						elif t.type == Transaction.tickerChange:
-							if ticker == t.ticker:
-								# Old ticker
-								# TODO: Handle for options?
-								removeFromBasis(ticker, shares)
-								shares = 0
-								
-								# Force exit from loop, this stock no longer exists
-								doneWithTicker = True
-							else:
-								# New ticker, get stock data of original ticker
-								if currentTrans != 1:
-									if update:
-										update.addMessage("The ticker change transaction from %s to %s is not the first transaction for %s." % (t.ticker, t.ticker2, t.ticker2))
-									continue
-								pos = self.getPositionOnDate(t.ticker, t.date - datetime.timedelta(1))
-								if not pos:
-									if update:
-										update.addMessage("The ticker change transaction from %s to %s does not have data" % (t.ticker, t.ticker2))
-									continue
-								
-								# Start calculating based off of the position data
-								# First use given transaction shares, if not, use position shares
-								if t.shares > 0:
-									shares = abs(t.shares)
-								elif pos["shares"] > 0:
-									shares = abs(pos["shares"])
-								if shares > 0:
-									pps = pos["value"] / shares
-									# TODO: Handle for options?
-									addToBasis(ticker, t.date, shares, pps)
-						elif update:
-							update.addError("Did not use transaction %s for rebuilding" % t)
-						
-						# Adjust for fee
-						if t.fee:
-							totalFees += t.fee
-						if t.getFee():
-							twrr.addFee(t.getFee())
-							if ticker == "__CASH__":
-								twrr.removeShares(ticker, t.getFee(), 1)
-								shares -= t.getFee()
-								value -= t.getFee()
-					
-					# Do not automatically expire options
-					expired = checkOptionsExpiration(ticker, date)
-					if expired:
-						totalTrans += 1
-					
-					# Build current value based on shares and price
-					if currentPrice < len(prices):
-						# Advance to next price if not cash
-						if ticker != "__CASH__":
-							while currentPrice < len(prices) - 1 and prices[currentPrice + 1]["date"] <= date:
-								currentPrice += 1
-
-						price = prices[currentPrice]["close"]
-						if ticker == "__CASH__":
-							value = shares
-						elif getShares(ticker) >= 0:
-							value = getShares(ticker) * price + adjustedValue
-						else:
-							# Short
-							value = (price - getBasis(ticker)) * getShares(ticker) + adjustedValue
-						
-						twrr.setValue(ticker, price)
-						
-						# Use yesterday's value or today's value if position was opened today
-						if todayDividends > 0:
-							totalProfit += todayDividends
-							totalDividends += todayDividends
-
-							if ticker == "__CASH__":
-								shares += todayDividends
-								value += todayDividends
-
-						# Adjust fee factor for fees today's fees
-						# Use today's value or yesterday's value if position was closed today
-					elif price:
-						# Use last price
-						value = getShares(ticker) * price + adjustedValue
-					else:
-						# No price
-						value = 0
-					
-					try:
-						twrr.endTransactions()
-					except Exception, e:
-						if update:
-							update.addException()
-						else:
-							raise
 
-					# Update value based on options
-					# TODO: Calculate value of options better!!!
-					optionsShares = getOptionsShares(ticker)
-					value += getOptionsValue(ticker)
-					
-					if ticker == "__CASH__":
-						profitFee = totalProfit
-					else:
-						profitFee = value + totalProfit
-					
-					profitDividend = profitFee + totalFees
-					profitSplit = profitDividend - totalDividends
-
-					if (abs(shares) + abs(getOptionsShares(ticker)) > 1.0e-6 or totalTrans > 0 or currentTrans < len(transactions) or ticker == "__CASH__") and not doneWithTicker:
-						self.db.insert("positionHistory", {
-							"date": date.strftime("%Y-%m-%d 00:00:00"),
-							"ticker": ticker,
-							"shares": getShares(ticker),
-							"options": getOptionsShares(ticker),
-							"value": value,
-							"normSplit": twrr.getReturnSplit(),
-							"normDividend": twrr.getReturnDiv(),
-							"normFee": twrr.getReturnFee(),
-							"profitSplit": profitSplit,
-							"profitDividend": profitDividend,
-							"profitFee": profitFee})
-	
-					d = datetime.datetime(date.year, date.month, date.day)				
-					if d in combinedValue:
-						combinedValue[d] += value
-					else:
-						combinedValue[d] = value
-	
-					date += datetime.timedelta(1)
+				nearestPrices, tickerChangePositions = self.getRebuildLookups(stockData, ticker, transactions)
+				args = (ticker, transactions, prices, portfolioFirstDate, now, nearestPrices, tickerChangePositions)
+				if pool:
+					pending.append((transactions, pool.apply_async(rebuildPositionWorker, (args,))))
+				else:
+					mergePosition(transactions, rebuildPosition(*(args + (update,))))
+			
+			for (pendingTransactions, pendingResult) in pending:
+				mergePosition(pendingTransactions, *pendingResult.get())
 
 			# Now build combined position
 			if update:
@@ -3028,7 +2715,7 @@ class Portfolio:
 				profitDividend = profitFee + totalFees
 				profitSplit = profitDividend - totalDividends
 				
-				self.db.insert("positionHistory", {
+				self.db.insert("positionHistory", self.historyDates.saveRow({
 					"date": date.strftime("%Y-%m-%d 00:00:00"),
 					"ticker": "__COMBINED__",
 					"shares": value,
@@ -3038,68 +2725,13 @@ class Portfolio:
 					"normFee": normFee,
 					"profitSplit": profitSplit,
 					"profitDividend": profitDividend,
-					"profitFee": profitFee})
+					"profitFee": profitFee}))
 				
 				lastValue = value
 			
-			# Now build benchmark
-			if update:
-				update.addMessage("Computing benchmark")
-			currentCashTrans = 0
-			dates = sorted(combinedValue.keys())
-			first = True
-			if not self.isBenchmark():
-				benchmark = Portfolio(self.getBenchmark())
-
-				benchmarkShares = 0
-				totalCashIn = 0
-				benchmarkValues = benchmark.getPositionHistory("__COMBINED__")
-				for date in dates:
-					endOfDay = datetime.datetime(date.year, date.month, date.day, 23, 59, 59)
-					
-					# Update deposited/withdrawn money
-					cashInToday = 0
-					while currentCashTrans < len(cashTransactions) and cashTransactions[currentCashTrans].date <= endOfDay:
-						t = cashTransactions[currentCashTrans]
-						if t.type in [Transaction.deposit, Transaction.transferIn]:
-							cashInToday += abs(t.total)
-						elif t.type in [Transaction.withdrawal, Transaction.transferOut]:
-							cashInToday -= abs(t.total)
-						elif t.type in [Transaction.dividend, Transaction.adjustment, Transaction.expense]:
-							# Dividends/adjustments are not cash in/out
-							pass
-						else:
-							cashIn -= abs(t.total)
-						currentCashTrans += 1
-					
-					# Buy or sell shares
-					if cashInToday != 0:
-						totalCashIn += cashInToday
-						if date in benchmarkValues and benchmarkValues[date]['value'] != 0:
-							benchmarkShares += cashInToday / benchmarkValues[date]['value']
-					
-					# Update values
-					if date in benchmarkValues:
-						value = benchmarkShares * benchmarkValues[date]['value']
-						
-						if first:
-							first = False
-							firstNormSplit = benchmarkValues[date]['normSplit']
-							firstNormDividend = benchmarkValues[date]['normDividend']
-							firstNormFee = benchmarkValues[date]['normFee']
-
-						self.db.insert("positionHistory", {
-							"date": date.strftime("%Y-%m-%d 00:00:00"),
-							"ticker": "__BENCHMARK__",
-							"shares": benchmarkShares,
-							"value": value,
-							"normSplit": benchmarkValues[date]['normSplit'] / firstNormSplit,
-							"normDividend": benchmarkValues[date]['normDividend'] / firstNormDividend,
-							"normFee": benchmarkValues[date]['normFee'] / firstNormFee,
-							"profitSplit": value - totalCashIn,
-							"profitDividend": value - totalCashIn,
-							"profitFee": value - totalCashIn})
-
+			# The benchmark comparison is computed when first needed by getBenchmarkHistory
+			self.rebuildCurrentPositions()
+			self.portPrefs.setLastRebuild()
 			self.portPrefs.setDirty(False)
 			self.db.commitTransaction()
 			appGlobal.getApp().endBigTask()
@@ -3365,7 +2997,28 @@ class Portfolio:
 			* doBenchmark: Whether the benchmark should be included
 			* doGradient: Whether to include a gradient
 		
+		Charts are kept in memory until a portfolio is rebuilt or marked dirty.
 		'''
+		if type(tickers) == list:
+			key = tuple(tickers)
+		else:
+			key = tickers
+		if doBenchmark:
+			benchmark = self.getBenchmark()
+		else:
+			benchmark = False
+		key = (self.db.name, key, period, chartType, doSplit, doDividend, doFee, benchmark, doGradient, title, datetime.date.today())
+		series = chartSeriesCache.get(key)
+		if series:
+			chartBase.setSeries(series)
+			return
+
+		generation = chartSeriesCache.generation
+		self.buildChart(chartBase, stockData, tickers, period, chartType, doSplit, doDividend, doFee, doBenchmark, doGradient, title)
+		chartSeriesCache.set(key, chartBase.getSeries(), generation)
+
+	def buildChart(self, chartBase, stockData, tickers, period, chartType, doSplit, doDividend, doFee, doBenchmark, doGradient, title):
+		'''Draw a chart without using cached charts.  See drawChart.'''
 		# No gradient for spending
 		if chartType == "spending":
 			doGradient = False
@@ -3443,8 +3096,7 @@ class Portfolio:
 			if benchmark and benchmark.portPrefs.getDirty() and not appGlobal.getApp().prefs.getBackgroundRebuild():
 				benchmark.rebuildPositionHistory(stockData)
 			if benchmark:
-				benchmarkHistory = benchmark.getPositionHistory("__COMBINED__", startDate)
-				benchmarkKeys = sorted(benchmarkHistory.keys())
+				(benchmarkHistory, benchmarkKeys) = benchmark.getChartHistory("__COMBINED__", startDate)
 	
 			# Check for empty benchmark
 			if benchmark and len(benchmarkKeys) == 0:
@@ -3463,7 +3115,6 @@ class Portfolio:
 		normDate = False
 		firstDate = False
 		veryFirstValue = False
-		endLoop = self.getEndDate()
 		for ticker in tickers:
 			# Get price data
 			if chartType == "transactions":
@@ -3475,28 +3126,16 @@ class Portfolio:
 					p["transactions"] = p["close"]
 					p["value"] = p["close"]
 					pricesBase[p["date"]] = p
+				keys = sorted(pricesBase.keys())
 			else:
-				pricesBase = self.getPositionHistory(ticker, startDate)
+				(pricesBase, keys) = self.getChartHistory(ticker, startDate)
 			prices = pricesBase
 	
 			# Keys will be a list of all dates
-			keys = sorted(prices.keys())
 			if len(keys) == 0:
 				continue
 			firstDate = keys[0]
 	
-			# Next check for closed position
-			d = firstDate
-			d = datetime.datetime(d.year, d.month, d.day)
-	
-			# Now get old prices, fill in up to one week
-			while d < endLoop:
-				data = stockData.getPrice(ticker, d)
-				if not data:
-					d += datetime.timedelta(1)
-					continue
-				d += datetime.timedelta(1)
-	
 			chartTypes = []
 			if chartType == "total value":
 				chartTypes.append("value")
@@ -4102,7 +3741,7 @@ class Portfolio:
 			currentRow = []
 
 			if ticker in positions:
-				current = positions[ticker]["value"] / total * 100.0
+				current = positions[ticker]["weight"] * 100.0
 				currentDollar = Transaction.formatDollar(positions[ticker]["value"])
 				if ticker in allocation:
 					differenceDollar = positions[ticker]["value"] - total * allocation[ticker] / 100.0
@@ -4150,26 +3789,32 @@ class Portfolio:
 				currentRow.append("$%s%s" % (sign, dollarStr))
 			
 			if self.isBrokerage():
-				# Get last stock data
-				date = appGlobal.getApp().stockData.getLastDate(ticker)
-				if date:
-					value = appGlobal.getApp().stockData.getPrice(ticker, date)
+				# Last stock price is stored in the position snapshot
+				if ticker in positions:
+					price = positions[ticker]["price"]
+				else:
+					price = False
+					date = appGlobal.getApp().stockData.getLastDate(ticker)
+					if date:
+						value = appGlobal.getApp().stockData.getPrice(ticker, date)
+						if value:
+							price = value["close"]
+				if price:
 					cash = positions["__CASH__"]["value"]
-					if value:
-						if cash > 0 and differenceDollar < -cash:
-							differenceDollar = -cash
-						shares = differenceDollar / value["close"]
-						if shares > 0:
-							currentRow.append("Sell %.2f" % shares)
-						elif shares < 0:
-							# Buy up to cash amount of shares if we can't totally rebalance
-							# Or buy rebalancing amount plus remaining balance
-							if differenceDollar > -cash:
-								currentRow.append("Buy %.2f to %.2f" % (abs(shares), cash / value["close"]))
-							else:
-								currentRow.append("Buy %.2f" % abs(shares))
+					if cash > 0 and differenceDollar < -cash:
+						differenceDollar = -cash
+					shares = differenceDollar / price
+					if shares > 0:
+						currentRow.append("Sell %.2f" % shares)
+					elif shares < 0:
+						# Buy up to cash amount of shares if we can't totally rebalance
+						# Or buy rebalancing amount plus remaining balance
+						if differenceDollar > -cash:
+							currentRow.append("Buy %.2f to %.2f" % (abs(shares), cash / price))
 						else:
-							currentRow.append("")
+							currentRow.append("Buy %.2f" % abs(shares))
+					else:
+						currentRow.append("")
 
 			row += 1
 			data.append(currentRow)
@@ -4287,80 +3932,23 @@ class Portfolio:
 		
 		# Check for missing splits
 		for ticker in self.getPositions():
-			(first, last) = self.getPositionFirstLast(ticker)
-			dataSplits = stockData.getSplits(ticker, first, last)
-			portSplits = self.getTransactions(ticker, transType = Transaction.stockDividend)
-			for t in self.getTransactions(ticker, transType = Transaction.split):
-				portSplits.append(t)
-			
-			# Try to match actual splits with portfolio splits
-			if dataSplits and portSplits:
-				for s in dataSplits[:]:
-					for s2 in portSplits:
-						diff = abs(s["date"] - s2.date)
-						
-						if diff < datetime.timedelta(7):
-							position = self.getPositionOnDate(ticker, s["date"])
-							if position:
-								if s2.type == Transaction.stockDividend:
-									# Determine shares before ths split
-									# TODO: make work with buys/sells/etc
-									shares = position["shares"] - position["shares"] / s["value"]
-									portShares = s2.shares
-									if abs(shares - portShares) > 1.0e-6:
-										# Match but incorrect shares
-										errors.append(TransactionErrorCheck(s2.uniqueId, ticker, s2.type, s2.date, s["date"], s2.shares, shares))
-								else:
-									if abs(s2.total - s["value"]) > 1.0e-6:
-										# Match but incorrect shares
-										errors.append(TransactionErrorCheck(s2.uniqueId, ticker, s2.type, s2.date, s["date"], s2.total, s["value"]))
-							
-							# Check for proper date based on stock values
-							# Start one week prior, find best match
-							interval = -7
-							bestInterval = -7
-							bestDiff = 1.0e6
-							lastValue = stockData.getPrice(ticker, s2.date + datetime.timedelta(days = interval))
-							while interval < 7:
-								interval += 1
-								nextValue = stockData.getPrice(ticker, s2.date + datetime.timedelta(days = interval))
-								if lastValue and nextValue and nextValue["close"] != 0:
-									thisSplit = lastValue["close"] / nextValue["close"]
-									thisDiff = abs(thisSplit - s["value"])
-									if thisDiff < bestDiff:
-										bestInterval = interval
-										bestDiff = thisDiff
-								if nextValue:
-									lastValue = nextValue
-							if bestInterval != 0:
-								errors.append(TransactionErrorCheck(s2.uniqueId, ticker, s2.type, s2.date, s2.date + datetime.timedelta(days = bestInterval), s2.total, s2.total))
-							
-							# Matched, remove
-							dataSplits.remove(s)
-							portSplits.remove(s2)
-							break
-			
-			# Now add missing splits to error check
-			if dataSplits:
-				for s in dataSplits:
-					date = s["date"]
-					
-					# Determine split value
-					splitVal = Transaction.splitValueToString(s["value"])
-					
-					# Determine shares for stock dividend
-					shares = "?"
-					position = self.getPositionOnDate(ticker, s["date"])
-					if position:
-						shares = position["shares"] * (s["value"] - 1.0)
-						shares = "%.3f" % shares
-
-					errors.append(TransactionErrorCheck(False, ticker, Transaction.split, s["date"], s["date"], s["value"], s["value"]))
-			
-			# Check for removed splits only if we have stock data
-			if portSplits and stockData.getFirstDate(ticker) != False:
-				for s2 in portSplits:
-					errors.append(TransactionErrorCheck(s2.uniqueId, ticker, s2.type, s2.date, s2.date, s2.total, s2.total, delete = True))
+			reconcile = TickerReconcile(self, stockData, ticker)
+			hasStockData = None
+			for (kind, s, s2, value) in reconcile.reconcileSplits():
+				if kind == TickerReconcile.wrongShares:
+					errors.append(TransactionErrorCheck(s2.uniqueId, ticker, s2.type, s2.date, s["date"], s2.shares, value))
+				elif kind == TickerReconcile.wrongValue:
+					errors.append(TransactionErrorCheck(s2.uniqueId, ticker, s2.type, s2.date, s["date"], s2.total, value))
+				elif kind == TickerReconcile.wrongDate:
+					errors.append(TransactionErrorCheck(s2.uniqueId, ticker, s2.type, s2.date, value, s2.total, s2.total))
+				elif kind == TickerReconcile.missing:
+					errors.append(TransactionErrorCheck(False, ticker, Transaction.split, s["date"], s["date"], value, value))
+				elif kind == TickerReconcile.extra:
+					# Check for removed splits only if we have stock data
+					if hasStockData is None:
+						hasStockData = stockData.getFirstDate(ticker) != False
+					if hasStockData:
+						errors.append(TransactionErrorCheck(s2.uniqueId, ticker, s2.type, s2.date, s2.date, s2.total, s2.total, delete = True))
 		
 		# Remove ignored errors
 		for e in errors[:]:
@@ -4394,6 +3982,11 @@ class Portfolio:
 			if not transactions[0].type in [Transaction.buy, Transaction.transferIn, Transaction.spinoff, Transaction.short, Transaction.sellToOpen, Transaction.buyToOpen]:
 				errors.append(["First transaction is not buy", "Severe", "The first transaction for %s is not a buy transaction.  This symbol will not be included in performance calculations.  Add a buy transaction, a transfer transaction or a spinoff transaction for this symbol." % ticker])
 				
+		# Load each position once for the position and split checks
+		reconciles = {}
+		for ticker in self.getPositions():
+			reconciles[ticker] = TickerReconcile(self, stockData, ticker)
+
 		# Check for data not matching positionCheck
 		for ticker in self.getPositions():
 			didSevere = False
@@ -4404,7 +3997,7 @@ class Portfolio:
 			
 			checks = self.getPositionCheck(ticker)
 			for check in checks:
-				pos = self.getPositionForCheck(ticker, check)
+				pos = reconciles[ticker].getPositionForCheck(check)
 				
 				# If position data is available first check shares, then value
 				if pos:
@@ -4444,55 +4037,16 @@ class Portfolio:
 
 		# Check for missing splits
 		for ticker in self.getPositions():
-			(first, last) = self.getPositionFirstLast(ticker)
-			dataSplits = stockData.getSplits(ticker, first, last)
-			portSplits = self.getTransactions(ticker, transType = Transaction.stockDividend)
-			for t in self.getTransactions(ticker, transType = Transaction.split):
-				portSplits.append(t)
-			
-			# Try to match actual splits with portfolio splits
-			if dataSplits and portSplits:
-				for s in dataSplits:
-					for s2 in portSplits:
-						diff = abs(s["date"] - s2.date)
-						
-						if diff < datetime.timedelta(7):
-							position = self.getPositionOnDate(ticker, s["date"])
-							if position:
-								if s2.type == Transaction.stockDividend:
-									# Determine shares before ths split
-									# TODO: make work with buys/sells/etc
-									shares = position["shares"] - position["shares"] / s["value"]
-									portShares = s2.shares
-									if abs(shares - portShares) > 1.0e-6:
-										# Match but incorrect shares
-										errors.append(["Incorrect stock dividend for " + ticker, "Moderate", "A stock dividend occurred on %d/%d/%d.  The portfolio transaction has %f shares but the proper number is %f." % (s2.date.month, s2.date.day, s2.date.year, portShares, shares)])
-								else:
-									if abs(s2.total - s["value"]) > 1.0e-6:
-										# Match but incorrect shares
-										errors.append(["Incorrect split for " + ticker, "Moderate", "A split occurred on %d/%d/%d.  The portfolio transaction has a value of %s (%.2f) but the proper value is %s (%.2f)." % (s2.date.month, s2.date.day, s2.date.year, Transaction.splitValueToString(s2.total), s2.total, Transaction.splitValueToString(s["value"]), s["value"])])
-								dataSplits.remove(s)
-								portSplits.remove(s2)
-								break
-			
-			if dataSplits:
-				for s in dataSplits:
+			for (kind, s, s2, value) in reconciles[ticker].reconcileSplits(checkDates = False):
+				if kind == TickerReconcile.wrongShares:
+					errors.append(["Incorrect stock dividend for " + ticker, "Moderate", "A stock dividend occurred on %d/%d/%d.  The portfolio transaction has %f shares but the proper number is %f." % (s2.date.month, s2.date.day, s2.date.year, s2.shares, value)])
+				elif kind == TickerReconcile.wrongValue:
+					errors.append(["Incorrect split for " + ticker, "Moderate", "A split occurred on %d/%d/%d.  The portfolio transaction has a value of %s (%.2f) but the proper value is %s (%.2f)." % (s2.date.month, s2.date.day, s2.date.year, Transaction.splitValueToString(s2.total), s2.total, Transaction.splitValueToString(value), value)])
+				elif kind == TickerReconcile.missing:
 					date = s["date"]
-					
-					# Determine split value
-					splitVal = Transaction.splitValueToString(s["value"])
-					
-					# Determine shares for stock dividend
-					shares = "?"
-					position = self.getPositionOnDate(ticker, s["date"])
-					if position:
-						shares = position["shares"] * (s["value"] - 1.0)
-						shares = "%.3f" % shares
-
+					splitVal = Transaction.splitValueToString(value)
 					errors.append(["Missing split for " + ticker, "Severe", "A %s split occurred on %d/%d/%d.  A %s Split transaction should be added." % (splitVal, date.month, date.day, date.year, splitVal)])
-			
-			if portSplits:
-				for s2 in portSplits:
+				elif kind == TickerReconcile.extra:
 					errors.append(["Invalid split for " + ticker, "Severe", "This portfolio has a stock dividend on %d/%d/%d although no such stock dividend or stock split exists." % (s2.date.month, s2.date.day, s2.date.year)])
 		
 		return errors
@@ -4517,3 +4071,9 @@ def checkBenchmarks(prefs):
 	
 	doCheck("S&P 500", {"VFINX": 100.0})
 	doCheck("Aggressive", {"VTSMX": 75.0, "VBMFX": 25.0})
+
+if __name__ == "__main__":
+	if "benchmark" in sys.argv[1:]:
+		benchmarkPositions()
+	elif "migrate" in sys.argv[1:]:
+		migrateDataToDays()
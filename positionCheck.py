@@ -23,6 +23,21 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+def floatCompare(a, b):
+	'''Return the ratio of two floating point numbers.  Return value is always greater than 0 unless both numbers are 0 in which case this function returns 0.'''
+	if a > b:
+		num = a
+		den = b
+	else:
+		num = b
+		den = a
+	if num == 0 and den == 0:
+		return 0
+	elif den == 0:
+		return 1e9
+	else:
+		return num / den
+
 class PositionCheck:
 	def __init__(self, date, ticker, shares, value):
 		self.date = date
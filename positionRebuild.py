@@ -0,0 +1,854 @@
+# Copyright (c) 2006-2010, Jesse Liesch
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the author nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE IMPLIED
+# DISCLAIMED. IN NO EVENT SHALL JESSE LIESCH BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+import math
+import traceback
+
+from twrr import *
+
+class RebuildLog:
+	'''Collects the messages of a position rebuilt in another process so
+	they can be passed to a StatusUpdate once the position is merged.'''
+	def __init__(self):
+		self.canceled = False
+		self.entries = []
+	
+	def appYield(self):
+		pass
+	
+	def addMessage(self, message):
+		self.entries.append(("message", message))
+	
+	def addError(self, error):
+		self.entries.append(("error", error))
+	
+	def addException(self):
+		self.entries.append(("error", traceback.format_exc()))
+	
+	def replay(self, update):
+		for (type, text) in self.entries:
+			if type == "message":
+				update.addMessage(text)
+			else:
+				update.addError(text)
+
+def rebuildPositionWorker(args):
+	'''Entry point for a process pool.  Returns the result of rebuildPosition and its messages.'''
+	log = RebuildLog()
+	result = rebuildPosition(*(args + (log,)))
+	return (result, log)
+
+def rebuildPosition(ticker, transactions, prices, portfolioFirstDate, now, nearestPrices, tickerChangePositions, update = False):
+	'''Simulate one position from its first transaction until now.
+	
+	The simulation does not touch the database so positions may be rebuilt
+	in separate processes.  The nearest price for transactions without a price
+	per share is passed in nearestPrices and the prior position for ticker
+	changes is passed in tickerChangePositions, both indexed by transaction
+	index.  See Portfolio.getRebuildLookups.
+	
+	Returns a tuple of (history rows, list of (date, value) for every day,
+	list of (transaction index, price per share, total) for every transaction
+	whose price was filled in).'''
+	# Basis dictionary key is ticker, dictionary of date, content is list of (shares, price per share)
+	basis = {}
+
+	# Total combined basis indexed by date
+	combinedBasis = {}
+
+	# Options basis key is date, content is list of (shares, price per share, strike, expire)
+	longOptionsBasis = {}
+	shortOptionsBasis = {}
+
+	historyRows = []
+	dailyValues = []
+	pricedTransactions = []
+
+	def addToBasis(ticker, d, s, pps):
+		if ticker not in basis:
+			basis[ticker] = {}
+		if d in basis[ticker]:
+			# Update basis for this day
+			(oldShares, oldPricePerShare) = basis[ticker][d]
+			newShares = s + oldShares
+			if newShares == 0:
+				raise Exception("Added shares to 0")
+			newPricePerShare = (oldShares * oldPricePerShare + s * pps) / newShares
+			basis[ticker][d] = (newShares, newPricePerShare)
+		else:
+			basis[ticker][d] = (s, pps)
+
+		# Update combined basis
+		d = datetime.datetime(d.year, d.month, d.day)
+		if not d in combinedBasis:
+			combinedBasis[d] = 0.0
+		combinedBasis[d] += abs(s * pps)
+
+	def getShares(ticker):
+		if not ticker in basis:
+			return 0
+	
+		s = 0
+		for d in basis[ticker]:
+			s += basis[ticker][d][0]
+		return s
+
+	def getBasis(ticker, update = False, shareCount = False):
+		if not ticker in basis:
+			return 0
+
+		basisVal = 0
+		basisShares = 0
+		if shareCount:
+			# Use up all shares in shareCount
+			for d in basis[ticker]:
+				(s, pps) = basis[ticker][d]
+				if s > shareCount:
+					basisVal += shareCount * pps
+					basisShares += shareCount
+					shareCount -= shareCount
+					break
+				else:
+					basisVal += s * pps
+					basisShares += s
+					shareCount -= s
+			if update and shareCount > 0:
+				update.addError("Invalid share count for " + ticker)
+		else:
+			# Compute over all shares
+			for d in basis[ticker]:
+				(s, pps) = basis[ticker][d]
+				basisVal += s * pps
+				basisShares += s
+	
+		if basisShares == 0:
+			return 0
+		else:
+			return basisVal / basisShares
+
+	def getBasisValue(ticker):
+		if not ticker in basis:
+			return 0
+
+		val = 0
+		# Compute over all shares
+		for d in basis[ticker]:
+			(s, pps) = basis[ticker][d]
+			val += s * pps
+	
+		return val
+
+	def removeFromBasis(ticker, remove):
+		while ticker in basis and len(basis[ticker]) > 0 and abs(remove) > 0:
+			(s, pricePerShare) = basis[ticker][basis[ticker].keys()[0]]
+			if abs(s) > abs(remove):
+				basis[ticker][basis[ticker].keys()[0]] = (s - remove, pricePerShare)
+				remove = 0
+
+				# Update combined basis
+				d = datetime.datetime(t.date.year, t.date.month, t.date.day)
+				if not d in combinedBasis:
+					combinedBasis[d] = 0.0
+				else:
+					combinedBasis[d] -= abs(remove * pricePerShare)
+			else:
+				del basis[ticker][basis[ticker].keys()[0]]
+				remove -= s
+
+				# Update combined basis
+				d = datetime.datetime(t.date.year, t.date.month, t.date.day)
+				if not d in combinedBasis:
+					combinedBasis[d] = 0.0
+				else:
+					combinedBasis[d] -= abs(s * pricePerShare)
+		if abs(remove) > 1.0e-6:
+			if update:
+				if ticker in basis:
+					update.addError("Could not finish basis for %s %s %s" % (ticker, remove, basis[ticker]))
+				else:
+					update.addError("Could not finish basis for %s %s (no basis)" % (ticker, remove))
+	
+	def adjustBasisStockDividend(ticker, adjustShares):
+		"""Add or remove shares from basis"""
+		shares = getShares(ticker)
+		if shares == 0:
+			if update:
+				update.addError("Split but zero shares for " + ticker)
+			return
+		shareFactor = (shares + adjustShares) / shares
+		if shareFactor == 0:
+			if update:
+				update.addError("Split to zero shares for " + ticker)
+			return
+	
+		for d in basis[ticker]:
+			(s, pps) = basis[ticker][d]
+			basis[ticker][d] = (s * shareFactor, pps / shareFactor)
+
+	def adjustBasisValue(ticker, percent):
+		"""Modify basis value by percent"""
+		for d in basis[ticker]:
+			(s, pps) = basis[ticker][d]
+			basis[ticker][d] = (s, pps * percent)
+
+	def dumpOptionsBasis():
+		print "options dump"
+		for d in longOptionsBasis:
+			for i in range(len(longOptionsBasis[d])):
+				(ignoreTicker, s, pps, strike, expire) = longOptionsBasis[d][i]
+				print "long ", ignoreTicker, s, strike, expire, "pps", pps
+		for d in shortOptionsBasis:
+			for i in range(len(shortOptionsBasis[d])):
+				(ignoreTicker, s, pps, strike, expire) = shortOptionsBasis[d][i]
+				print "short", ignoreTicker, s, strike, expire, "pps", pps
+
+	# TODO: do not combine individual days
+	def addToOptionsBasis(ticker, d, s, pps, strike, expire):
+		# Decide whether short or long
+		if s > 0:
+			b = longOptionsBasis
+		else:
+			b = shortOptionsBasis
+	
+		if d in b:
+			# Update basis for this day
+			b[d].append((ticker, s, pps, strike, expire))
+		else:
+			b[d] = [(ticker, s, pps, strike, expire)]
+
+		# Update combined basis
+		# TODO: Should this be done?
+		d = datetime.datetime(d.year, d.month, d.day)
+		if not d in combinedBasis:
+			combinedBasis[d] = 0.0
+		combinedBasis[d] += abs(s * pps)
+
+	def getOptionsShares(ticker):
+		s = 0
+		for d in longOptionsBasis:
+			for i in range(len(longOptionsBasis[d])):
+				s += longOptionsBasis[d][i][1]
+		for d in shortOptionsBasis:
+			for i in range(len(shortOptionsBasis[d])):
+				s += abs(shortOptionsBasis[d][i][1])
+		return s
+
+	def getOptionsBasis(ticker, update = False):
+		basisVal = 0
+		basisShares = 0
+		# Compute over all shares
+		for d in longOptionsBasis:
+			for i in range(len(longOptionsBasis[d])):
+				(ignoreTicker, s, pps, strike, expire) = longOptionsBasis[d][i]
+				basisVal += s * pps
+				basisShares += s
+		for d in shortOptionsBasis:
+			for i in range(len(shortOptionsBasis[d])):
+				(ignoreTicker, s, pps, strike, expire) = shortOptionsBasis[d][i]
+				basisVal += s * pps
+				basisShares += s
+	
+		if basisShares == 0:
+			return 0
+		else:
+			return basisVal / basisShares
+
+	def getOptionsBasisValue(ticker, update = False):
+		basisVal = 0
+		# Compute over all shares
+		for d in longOptionsBasis:
+			for i in range(len(longOptionsBasis[d])):
+				(ignoreTicker, s, pps, strike, expire) = longOptionsBasis[d][i]
+				basisVal += s * pps
+		for d in shortOptionsBasis:
+			for i in range(len(shortOptionsBasis[d])):
+				(ignoreTicker, s, pps, strike, expire) = shortOptionsBasis[d][i]
+				basisVal += s * pps
+	
+		return basisVal
+
+	def getOptionsValue(ticker):
+		value = 0.0
+	
+		for d in longOptionsBasis:
+			for i in range(len(longOptionsBasis[d])):
+				(optionTicker, s, pps, strike, expire) = longOptionsBasis[d][i]
+			
+				# TODO: Determine price for this option
+				price = pps
+			
+				value += s * price
+
+		for d in shortOptionsBasis:
+			for i in range(len(shortOptionsBasis[d])):
+				(optionTicker, s, pps, strike, expire) = shortOptionsBasis[d][i]
+
+				# TODO: Determine price for this option
+				price = pps
+
+				value += (pps - price) * s
+	
+		return value
+
+	def getSpecificOptionsBasis(optionStrike, optionExpire):
+		basisVal = 0
+		basisShares = 0
+		# Compute over matching shares
+		for d in longOptionsBasis:
+			for i in range(len(longOptionsBasis[d])):
+				(ignoreTicker, s, pps, strike, expire) = longOptionsBasis[d][i]
+				if strike == optionStrike and expire == optionExpire:
+					basisVal += s * pps
+					basisShares += s
+		for d in shortOptionsBasis:
+			for i in range(len(shortOptionsBasis[d])):
+				(ignoreTicker, s, pps, strike, expire) = shortOptionsBasis[d][i]
+				if strike == optionStrike and expire == optionExpire:
+					basisVal += s * pps
+					basisShares += s
+	
+		if basisShares == 0:
+			return 0
+		else:
+			return basisVal / basisShares
+
+	def expireOptions(ticker, optionStrike, optionExpire, date):
+		for thisBasis in [longOptionsBasis, shortOptionsBasis]:
+			for d in thisBasis:
+				for i in range(len(thisBasis[d])):
+					(thisTicker, s, pps, strike, expire) = thisBasis[d][i]
+					if ticker == thisTicker and strike == optionStrike and expire == optionExpire:
+						if s < 0:
+							# Sell to open / buy to close
+							#twrr.removeShares(thisTicker + " shares", abs(s) * 100, optionStrike)
+							twrr.coverShares(thisTicker, abs(s), 0)
+						else:
+							# Buy to open / sell to close
+							#twrr.removeShares(thisTicker + " shares", abs(s) * 100, optionStrike)
+							twrr.removeShares(thisTicker, abs(s), 0)
+						removeFromOptionsBasis(thisTicker, s, strike, expire)
+
+	def checkOptionsExpiration(ticker, date):
+		# Return True if expired an option
+		expired = False
+	
+		for thisBasis in [longOptionsBasis, shortOptionsBasis]:
+			for d in thisBasis:
+				for i in range(len(thisBasis[d])):
+				#while i < len(thisBasis[d]):
+					(thisTicker, s, pps, strike, expire) = thisBasis[d][i]
+					# Expire 2 days after the friday
+					date2 = datetime.datetime(date.year, date.month, date.day)
+					expire2 = datetime.datetime(expire.year, expire.month, expire.day) + datetime.timedelta(days = 2)
+					if date2 >= expire2:
+						expired = True
+						expireOptions(ticker, strike, expire, date)
+						'''removeFromOptionsBasis(thisTicker, s, strike, expire)
+						if s > 0:
+							# Buy to open
+							twrr.removeShares(thisTicker, abs(s), 0)
+						elif s < 0:
+							# Sell to open
+							twrr.coverShares(thisTicker, abs(s) * 100, strike)
+							twrr.removeSharesNoPrice(thisTicker + "income", abs(s))'''
+	
+		return expired
+
+	def getNextOptionsExpiration():
+		# Return the first date checkOptionsExpiration will expire an option, or False if no options
+		first = False
+		for thisBasis in [longOptionsBasis, shortOptionsBasis]:
+			for d in thisBasis:
+				for (thisTicker, s, pps, strike, expire) in thisBasis[d]:
+					expire2 = datetime.datetime(expire.year, expire.month, expire.day) + datetime.timedelta(days = 2)
+					if first is False or expire2 < first:
+						first = expire2
+		return first
+
+	def removeFromOptionsBasis(ticker, remove, strike, expire):
+		if remove > 0:
+			thisBasis = longOptionsBasis
+		else:
+			thisBasis = shortOptionsBasis
+	
+		for d in thisBasis:
+			i = 0
+			while d in thisBasis and i < len(thisBasis[d]) and abs(remove) > 1.0e-6:
+				(optionTicker, s, pps, str, e) = thisBasis[d][i]
+				# Check for right ticker, strike price, expiration
+				if ticker != optionTicker or (str - strike) > 1.0e-6 or e != expire:
+					i += 1
+					continue
+			
+				if abs(s) > abs(remove):
+					thisBasis[d][i] = (ticker, s - remove, pps, str, e)
+					remove = 0
+
+					# Update combined basis
+					upd = datetime.datetime(t.date.year, t.date.month, t.date.day)
+					if not upd in combinedBasis:
+						combinedBasis[upd] = 0.0
+					else:
+						combinedBasis[upd] -= abs(remove * pps)
+					i += 1
+				else:
+					# Remove all of basis
+					del thisBasis[d][i]
+					remove -= s
+
+					# Update combined basis
+					upd = datetime.datetime(t.date.year, t.date.month, t.date.day)
+					if not remove in combinedBasis:
+						combinedBasis[upd] = 0.0
+					else:
+						combinedBasis[upd] -= abs(s * pps)
+		if abs(remove) > 1.0e-6:
+			if update:
+				update.addError("Could not finish options basis for %s remove %f strike %f expire %s" % (ticker, remove, strike, expire))
+
+
+	# Loop through first date until now
+	currentTrans = 0
+	currentPrice = 0
+	# Begin on first transaction.  Always begin cash on portfolio first date.
+	if transactions and ticker != "__CASH__":
+		date = transactions[0].getDate()
+	else:
+		date = portfolioFirstDate
+	date = datetime.datetime(date.year, date.month, date.day, 23, 59, 59)
+	price = False
+	shares = 0.0
+	value = 0.0
+	adjustedValue = 0.0
+	totalFees = 0
+	totalDividends = 0
+	totalProfit = 0 # Profit after fees
+	yieldCount = 0
+	doneWithTicker = False
+	twrr = Twrr() # Time weighted rate of return
+	if ticker == "__CASH__":
+		twrr.addShares("__CASH__", 0, 1)
+	while date < now and not doneWithTicker:
+		yieldCount += 1
+		if yieldCount == 100:
+			yieldCount = 0
+			if update:
+				update.appYield()
+				if update.canceled:
+					break
+		totalTrans = 0
+		todayDividends = 0
+		twrr.beginTransactions()
+		while currentTrans < len(transactions) and transactions[currentTrans].getDate() <= date and not doneWithTicker:
+			t = transactions[currentTrans]
+		
+			# Check that first transaction is a buy or transferIn (if not cash), or a spinoff or tickerChange and we are ticker2
+			if currentTrans == 0 and ticker != "__CASH__":
+				if not t.type in [Transaction.buy, Transaction.short, Transaction.buyToOpen, Transaction.sellToOpen, Transaction.transferIn] and ((t.type != Transaction.spinoff and t.type != Transaction.tickerChange) or t.ticker2 != ticker):
+					if update:
+						update.addError("The first transaction for %s does not add to its shares.  Ignoring position." % ticker)
+					doneWithTicker = True
+					break
+			currentTrans += 1
+			totalTrans += 1
+
+			if t.type == Transaction.deposit:
+				shares += t.getTotal()
+				twrr.addShares(ticker, t.getTotal(), 1)
+			elif t.type == Transaction.withdrawal:
+				shares += t.getTotal()
+				twrr.removeShares(ticker, -t.getTotal(), 1)
+			elif t.type == Transaction.buy or t.type == Transaction.transferIn:
+				# Lookup price if unavailable
+				if t.pricePerShare < 1.0e-6:
+					p = nearestPrices.get(currentTrans - 1)
+					if p:
+						t.pricePerShare = p["close"]
+						t.setTotal(t.pricePerShare * abs(t.shares) - t.getFee())
+						pricedTransactions.append((currentTrans - 1, t.pricePerShare, t.total))
+					else:
+						if update:
+							update.addError("Buy transaction has no price per share %s" % t)
+						continue
+
+				totalProfit -= abs(t.total)
+				twrr.addShares(t.formatTicker(), t.getShares(), t.pricePerShare)							
+
+				# Check for transfer in option
+				if t.isOption():
+					# Add to basis tracker
+					addToOptionsBasis(t.formatTicker(), t.date, t.shares, t.pricePerShare, t.optionStrike, t.optionExpire)
+				else:
+					shares += abs(t.shares)
+
+					# Add to basis tracker
+					addToBasis(ticker, t.date, t.shares, t.pricePerShare)
+			elif t.type == Transaction.sell:
+				if shares <= 0:
+					if update:
+						update.addError("Sell transaction but no shares %s" % t)
+					continue
+				shares -= abs(t.shares)
+				totalProfit += t.getTotal()
+				twrr.removeShares(ticker, t.getShares(), t.pricePerShare)
+			
+				# Remove t.shares from basis tracker
+				removeFromBasis(ticker, abs(t.shares))
+			elif t.type == Transaction.buyToOpen:
+				totalProfit -= abs(t.total)
+				# Use formatTicker() because it includes strike, option
+				#twrr.addShares(t.formatTicker() + " shares", t.getShares() * 100, t.optionStrike)
+				twrr.addShares(t.formatTicker(), t.getShares(), t.pricePerShare)
+			
+				# Add to basis tracker
+				addToOptionsBasis(t.formatTicker(), t.date, t.shares, t.pricePerShare, t.optionStrike, t.optionExpire)
+			elif t.type == Transaction.sellToClose:
+				totalProfit += t.getTotal()
+				#twrr.removeShares(t.formatTicker() + " shares", t.getShares() * 100, t.optionStrike)
+				twrr.removeShares(t.formatTicker(), t.getShares(), t.pricePerShare)
+			
+				# Remove t.shares from basis tracker
+				removeFromOptionsBasis(t.formatTicker(), abs(t.shares), t.optionStrike, t.optionExpire)
+			elif t.type == Transaction.short:
+				# Lookup price if unavailable
+				if not t.pricePerShare:
+					if update:
+						update.addError("Transaction has no price per share %s" % t)
+					continue
+
+				# Shorts reduce shares and add to basis
+				shares -= abs(t.shares)
+				totalProfit += t.getTotal()
+				twrr.shortShares(ticker, t.getShares(), t.pricePerShare)
+			
+				# Add to basis tracker
+				addToBasis(ticker, t.date, -abs(t.shares), t.pricePerShare)
+			elif t.type == Transaction.cover:
+				if shares >= 0:
+					if update:
+						update.addError("Cover transaction but no shares %s" % t)
+					continue
+
+				# Cover adds to shares and removes from basis
+				shares += abs(t.shares)
+				twrr.coverShares(ticker, t.getShares(), t.pricePerShare)
+			
+				# Remove t.shares from basis tracker
+				totalProfit += t.getTotal()
+				removeFromBasis(ticker, -abs(t.shares))
+			elif t.type == Transaction.sellToOpen:
+				# Shorts reduce shares and add to basis
+				totalProfit += t.getTotal()
+			
+				# For sellToOpen we track 2 positions: One is exposure to the underlying stock,
+				# the other is the value of the options.  Assume 100 shares per option.
+				#twrr.addShares(t.formatTicker() + " shares", t.getShares() * 100, t.optionStrike)
+				twrr.shortShares(t.formatTicker(), t.getShares(), t.pricePerShare)
+			
+				# Add to basis tracker
+				addToOptionsBasis(t.formatTicker(), t.date, -abs(t.shares), t.pricePerShare, t.optionStrike, t.optionExpire)
+			elif t.type == Transaction.buyToClose:
+				#twrr.removeShares(t.formatTicker() + " shares", t.getShares() * 100, t.optionStrike)
+				twrr.coverShares(t.formatTicker(), t.getShares(), t.pricePerShare)
+			
+				# Remove t.shares from basis tracker
+				totalProfit += t.getTotal()
+				removeFromOptionsBasis(t.formatTicker(), -abs(t.shares), t.optionStrike, t.optionExpire)
+			elif t.type in [Transaction.assign, Transaction.exercise, Transaction.expire]:
+				expireOptions(t.formatTicker(), t.optionStrike, t.optionExpire, t.date)
+			elif t.type == Transaction.dividend:
+				todayDividends += t.getTotalIgnoreFee()
+				twrr.addDividend(t.getTotalIgnoreFee())
+				if ticker == "__CASH__":
+					twrr.addShares(ticker, t.getTotalIgnoreFee(), 1)
+				# Fee will be subtracted from todayDividends later
+				if t.getFee():
+					todayDividends += t.getFee()
+			elif t.type == Transaction.expense:
+				# Note: Fees for all transactions are handled somewhere else
+				# Here we only keep track of fees from the total
+				if t.total:
+					if t.fee:
+						thisFee = abs(t.total) - abs(t.fee)
+					else:
+						thisFee = abs(t.total)
+					totalFees += thisFee
+					totalProfit -= thisFee
+				else:
+					totalProfit -= t.getFee()
+			elif t.type == Transaction.dividendReinvest:
+				if t.pricePerShare < 1.0e-6:
+					if t.getTotalIgnoreFee() > 0 and t.shares > 0:
+						t.pricePerShare = t.getTotalIgnoreFee() / t.shares
+					else:
+						p = nearestPrices.get(currentTrans - 1)
+						if p:
+							t.pricePerShare = p["close"]
+						else:
+							if update:
+								update.addError("Dividend reinvest transaction has no price per share %s" % t)
+							continue
+					pricedTransactions.append((currentTrans - 1, t.pricePerShare, t.total))
+			
+				# Add to today's dividends, but don't count as profit
+				# Because we are increasing share count
+				shares += abs(t.shares)
+				todayDividends += t.getTotalIgnoreFee()
+				totalProfit -= t.getTotalIgnoreFee()
+				twrr.addDividendReinvest(ticker, t.getShares(), t.pricePerShare)
+
+				# Add to basis tracker
+				addToBasis(ticker, t.date, t.shares, t.pricePerShare)
+			elif t.type == Transaction.transferOut:
+				if t.pricePerShare < 1.0e-6:
+					if t.getTotalIgnoreFee() > 0:
+						t.pricePerShare = t.getTotalIgnoreFee() / t.shares
+					elif price:
+						# Use last price data
+						t.pricePerShare = price
+					else:
+						p = nearestPrices.get(currentTrans - 1)
+						if p:
+							t.pricePerShare = p["close"]
+						else:
+							if update:
+								update.addError("transaction has no price per share %s" % t)
+							continue
+					pricedTransactions.append((currentTrans - 1, t.pricePerShare, t.total))
+			
+				totalProfit += t.getTotal()
+				twrr.removeShares(t.formatTicker(), t.getShares(), t.pricePerShare)
+
+				if t.isOption():
+					# Remove t.shares from basis tracker
+					removeFromOptionsBasis(t.formatTicker(), abs(t.shares), t.optionStrike, t.optionExpire)
+				else:
+					shares -= abs(t.shares)
+
+					# Remove t.shares from basis tracker
+					removeFromBasis(ticker, abs(t.shares))
+			elif t.type in [Transaction.stockDividend, Transaction.split]:
+				if t.type == Transaction.stockDividend:
+					adjustShares = t.shares
+				elif t.getTotal() > 0:
+					# A 2-1 split has a value of 2.0
+					adjustShares = math.floor(shares * (t.getTotal() - 1.0))
+				else:
+					raise Exception("Invalid split value for %s" % t)
+				shares += adjustShares
+				adjustBasisStockDividend(ticker, adjustShares)
+			
+				twrr.stockDividendShares(ticker, adjustShares)
+			elif t.type == Transaction.adjustment:
+				adjustedValue += t.getTotal()
+				twrr.addAdjustment(t.getTotal())
+			elif t.type == Transaction.spinoff:
+				# Determine price per share
+				if t.pricePerShare:
+					pps = t.pricePerShare
+				else:
+					if update:
+						update.addError("Transaction has no price per share: %s" % t)
+					continue
+
+				# Dividend if ticker, buy if ticker2
+				if t.ticker == ticker:
+					spinoffValue = t.shares * pps
+					if value > 0:
+						basisValue = getBasisValue(ticker)
+						totalProfit += spinoffValue
+						twrr.adjustBasis(ticker, spinoffValue)
+					
+						# Adjust basis
+						percent = (basisValue - spinoffValue) / basisValue
+						if percent < 0:
+							percent = 0
+						if percent >= 0:
+							adjustBasisValue(ticker, percent)
+						elif update:
+							update.addError("adjust basis for spinoff, percent less than 0: %f - %f" % (basisValue, spinoffValue))
+				else:
+					shares += abs(t.shares)
+					totalProfit -= pps
+					twrr.addShares(ticker, t.getShares(), pps)
+				
+					# TODO: Handle for options?
+					addToBasis(ticker, t.date, t.shares, pps)
+			elif t.type == Transaction.tickerChange:
+				if ticker == t.ticker:
+					# Old ticker
+					# TODO: Handle for options?
+					removeFromBasis(ticker, shares)
+					shares = 0
+				
+					# Force exit from loop, this stock no longer exists
+					doneWithTicker = True
+				else:
+					# New ticker, get stock data of original ticker
+					if currentTrans != 1:
+						if update:
+							update.addMessage("The ticker change transaction from %s to %s is not the first transaction for %s." % (t.ticker, t.ticker2, t.ticker2))
+						continue
+					pos = tickerChangePositions.get(currentTrans - 1)
+					if not pos:
+						if update:
+							update.addMessage("The ticker change transaction from %s to %s does not have data" % (t.ticker, t.ticker2))
+						continue
+				
+					# Start calculating based off of the position data
+					# First use given transaction shares, if not, use position shares
+					if t.shares > 0:
+						shares = abs(t.shares)
+					elif pos["shares"] > 0:
+						shares = abs(pos["shares"])
+					if shares > 0:
+						pps = pos["value"] / shares
+						# TODO: Handle for options?
+						addToBasis(ticker, t.date, shares, pps)
+			elif update:
+				update.addError("Did not use transaction %s for rebuilding" % t)
+		
+			# Adjust for fee
+			if t.fee:
+				totalFees += t.fee
+			if t.getFee():
+				twrr.addFee(t.getFee())
+				if ticker == "__CASH__":
+					twrr.removeShares(ticker, t.getFee(), 1)
+					shares -= t.getFee()
+					value -= t.getFee()
+	
+		# Do not automatically expire options
+		expired = checkOptionsExpiration(ticker, date)
+		if expired:
+			totalTrans += 1
+	
+		# Build current value based on shares and price
+		priceChanged = False
+		if currentPrice < len(prices):
+			# Advance to next price if not cash
+			if ticker != "__CASH__":
+				while currentPrice < len(prices) - 1 and prices[currentPrice + 1]["date"] <= date:
+					currentPrice += 1
+					priceChanged = True
+
+			price = prices[currentPrice]["close"]
+			if ticker == "__CASH__":
+				value = shares
+			elif getShares(ticker) >= 0:
+				value = getShares(ticker) * price + adjustedValue
+			else:
+				# Short
+				value = (price - getBasis(ticker)) * getShares(ticker) + adjustedValue
+		
+			twrr.setValue(ticker, price)
+		
+			# Use yesterday's value or today's value if position was opened today
+			if todayDividends > 0:
+				totalProfit += todayDividends
+				totalDividends += todayDividends
+
+				if ticker == "__CASH__":
+					shares += todayDividends
+					value += todayDividends
+
+			# Adjust fee factor for fees today's fees
+			# Use today's value or yesterday's value if position was closed today
+		elif price:
+			# Use last price
+			value = getShares(ticker) * price + adjustedValue
+		else:
+			# No price
+			value = 0
+	
+		try:
+			twrr.endTransactions()
+		except Exception, e:
+			if update:
+				update.addException()
+			else:
+				raise
+
+		# Update value based on options
+		# TODO: Calculate value of options better!!!
+		optionsShares = getOptionsShares(ticker)
+		value += getOptionsValue(ticker)
+	
+		if ticker == "__CASH__":
+			profitFee = totalProfit
+		else:
+			profitFee = value + totalProfit
+	
+		profitDividend = profitFee + totalFees
+		profitSplit = profitDividend - totalDividends
+
+		row = False
+		if (abs(shares) + abs(getOptionsShares(ticker)) > 1.0e-6 or totalTrans > 0 or currentTrans < len(transactions) or ticker == "__CASH__") and not doneWithTicker:
+			row = {
+				"date": date.strftime("%Y-%m-%d 00:00:00"),
+				"ticker": ticker,
+				"shares": getShares(ticker),
+				"options": getOptionsShares(ticker),
+				"value": value,
+				"normSplit": twrr.getReturnSplit(),
+				"normDividend": twrr.getReturnDiv(),
+				"normFee": twrr.getReturnFee(),
+				"profitSplit": profitSplit,
+				"profitDividend": profitDividend,
+				"profitFee": profitFee}
+			historyRows.append(row)
+
+		dailyValues.append((datetime.datetime(date.year, date.month, date.day), value))
+
+		date += datetime.timedelta(1)
+	
+		# A day with no transactions, no new price and no expired options leaves the
+		# position unchanged.  Every following day is identical until the next event
+		# so fill those days without simulating them.
+		if totalTrans == 0 and not priceChanged and not doneWithTicker:
+			nextEvent = now
+			if currentTrans < len(transactions):
+				nextEvent = min(nextEvent, transactions[currentTrans].getDate())
+			if ticker != "__CASH__" and currentPrice < len(prices) - 1:
+				nextEvent = min(nextEvent, prices[currentPrice + 1]["date"])
+			nextExpiration = getNextOptionsExpiration()
+			if nextExpiration:
+				nextEvent = min(nextEvent, nextExpiration)
+		
+			skipped = 0
+			while date < nextEvent and date < now:
+				if row:
+					row = row.copy()
+					row["date"] = date.strftime("%Y-%m-%d 00:00:00")
+					historyRows.append(row)
+
+				dailyValues.append((datetime.datetime(date.year, date.month, date.day), value))
+
+				date += datetime.timedelta(1)
+				skipped += 1
+			twrr.skipDays(skipped)
+
+	return (historyRows, dailyValues, pricedTransactions)
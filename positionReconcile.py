@@ -0,0 +1,138 @@
+# Copyright (c) 2006-2010, Jesse Liesch
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the author nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE IMPLIED
+# DISCLAIMED. IN NO EVENT SHALL JESSE LIESCH BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+
+from transaction import *
+from positionCheck import *
+
+def bestSplitOffset(closes, date, split, days = 7):
+	'''Return the offset in days from date whose close to close ratio best matches split.
+	closes maps datetime.date to the closing price.  Days without a price are skipped
+	and the ratio is taken against the previous day with a price.'''
+	day = datetime.date(date.year, date.month, date.day)
+	bestOffset = -days
+	bestDiff = 1.0e6
+	lastClose = closes.get(day + datetime.timedelta(days = -days))
+	for offset in range(-days + 1, days + 1):
+		nextClose = closes.get(day + datetime.timedelta(days = offset))
+		if lastClose is not None and nextClose:
+			diff = abs(lastClose / nextClose - split)
+			if diff < bestDiff:
+				bestOffset = offset
+				bestDiff = diff
+		if nextClose is not None:
+			lastClose = nextClose
+	return bestOffset
+
+class TickerReconcile:
+	'''Compares the position history of one ticker against its stock data.
+	
+	The position history, splits and prices are each read once so the error check
+	tools do not need a database query per date.'''
+	
+	# Kinds of split mismatches returned by reconcileSplits
+	wrongShares = 1
+	wrongValue = 2
+	wrongDate = 3
+	missing = 4
+	extra = 5
+	
+	def __init__(self, portfolio, stockData, ticker):
+		self.portfolio = portfolio
+		self.stockData = stockData
+		self.ticker = ticker
+		self.positions = portfolio.getPositionHistory(ticker)
+		self.closes = False
+	
+	def getCloses(self, dates, days):
+		'''Return closing prices by day for days before the first date through days after the last date'''
+		if self.closes is False:
+			self.closes = {}
+			first = min(dates) - datetime.timedelta(days = days)
+			last = max(dates) + datetime.timedelta(days = days)
+			for p in self.stockData.getPrices(self.ticker, startDate = first, endDate = last):
+				self.closes[p["date"].date()] = p["close"]
+		return self.closes
+
+	def getPositionForCheck(self, check):
+		'''Return the position on the day of check, or the day before or after if they match better.  May be False.'''
+		d = datetime.datetime(check.date.year, check.date.month, check.date.day, 0, 0, 0)
+		same = self.positions.get(d, False)
+		for day in [d, d - datetime.timedelta(days = 1), d + datetime.timedelta(days = 1)]:
+			pos = self.positions.get(day)
+			if pos and abs(check.shares - pos["shares"]) < 1.0e-6 and floatCompare(check.value, pos["value"]):
+				return pos
+		return same
+
+	def reconcileSplits(self, checkDates = True):
+		'''Match the splits in stock data with the portfolio's split and stock dividend transactions.
+		
+		Returns a list of (kind, data split, portfolio transaction, correct value) tuples.
+		The correct value is the number of shares for wrongShares, the split value for wrongValue
+		and the correct date for wrongDate.  missing has no transaction and extra has no data split.'''
+		if not self.positions:
+			return []
+		first = min(self.positions)
+		last = max(self.positions)
+		dataSplits = self.stockData.getSplits(self.ticker, first, last)
+		portSplits = self.portfolio.getTransactions(self.ticker, transType = Transaction.stockDividend)
+		portSplits += self.portfolio.getTransactions(self.ticker, transType = Transaction.split)
+		
+		mismatches = []
+		if dataSplits and portSplits:
+			for s in dataSplits[:]:
+				for s2 in portSplits:
+					if abs(s["date"] - s2.date) >= datetime.timedelta(7):
+						continue
+					
+					position = self.positions.get(s["date"])
+					if position:
+						if s2.type == Transaction.stockDividend:
+							# Determine shares before the split
+							shares = position["shares"] - position["shares"] / s["value"]
+							if abs(shares - s2.shares) > 1.0e-6:
+								mismatches.append((TickerReconcile.wrongShares, s, s2, shares))
+						elif abs(s2.total - s["value"]) > 1.0e-6:
+							mismatches.append((TickerReconcile.wrongValue, s, s2, s["value"]))
+					
+					# Check for proper date based on stock values
+					if checkDates:
+						closes = self.getCloses([t.date for t in portSplits], 7)
+						offset = bestSplitOffset(closes, s2.date, s["value"])
+						if offset != 0:
+							mismatches.append((TickerReconcile.wrongDate, s, s2, s2.date + datetime.timedelta(days = offset)))
+					
+					# Matched, remove
+					dataSplits.remove(s)
+					portSplits.remove(s2)
+					break
+		
+		for s in dataSplits:
+			mismatches.append((TickerReconcile.missing, s, False, s["value"]))
+		for s2 in portSplits:
+			mismatches.append((TickerReconcile.extra, False, s2, False))
+		
+		return mismatches
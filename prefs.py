@@ -84,6 +84,8 @@ class Prefs:
 			self.checkDefaults("showCashInTransactions", "False")
 			self.checkDefaults("backgroundRebuild", "True")
 			self.checkDefaults("backgroundImport", "False")
+			self.checkDefaults("parallelRebuild", "True")
+			self.checkDefaults("binaryPrices", "False")
 			self.checkDefaults("lastBackgroundImport", "2000-01-01 00:00:00")
 			self.checkDefaults("ignoreVersion", "0.0.0")
 			self.checkDefaults("lastVersionReminder", "2000-01-01 00:00:00")
@@ -146,6 +148,12 @@ class Prefs:
 	def getBackgroundImport(self):
 		return self.getPreference("backgroundImport") == "True"
 
+	def getParallelRebuild(self):
+		return self.getPreference("parallelRebuild") == "True"
+
+	def getBinaryPrices(self):
+		return self.getPreference("binaryPrices") == "True"
+
 	def getLastBackgroundImport(self):
 		return datetime.datetime.strptime(self.getPreference("lastBackgroundImport"), "%Y-%m-%d %H:%M:%S")
 
@@ -211,6 +219,16 @@ class Prefs:
 		self.db.update("prefs", {"value": show}, {"name": "backgroundImport"})
 		self.db.commitTransaction()
 	
+	def setParallelRebuild(self, parallel):
+		self.db.beginTransaction()
+		self.db.update("prefs", {"value": parallel}, {"name": "parallelRebuild"})
+		self.db.commitTransaction()
+	
+	def setBinaryPrices(self, binary):
+		self.db.beginTransaction()
+		self.db.update("prefs", {"value": binary}, {"name": "binaryPrices"})
+		self.db.commitTransaction()
+	
 	def setLastBackgroundImport(self):
 		self.db.beginTransaction()
 		self.db.update("prefs", {"value": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}, {"name": "lastBackgroundImport"})
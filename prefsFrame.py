@@ -49,18 +49,28 @@ class PrefsFrame(QDialog):
 			self.backgroundImport.setChecked(True)
 		grid.addWidget(self.backgroundImport, 1, 0, 1, 1)
 
+		self.parallelRebuild = QCheckBox("Use all processors when rebuilding portfolios (after restarting)")
+		if self.app.prefs.getParallelRebuild():
+			self.parallelRebuild.setChecked(True)
+		grid.addWidget(self.parallelRebuild, 2, 0, 1, 1)
+
+		self.binaryPrices = QCheckBox("Store stock prices in binary files")
+		if self.app.prefs.getBinaryPrices():
+			self.binaryPrices.setChecked(True)
+		grid.addWidget(self.binaryPrices, 3, 0, 1, 1)
+
 		self.showCash = QCheckBox("Show cash total in Transactions")
 		if self.app.prefs.getShowCashInTransactions():
 			self.showCash.setChecked(True)
-		grid.addWidget(self.showCash, 2, 0, 1, 1)
+		grid.addWidget(self.showCash, 4, 0, 1, 1)
 
 		self.ofxDebug = QCheckBox("Enable OFX Debugging")
 		if self.app.prefs.getOfxDebug():
 			self.ofxDebug.setChecked(True)
-		grid.addWidget(self.ofxDebug, 3, 0, 1, 1)
+		grid.addWidget(self.ofxDebug, 5, 0, 1, 1)
 		
   		buttons = QDialogButtonBox(QDialogButtonBox.Cancel | QDialogButtonBox.Ok)
-  		grid.addWidget(buttons, 4, 0, 2, 1)
+  		grid.addWidget(buttons, 6, 0, 2, 1)
   		self.connect(buttons.button(QDialogButtonBox.Cancel), SIGNAL("clicked()"), SLOT("reject()"))
   		self.connect(buttons.button(QDialogButtonBox.Ok), SIGNAL("clicked()"), self.onOk)
 
@@ -73,6 +83,13 @@ class PrefsFrame(QDialog):
 		if self.backgroundImport.isChecked() != self.app.prefs.getBackgroundImport():
 			self.app.prefs.setBackgroundImport(self.backgroundImport.isChecked())
 
+		if self.parallelRebuild.isChecked() != self.app.prefs.getParallelRebuild():
+			self.app.prefs.setParallelRebuild(self.parallelRebuild.isChecked())
+
+		if self.binaryPrices.isChecked() != self.app.prefs.getBinaryPrices():
+			self.app.prefs.setBinaryPrices(self.binaryPrices.isChecked())
+			self.app.stockData.setBinaryPrices(self.binaryPrices.isChecked())
+
 		if self.ofxDebug.isChecked() != self.app.prefs.getOfxDebug():
 			self.app.prefs.setOfxDebug(self.ofxDebug.isChecked())
 			
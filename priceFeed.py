@@ -0,0 +1,227 @@
+# Copyright (c) 2006-2010, Jesse Liesch
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the author nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE IMPLIED
+# DISCLAIMED. IN NO EVENT SHALL JESSE LIESCH BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Binary price feed returned by the server's getStockBinary call.  The feed is a zlib
+# stream in base64 holding feedMagic followed by blocks.  Each block is a headerStruct
+# of kind, record count and ticker length, then the ticker, then the records stored by
+# column.  Every column is a little endian array, the first column is the day number.
+import sys
+import zlib
+import array
+import base64
+import binascii
+import struct
+
+feedMagic = "ICB1"
+
+stockBlock = 1
+dividendBlock = 2
+splitBlock = 3
+versionBlock = 4
+
+headerStruct = struct.Struct("<BIB")
+
+# Array typecodes of the columns of each kind of block
+# Stock records are (day, open, high, low, close, volume) like PriceStore bars
+blockColumns = {
+	stockBlock: "iddddd",
+	dividendBlock: "id",
+	splitBlock: "id",
+	versionBlock: "iii"}
+
+swapBytes = sys.byteorder != "little"
+
+def encodeFeed(blocks):
+	'''Return a feed of blocks, a list of (kind, ticker, records).  Used by the server.'''
+	parts = [feedMagic]
+	for (kind, ticker, records) in blocks:
+		parts.append(headerStruct.pack(kind, len(records), len(ticker)))
+		parts.append(ticker)
+		for i in range(len(blockColumns[kind])):
+			column = array.array(blockColumns[kind][i], [record[i] for record in records])
+			if swapBytes:
+				column.byteswap()
+			parts.append(column.tostring())
+	return base64.b64encode(zlib.compress("".join(parts)))
+
+class FeedReader:
+	'''Decodes a feed a chunk at a time so the whole feed is never held decompressed'''
+	def __init__(self, data, chunkSize = 65536):
+		self.data = data
+		self.offset = 0
+		self.chunkSize = chunkSize
+		self.pending = ""
+		self.decompressor = zlib.decompressobj()
+		self.buffer = ""
+		self.pos = 0
+	
+	def fill(self, size):
+		'''Buffer at least size bytes.  Return False if the feed ends first.'''
+		while len(self.buffer) - self.pos < size:
+			if self.offset < len(self.data):
+				chunk = self.data[self.offset:self.offset + self.chunkSize]
+				self.offset += self.chunkSize
+				if isinstance(chunk, unicode):
+					chunk = chunk.encode("ascii")
+				
+				# Decode whole base64 quanta, keep the rest for the next chunk
+				chunk = self.pending + chunk.translate(None, " \t\r\n")
+				end = len(chunk) - len(chunk) % 4
+				self.pending = chunk[end:]
+				more = self.decompressor.decompress(binascii.a2b_base64(chunk[:end]))
+			else:
+				more = self.decompressor.flush()
+				if not more:
+					return False
+			self.buffer = self.buffer[self.pos:] + more
+			self.pos = 0
+		return True
+	
+	def read(self, size):
+		if not self.fill(size):
+			raise ValueError("Truncated price feed")
+		ret = self.buffer[self.pos:self.pos + size]
+		self.pos += size
+		return ret
+	
+	def readRecords(self, columns, count):
+		'''Return a list of count record tuples with the given column typecodes'''
+		arrays = []
+		for typecode in columns:
+			column = array.array(typecode)
+			column.fromstring(self.read(column.itemsize * count))
+			if swapBytes:
+				column.byteswap()
+			arrays.append(column)
+		return zip(*arrays)
+	
+	def blocks(self):
+		'''Generate (kind, ticker, records) for every block'''
+		if self.read(len(feedMagic)) != feedMagic:
+			raise ValueError("Not a binary price feed")
+		while self.fill(1):
+			(kind, count, tickerLength) = headerStruct.unpack(self.read(headerStruct.size))
+			ticker = self.read(tickerLength)
+			if not kind in blockColumns:
+				raise ValueError("Unknown price feed block %d" % kind)
+			yield (kind, ticker, self.readRecords(blockColumns[kind], count))
+
+def decodeFeed(data, chunkSize = 65536):
+	'''Generate (kind, ticker, records) for every block of a feed'''
+	return FeedReader(data, chunkSize).blocks()
+
+if __name__ == "__main__":
+	import json
+	import time
+	import random
+	import datetime
+	import threading
+	import BaseHTTPServer
+	import SocketServer
+	from jsonrpc import ServiceProxy
+	from dayStorage import textToDay
+	
+	# Ten years of bars for 20 tickers, roughly a long offline period
+	random.seed(1)
+	blocks = [(versionBlock, "", [(1, 2, 3)])]
+	csv = ["#vers,1,2,3"]
+	first = datetime.date(2000, 1, 1).toordinal()
+	for t in range(20):
+		ticker = "T%d" % t
+		bars = []
+		for day in range(first, first + 3650):
+			bar = (day, round(random.random() * 100, 2), round(random.random() * 100, 2), round(random.random() * 100, 2), round(random.random() * 100, 2), float(random.randint(0, 1000000)))
+			bars.append(bar)
+			csv.append("stock,%s,%s,%r,%r,%r,%r,%r" % ((ticker, datetime.date.fromordinal(day).strftime("%Y-%m-%d 00:00:00")) + bar[1:]))
+		blocks.append((stockBlock, ticker, bars))
+		blocks.append((dividendBlock, ticker, [(first + 100, 0.25)]))
+		blocks.append((splitBlock, ticker, [(first + 200, 2.0)]))
+		csv.append("dividend,%s,%s,0.25" % (ticker, datetime.date.fromordinal(first + 100).strftime("%Y-%m-%d 00:00:00")))
+		csv.append("split,%s,%s,2.0" % (ticker, datetime.date.fromordinal(first + 200).strftime("%Y-%m-%d 00:00:00")))
+	csv = base64.b64encode(zlib.compress("\n".join(csv)))
+	feed = encodeFeed(blocks)
+	
+	print "test1 - decode with chunk boundaries"
+	for chunkSize in [1, 7, 1000, 65536]:
+		assert list(decodeFeed(encodeFeed(blocks[:4]), chunkSize)) == blocks[:4]
+	assert list(decodeFeed(unicode(encodeFeed(blocks[:2])))) == blocks[:2]
+	
+	print "test2 - truncated and foreign feeds"
+	truncated = base64.b64encode(zlib.compress(zlib.decompress(base64.b64decode(feed))[:1000]))
+	for bad in [truncated, base64.b64encode(zlib.compress("stock,A"))]:
+		try:
+			list(decodeFeed(bad))
+			assert False
+		except ValueError:
+			pass
+	
+	print "test3 - local stand-in server"
+	class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+		protocol_version = "HTTP/1.1"
+		wbufsize = -1
+		
+		def do_POST(self):
+			request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+			if request["method"] == "getStockBinary":
+				result = feed
+			else:
+				result = csv
+			response = json.dumps({"result": result, "error": None, "id": request["id"]})
+			self.send_response(200)
+			self.send_header("Connection", "close")
+			self.send_header("Content-Length", str(len(response)))
+			self.end_headers()
+			self.wfile.write(response)
+		
+		def log_message(self, *args):
+			pass
+	
+	class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+		daemon_threads = True
+	
+	server = StandInServer(("127.0.0.1", 0), StandInHandler)
+	thread = threading.Thread(target = server.serve_forever)
+	thread.setDaemon(True)
+	thread.start()
+	proxy = ServiceProxy("http://127.0.0.1:%d/" % server.server_address[1])
+	
+	# Parse the CSV feed the way StockData.getFromServer did
+	start = time.time()
+	data = zlib.decompress(binascii.a2b_base64(proxy.getStockZip({})))
+	csvBars = 0
+	for line in data.split("\n"):
+		values = line.split(",")
+		if values[0] == "stock" and len(values) == 8:
+			bar = (textToDay(values[2]), float(values[3]), float(values[4]), float(values[5]), float(values[6]), float(values[7]))
+			csvBars += 1
+	csvTime = time.time() - start
+	
+	start = time.time()
+	received = list(decodeFeed(proxy.getStockBinary({})))
+	binaryTime = time.time() - start
+	assert received == blocks
+	assert csvBars == sum([len(b[2]) for b in blocks if b[0] == stockBlock])
+	print "  %d bars, csv %.0f ms %d bytes, binary %.0f ms %d bytes" % (csvBars, csvTime * 1000, len(csv), binaryTime * 1000, len(feed))
+	server.shutdown()
@@ -0,0 +1,254 @@
+# Copyright (c) 2006-2010, Jesse Liesch
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the author nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE IMPLIED
+# DISCLAIMED. IN NO EVENT SHALL JESSE LIESCH BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import mmap
+import struct
+import datetime
+import threading
+
+# Each bar is a date ordinal followed by open, high, low, close and volume
+barStruct = struct.Struct("<i5d")
+dayStruct = struct.Struct("<i")
+barSize = barStruct.size
+
+def tickerFileName(ticker):
+	'''Return the file name for a ticker.  Characters other than letters, digits, "." and "-"
+	are escaped so every ticker maps to a different file.'''
+	name = ""
+	for c in ticker.upper():
+		if c.isalnum() or c in ".-":
+			name += c
+		else:
+			name += "_%02x" % ord(c)
+	return name + ".bars"
+
+def barToPrice(bar):
+	'''Convert a bar tuple to the price dictionary returned by StockData'''
+	return {
+		"date": datetime.datetime.fromordinal(bar[0]),
+		"open": bar[1],
+		"high": bar[2],
+		"low": bar[3],
+		"close": bar[4],
+		"volume": bar[5]}
+
+class PriceFile:
+	'''Read only memory mapped view of a ticker's bars.  Bars are sorted by day.'''
+	def __init__(self, path):
+		self.file = open(path, "rb")
+		self.count = os.fstat(self.file.fileno()).st_size / barSize
+		self.map = False
+		if self.count > 0:
+			self.map = mmap.mmap(self.file.fileno(), self.count * barSize, access = mmap.ACCESS_READ)
+	
+	def close(self):
+		if self.map:
+			self.map.close()
+			self.map = False
+		self.file.close()
+	
+	def getDay(self, i):
+		return dayStruct.unpack_from(self.map, i * barSize)[0]
+	
+	def getBar(self, i):
+		return barStruct.unpack_from(self.map, i * barSize)
+	
+	def find(self, day):
+		'''Return the index of the first bar on or after day'''
+		lower = 0
+		upper = self.count
+		while lower < upper:
+			mid = (lower + upper) / 2
+			if self.getDay(mid) < day:
+				lower = mid + 1
+			else:
+				upper = mid
+		return lower
+	
+	def getBars(self, firstDay = False, lastDay = False):
+		'''Return the bars from firstDay through lastDay inclusive'''
+		first = 0
+		last = self.count
+		if firstDay is not False:
+			first = self.find(firstDay)
+		if lastDay is not False:
+			last = self.find(lastDay + 1)
+		unpack = barStruct.unpack_from
+		data = self.map
+		return [unpack(data, i * barSize) for i in xrange(first, last)]
+
+class PriceStore:
+	'''Keeps the price history of each ticker in a fixed width binary file of bars.
+	
+	Readers memory map the file and unpack only the bars in the requested range.  New bars
+	after the last bar are appended.  Bars on or before the last bar rewrite the file.
+	
+	The store is shared by the GUI and AutoUpdater threads.  Every method holds lock, so a
+	file is never closed or replaced while another thread is reading it.  PriceFiles are
+	only used inside the store.'''
+	def __init__(self, path):
+		self.path = path
+		if not os.path.isdir(path):
+			os.makedirs(path)
+		self.files = {}
+		self.lock = threading.RLock()
+	
+	def getPath(self, ticker):
+		return os.path.join(self.path, tickerFileName(ticker))
+	
+	def hasTicker(self, ticker):
+		return os.path.exists(self.getPath(ticker))
+	
+	def getFile(self, ticker):
+		'''Return the PriceFile for ticker, or False if it has no file.  Call with lock held.'''
+		ticker = ticker.upper()
+		if not ticker in self.files:
+			if not self.hasTicker(ticker):
+				return False
+			self.files[ticker] = PriceFile(self.getPath(ticker))
+		return self.files[ticker]
+	
+	def closeFile(self, ticker):
+		self.lock.acquire()
+		try:
+			ticker = ticker.upper()
+			if ticker in self.files:
+				self.files[ticker].close()
+				del self.files[ticker]
+		finally:
+			self.lock.release()
+	
+	def close(self):
+		self.lock.acquire()
+		try:
+			for ticker in self.files.keys():
+				self.closeFile(ticker)
+		finally:
+			self.lock.release()
+	
+	def getBars(self, ticker, firstDay = False, lastDay = False):
+		'''Return the bars of ticker from firstDay through lastDay inclusive'''
+		self.lock.acquire()
+		try:
+			f = self.getFile(ticker)
+			if not f:
+				return []
+			return f.getBars(firstDay, lastDay)
+		finally:
+			self.lock.release()
+	
+	def getFirstDay(self, ticker):
+		'''Return the day of the first bar of ticker or False if it has none'''
+		self.lock.acquire()
+		try:
+			f = self.getFile(ticker)
+			if not f or f.count == 0:
+				return False
+			return f.getDay(0)
+		finally:
+			self.lock.release()
+	
+	def getLastDay(self, ticker):
+		'''Return the day of the last bar of ticker or False if it has none'''
+		self.lock.acquire()
+		try:
+			f = self.getFile(ticker)
+			if not f or f.count == 0:
+				return False
+			return f.getDay(f.count - 1)
+		finally:
+			self.lock.release()
+	
+	def write(self, ticker, bars):
+		'''Add or replace bars, a list of (day, open, high, low, close, volume) tuples.
+		Return True if any bar was added or changed.'''
+		if not bars:
+			return False
+		bars = sorted(bars)
+		
+		self.lock.acquire()
+		try:
+			f = self.getFile(ticker)
+			lastDay = False
+			if f and f.count > 0:
+				lastDay = f.getDay(f.count - 1)
+		
+			# Append only
+			if lastDay is False or bars[0][0] > lastDay:
+				self.closeFile(ticker)
+				out = open(self.getPath(ticker), "ab")
+				previous = False
+				for bar in bars:
+					if bar[0] != previous:
+						out.write(barStruct.pack(*bar))
+					previous = bar[0]
+				out.close()
+				return True
+		
+			# Merge with existing bars
+			existing = dict((bar[0], bar) for bar in f.getBars())
+			changed = False
+			for bar in bars:
+				bar = tuple(bar)
+				if existing.get(bar[0]) != bar:
+					existing[bar[0]] = bar
+					changed = True
+			if changed:
+				self.rewrite(ticker, existing)
+			return changed
+		finally:
+			self.lock.release()
+	
+	def delete(self, ticker, day):
+		'''Delete the bar on day.  Return True if it existed.'''
+		self.lock.acquire()
+		try:
+			existing = dict((bar[0], bar) for bar in self.getBars(ticker))
+			if not day in existing:
+				return False
+			del existing[day]
+			self.rewrite(ticker, existing)
+			return True
+		finally:
+			self.lock.release()
+	
+	def rewrite(self, ticker, bars):
+		'''Replace the file of ticker with bars, a dictionary indexed by day'''
+		self.lock.acquire()
+		try:
+			self.closeFile(ticker)
+			path = self.getPath(ticker)
+			out = open(path + ".tmp", "wb")
+			for day in sorted(bars):
+				out.write(barStruct.pack(*bars[day]))
+			out.close()
+			
+			# Windows can not rename over an existing file
+			if os.path.exists(path):
+				os.remove(path)
+			os.rename(path + ".tmp", path)
+		finally:
+			self.lock.release()
@@ -31,6 +31,43 @@ import appGlobal
 import prefs
 import chart
 
+def checkBenchmark(portfolio, stockData):
+	'''Compare a benchmark's simulated position history against the generic transaction replay.
+	The benchmark's transactions are copied to a scratch portfolio and rebuilt there.
+	Returns True if every row matches.'''
+	import tempfile
+	(handle, path) = tempfile.mkstemp(suffix = ".db")
+	os.close(handle)
+	replay = Portfolio(portfolio.name + " replay", customDb = path)
+	try:
+		replay.db.beginTransaction()
+		for t in portfolio.getTransactions(ascending = True):
+			data = t.getSaveData()
+			data["auto"] = False
+			replay.db.insert("transactions", data)
+		replay.db.commitTransaction()
+		replay.rebuildPositionHistory(stockData)
+		
+		expected = {}
+		for row in replay.db.select("positionHistory").fetchall():
+			expected[(row["ticker"], replay.historyDates.toDate(row[replay.historyDates.name]))] = row
+		
+		passed = True
+		for row in portfolio.db.select("positionHistory").fetchall():
+			key = (row["ticker"], portfolio.historyDates.toDate(row[portfolio.historyDates.name]))
+			if not key in expected:
+				passed = False
+				print "FAIL %s benchmark: no replay row for %s %s" % (portfolio.name, key[0], key[1])
+				continue
+			for col in ["shares", "value", "normSplit", "normDividend", "normFee", "profitSplit", "profitDividend", "profitFee"]:
+				if abs(row[col] - expected[key][col]) >= 1.0e-6 * max(1.0, abs(expected[key][col])):
+					passed = False
+					print "FAIL %s benchmark %s %s: %s %f should be %f" % (portfolio.name, key[0], key[1], col, row[col], expected[key][col])
+		return passed
+	finally:
+		replay.close()
+		os.remove(path)
+
 def run(argv):
 	# Disable preferences when running regression
 	prefs.prefs = False
@@ -66,6 +103,10 @@ def run(argv):
 		
 		f = open(filename, "r")
 		passedAll = True
+		
+		# Benchmarks are simulated directly, check them against the generic replay
+		if portfolio.isBenchmark() and not checkBenchmark(portfolio, appGlobal.getApp().stockData):
+			passedAll = False
 		for l in f.readlines():
 			l = l.strip("\n").strip(" ")
 			if not l or l[0] == "#":
@@ -181,6 +222,8 @@ def run(argv):
 					print "    %s: %s should be %s" % (key, chartVal, val)
 			else:
 				# Validate positionHistory
+				if "date" in query:
+					query[portfolio.historyDates.name] = portfolio.historyDates.fromText(query.pop("date"))
 				result = portfolio.db.select("positionHistory", where = query)
 				row = result.fetchone()
 				del result
@@ -210,6 +253,7 @@ def run(argv):
 		# Delete position history if the portfolio is in the regression directory
 		if inRegression:
 			portfolio.db.query("delete from positionHistory")
+			portfolio.db.query("delete from currentPositions")
 		
 		if not commit:
 			portfolio.db.rollbackTransaction()
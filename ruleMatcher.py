@@ -0,0 +1,114 @@
+# Copyright (c) 2006-2010, Jesse Liesch
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the author nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE IMPLIED
+# DISCLAIMED. IN NO EVENT SHALL JESSE LIESCH BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import re
+
+# Characters that make a rule a regular expression instead of plain text
+regexChars = ".^$*+?{}[]\\|()"
+
+class RuleMatcher:
+	'''Matches payees against the banking rules of a portfolio.
+	
+	A rule matches a payee if it is found anywhere in the payee ignoring case.  Rules are
+	regular expressions.  Rules that are plain text are matched with a substring search.
+	When several rules match a payee the last one wins.  Rules that are not valid regular
+	expressions never match and are listed in invalid.'''
+	def __init__(self, rules):
+		# List of (rule, category, text, compiled regex or None if invalid)
+		self.rules = []
+		self.invalid = []
+		
+		combined = []
+		for (rule, category) in rules:
+			isText = True
+			for c in rule:
+				if c in regexChars:
+					isText = False
+					break
+			
+			if isText:
+				self.rules.append((rule, category, rule.lower()))
+				# lower() and IGNORECASE only agree on ascii
+				try:
+					rule.encode("ascii")
+				except UnicodeError:
+					combined = False
+				if combined is not False:
+					combined.append(re.escape(rule))
+				continue
+			
+			try:
+				regex = re.compile(rule, re.IGNORECASE)
+			except re.error:
+				self.rules.append((rule, category, None))
+				self.invalid.append(rule)
+				continue
+			self.rules.append((rule, category, regex))
+			
+			# Groups would renumber back references in the combined regex
+			if regex.groups > 0:
+				combined = False
+			elif combined is not False:
+				combined.append("(?:" + rule + ")")
+		
+		# Quickly reject payees that match no rule
+		self.combined = False
+		if combined:
+			self.combined = re.compile("|".join(combined), re.IGNORECASE)
+	
+	def matches(self, rule, payee, lowerPayee):
+		if rule[2] is None:
+			return False
+		if isinstance(rule[2], basestring):
+			return rule[2] in lowerPayee
+		return rule[2].search(payee) is not None
+	
+	def match(self, payee):
+		'''Return the (rule, category) of the last rule matching payee or False'''
+		if self.combined and not self.combined.search(payee):
+			return False
+		
+		lowerPayee = payee.lower()
+		for i in range(len(self.rules) - 1, -1, -1):
+			rule = self.rules[i]
+			if self.matches(rule, payee, lowerPayee):
+				return (rule[0], rule[1])
+		return False
+	
+	def preview(self, payees):
+		'''Return a list of (rule, category, count) where count is how many of payees each rule matches'''
+		counts = [0] * len(self.rules)
+		for payee in payees:
+			if self.combined and not self.combined.search(payee):
+				continue
+			lowerPayee = payee.lower()
+			for i in range(len(self.rules)):
+				if self.matches(self.rules[i], payee, lowerPayee):
+					counts[i] += 1
+		
+		ret = []
+		for i in range(len(self.rules)):
+			ret.append((self.rules[i][0], self.rules[i][1], counts[i]))
+		return ret
@@ -23,9 +23,10 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from jsonrpc import ServiceProxy
+from jsonrpc import ServiceProxy, JSONRPCException
 from db import *
 import os
+import sys
 import datetime
 import prefs
 import zlib
@@ -33,34 +34,75 @@ import binascii
 
 import appGlobal
 from transaction import *
+from dayStorage import *
+from priceStore import *
+from priceFeed import *
+
+# Daily tables of stocks.db.  See dayStorage for the optional integer day layout.
+stockDataFields = [
+	{"name": "ticker", "type": "text"},
+	{"name": "date", "type": "datetime"},
+	{"name": "open", "type": "float default 0.0"},
+	{"name": "high", "type": "float default 0.0"},
+	{"name": "low", "type": "float default 0.0"},
+	{"name": "close", "type": "float default 0.0"},
+	{"name": "volume", "type": "float default 0"}]
+
+stockValueFields = [
+	{"name": "ticker", "type": "text"},
+	{"name": "date", "type": "datetime"},
+	{"name": "value", "type": "float"}]
+
+stockTables = {
+	"stockData": stockDataFields,
+	"stockDividends": stockValueFields,
+	"stockSplits": stockValueFields}
+
+def migrateStocksToDays(db):
+	'''Convert the daily tables of stocks.db to the integer day layout.  Return True if any table changed.'''
+	changed = False
+	for table in sorted(stockTables):
+		if migrateTable(db, table, stockTables[table]):
+			changed = True
+	return changed
+
+def dedupeNews(db):
+	'''Remove news saved more than once for a ticker and url before stockNews was uniquely indexed on them'''
+	master = "select name from sqlite_master where type = ? and name = ?"
+	if db.query(master, ("table", "stockNews")).fetchone() and not db.query(master, ("index", "newsTickerUrl")).fetchone():
+		db.query("delete from stockNews where rowid not in (select max(rowid) from stockNews group by ticker, url)")
+
+def nearestRows(rows, dates, tolerance):
+	'''Return the row nearest each date within tolerance days, or False, as a dictionary indexed by date.
+	rows is a dictionary indexed by day number.'''
+	# Search closest days first, earlier before later
+	offsets = [0]
+	for d in range(1, tolerance + 1):
+		offsets += [-d, d]
+	
+	ret = {}
+	for date in dates:
+		ret[date] = False
+		for d in offsets:
+			day = date.toordinal() + d
+			if day in rows:
+				ret[date] = rows[day]
+				break
+	return ret
 
 class StockData:
-	def __init__(self):
+	def __init__(self, binaryPrices = False):
 		self.s = ServiceProxy("http://www.icarra2.com/cgi-bin/webApi.py")
 		
 		self.db = Db(os.path.join(prefs.Prefs.prefsRootPath(), "stocks.db"))
+		
+		# All daily tables are migrated together
+		self.dates = getDateColumn(self.db, "stockData")
+		
 		# TODO: make unique index on ticker
-		self.db.checkTable("stockData", [
-			{"name": "ticker", "type": "text"},
-			{"name": "date", "type": "datetime"},
-			{"name": "open", "type": "float default 0.0"},
-			{"name": "high", "type": "float default 0.0"},
-			{"name": "low", "type": "float default 0.0"},
-			{"name": "close", "type": "float default 0.0"},
-			{"name": "volume", "type": "float default 0"}], index = [
-			{"name": "tickerDate", "cols": ["ticker", "date"]}])
-		
-		self.db.checkTable("stockDividends", [
-			{"name": "ticker", "type": "text"},
-			{"name": "date", "type": "datetime"},
-			{"name": "value", "type": "float"}], index = [
-			{"name": "tickerDate", "cols": ["ticker", "date"]}])
-
-		self.db.checkTable("stockSplits", [
-			{"name": "ticker", "type": "text"},
-			{"name": "date", "type": "datetime"},
-			{"name": "value", "type": "float"}], index = [
-			{"name": "tickerDate", "cols": ["ticker", "date"]}])
+		for table in sorted(stockTables):
+			self.db.checkTable(table, self.dates.fields(stockTables[table]), index = self.dates.index([
+				{"name": "tickerDate", "cols": ["ticker", "date"]}]))
 
 		self.db.checkTable("stockInfo", [
 			{"name": "ticker", "type": "text"},
@@ -69,6 +111,7 @@ class StockData:
 			{"name": "name", "type": "text"}], unique = [
 			{"name": "ticker", "cols": ["ticker"]}])
 
+		dedupeNews(self.db)
 		self.db.checkTable("stockNews", [
 			{"name": "ticker", "type": "text"},
 			{"name": "date", "type": "datetime"},
@@ -78,9 +121,71 @@ class StockData:
 			{"name": "url", "type": "text"},
 			{"name": "downloaded", "type": "bool default 0"},
 			{"name": "content", "type": "text"}], index = [
-			{"name": "tickerDate", "cols": ["ticker", "date"]}])
+			{"name": "tickerDate", "cols": ["ticker", "date"]}], unique = [
+			{"name": "newsTickerUrl", "cols": ["ticker", "url"]}])
+
+		# Conditional request headers of each ticker's news feed
+		self.db.checkTable("newsFeeds", [
+			{"name": "ticker", "type": "text"},
+			{"name": "etag", "type": "text"},
+			{"name": "modified", "type": "text"}], unique = [
+			{"name": "newsFeedTicker", "cols": ["ticker"]}])
 
 		self.stocks = {}
+		
+		self.priceStore = False
+		self.setBinaryPrices(binaryPrices)
+		
+		# Ask for the binary price feed until the server does not support it
+		self.binaryFeed = True
+	
+	def setBinaryPrices(self, binary):
+		'''Keep prices in a PriceStore in the prices directory instead of the stockData table.
+		Dividends and splits stay in the database.  Tickers are copied from the stockData table
+		when first read, see convertTicker.'''
+		if self.priceStore:
+			self.priceStore.close()
+		self.priceStore = False
+		if binary:
+			self.priceStore = PriceStore(os.path.join(prefs.Prefs.prefsRootPath(), "prices"))
+		
+		# Tickers already copied or found in the PriceStore, tickers without any stockData
+		# rows never get a file so hasTicker can not tell they were checked
+		self.checkedTickers = set()
+	
+	def checkPriceTicker(self, ticker):
+		'''Copy ticker from the stockData table to the PriceStore if it is not there yet.  Each ticker is only checked once.'''
+		if ticker in self.checkedTickers:
+			return
+		if not self.priceStore.hasTicker(ticker):
+			self.convertTicker(ticker)
+		self.checkedTickers.add(ticker)
+	
+	def getPriceBars(self, ticker, firstDay = False, lastDay = False):
+		'''Return the PriceStore bars of ticker from firstDay through lastDay'''
+		self.checkPriceTicker(ticker)
+		return self.priceStore.getBars(ticker, firstDay, lastDay)
+	
+	def convertTicker(self, ticker):
+		'''Copy the stockData rows of ticker to the PriceStore.  Return True if any were copied.'''
+		cursor = self.db.select("stockData", where = {"ticker": ticker.upper()}, orderBy = self.dates.name + " asc")
+		bars = []
+		for row in cursor.fetchall():
+			bars.append((
+				self.dates.toDay(row[self.dates.name]),
+				float(row["open"]),
+				float(row["high"]),
+				float(row["low"]),
+				float(row["close"]),
+				float(row["volume"])))
+		return self.priceStore.write(ticker, bars)
+	
+	def convertToPriceStore(self):
+		'''Copy every ticker in the stockData table that is not already in the PriceStore'''
+		cursor = self.db.query("select distinct(ticker) as ticker from stockData")
+		for row in cursor.fetchall():
+			if row["ticker"] and not self.priceStore.hasTicker(row["ticker"]):
+				self.convertTicker(row["ticker"])
 	
 	def updateStocks(self, tickers, status = False):
 		'''Return True if new data is received'''
@@ -180,11 +285,28 @@ class StockData:
 		try:
 			if status:
 				status.setStatus("Receiving Stock Data", 70)
-			data = self.s.getStockZip(request)
+			feed = None
+			if self.binaryFeed:
+				try:
+					feed = self.s.getStockBinary(request)
+				except JSONRPCException:
+					# Older servers only send CSV
+					self.binaryFeed = False
+			if feed is None:
+				data = self.s.getStockZip(request)
 		except Exception, inst:
 			appGlobal.setFailConnected(True)
 			return False
 		
+		if not feed is None:
+			if status:
+				status.setStatus("Updating Stock Database", 80)
+			return self.saveFeed(feed, icarraTickers)
+		
+		# The json codec returns unicode
+		if isinstance(data, unicode):
+			data = data.encode("utf-8")
+		
 		# Try decompressing
 		# Ignore errors (assume not compressed)
 		try:
@@ -198,6 +320,7 @@ class StockData:
 			status.setStatus("Updating Stock Database", 80)
 		self.db.beginTransaction()
 		gotData = False
+		bars = {}
 		for line in data.split("\n"):
 			#print line
 			values = line.split(",")
@@ -206,14 +329,19 @@ class StockData:
 			
 			if values[0] == "#vers" and len(values) == 4:
 				appGlobal.getApp().prefs.updateLatestVersion(int(values[1]), int(values[2]), int(values[3]))
-			if values[0] == "stock" and len(values) == 8:
+			if values[0] == "stock" and len(values) == 8 and self.priceStore:
+				ticker = icarraTickers[values[1].upper()].upper()
+				if not ticker in bars:
+					bars[ticker] = []
+				bars[ticker].append((textToDay(values[2]), float(values[3]), float(values[4]), float(values[5]), float(values[6]), float(values[7])))
+			elif values[0] == "stock" and len(values) == 8:
 				on = {
 					"ticker": icarraTickers[values[1].upper()],
-					"date": values[2]
+					self.dates.name: self.dates.fromText(values[2])
 					}
 				if self.db.insertOrUpdate("stockData", {
 					"ticker": icarraTickers[values[1].upper()],
-					"date": values[2],
+					self.dates.name: self.dates.fromText(values[2]),
 					"open": values[3],
 					"high": values[4],
 					"low": values[5],
@@ -221,29 +349,133 @@ class StockData:
 					"volume": values[7]},
 					on):
 					gotData = True
-			elif values[0] == "dividend" and len(values) == 4:
-				if self.db.insertOrUpdate("stockDividends", {
-					"ticker": icarraTickers[values[1].upper()],
-					"date": values[2],
-					"value": values[3]}):
-					gotData = True
-			elif values[0] == "split" and len(values) == 4:
-				if self.db.insertOrUpdate("stockSplits", {
+			elif (values[0] == "dividend" or values[0] == "split") and len(values) == 4:
+				if values[0] == "dividend":
+					table = "stockDividends"
+				else:
+					table = "stockSplits"
+				data = {
 					"ticker": icarraTickers[values[1].upper()],
-					"date": values[2],
-					"value": values[3]}):
+					self.dates.name: self.dates.fromText(values[2]),
+					"value": values[3]}
+				
+				# Day tables hold one row per ticker and day
+				on = {}
+				if self.dates.days:
+					on = {"ticker": data["ticker"], "day": data["day"]}
+				if self.db.insertOrUpdate(table, data, on):
 					gotData = True
 		self.db.commitTransaction()
 		
+		for ticker in bars:
+			# Copy older prices before adding new ones
+			self.checkPriceTicker(ticker)
+			if self.priceStore.write(ticker, bars[ticker]):
+				gotData = True
+		
 		return gotData
 	
+	def saveFeed(self, feed, icarraTickers):
+		'''Save a binary price feed from getStockBinary, see priceFeed.  Blocks are decoded and
+		saved one at a time.  Return True if new stock data is received.'''
+		gotData = False
+		self.db.beginTransaction()
+		try:
+			for (kind, ticker, records) in decodeFeed(feed):
+				if kind == versionBlock:
+					appGlobal.getApp().prefs.updateLatestVersion(*records[0])
+					continue
+				
+				ticker = icarraTickers[ticker.upper()]
+				if kind == stockBlock and self.priceStore:
+					# Copy older prices before adding new ones
+					self.checkPriceTicker(ticker.upper())
+					if self.priceStore.write(ticker.upper(), records):
+						gotData = True
+				elif kind == stockBlock:
+					for (day, open, high, low, close, volume) in records:
+						date = self.dates.fromDate(datetime.datetime.fromordinal(day))
+						if self.db.insertOrUpdate("stockData", {
+							"ticker": ticker,
+							self.dates.name: date,
+							"open": open,
+							"high": high,
+							"low": low,
+							"close": close,
+							"volume": volume},
+							{"ticker": ticker, self.dates.name: date}):
+							gotData = True
+				else:
+					if kind == dividendBlock:
+						table = "stockDividends"
+					else:
+						table = "stockSplits"
+					for (day, value) in records:
+						data = {
+							"ticker": ticker,
+							self.dates.name: self.dates.fromDate(datetime.datetime.fromordinal(day)),
+							"value": value}
+						
+						# Day tables hold one row per ticker and day
+						on = {}
+						if self.dates.days:
+							on = {"ticker": data["ticker"], "day": data["day"]}
+						if self.db.insertOrUpdate(table, data, on):
+							gotData = True
+		except ValueError:
+			# Keep the blocks received before a damaged block
+			pass
+		self.db.commitTransaction()
+		
+		return gotData
+	
+	def saveData(self, table, ticker, date, values, oldDate = False):
+		'''Insert a row of stockData, stockDividends or stockSplits.  If oldDate is set
+		the row on oldDate is updated instead.'''
+		if table == "stockData" and self.priceStore:
+			self.savePriceBar(ticker, date, values, oldDate)
+			return
+		
+		data = values.copy()
+		data["ticker"] = ticker
+		data[self.dates.name] = self.dates.fromDate(date)
+		if oldDate:
+			self.db.update(table, data, {"ticker": ticker, self.dates.name: self.dates.fromDate(oldDate)})
+		else:
+			self.db.insert(table, data)
+	
+	def savePriceBar(self, ticker, date, values, oldDate = False):
+		'''saveData for the PriceStore.  Missing values are kept from the old bar or are 0.'''
+		bar = {"open": 0.0, "high": 0.0, "low": 0.0, "close": 0.0, "volume": 0.0}
+		
+		# Readers should not see the bar removed before it is written again
+		self.priceStore.lock.acquire()
+		try:
+			if oldDate:
+				old = self.getPriceBars(ticker, oldDate.toordinal(), oldDate.toordinal())
+				if old:
+					bar = barToPrice(old[0])
+				self.priceStore.delete(ticker, oldDate.toordinal())
+			bar.update(values)
+			self.priceStore.write(ticker, [(date.toordinal(), float(bar["open"]), float(bar["high"]), float(bar["low"]), float(bar["close"]), float(bar["volume"]))])
+		finally:
+			self.priceStore.lock.release()
+	
+	def deleteData(self, table, ticker, date):
+		'''Delete the row of stockData, stockDividends or stockSplits on date'''
+		if table == "stockData" and self.priceStore:
+			self.checkPriceTicker(ticker)
+			self.priceStore.delete(ticker, date.toordinal())
+			return
+		self.db.delete(table, {"ticker": ticker, self.dates.name: self.dates.fromDate(date)})
+	
 	def readTickerFromDb(self, ticker):
-		res = self.db.select("stockData", where = {"ticker": ticker}, orderBy = "date")
+		res = self.db.select("stockData", where = {"ticker": ticker}, orderBy = self.dates.name)
 		
 		self.stocks[ticker] = []
 		for row in res.fetchall():
 			self.stocks[ticker].append({
-				"date": row["date"],
+				"date": self.dates.toText(row[self.dates.name]),
 				"open": row["open"],
 				"high": row["high"],
 				"low": row["low"],
@@ -252,7 +484,7 @@ class StockData:
 	
 	def readFromDb(self):
 		self.stocks = {}
-		res = self.db.select("stockData", orderBy = "ticker, date asc")
+		res = self.db.select("stockData", orderBy = "ticker, " + self.dates.name + " asc")
 		
 		lastTicker = ""
 		for row in res.fetchall():
@@ -260,7 +492,7 @@ class StockData:
 			if ticker != lastTicker:
 				self.stocks[ticker] = []
 			self.stocks[ticker].append({
-				"date": row["date"],
+				"date": self.dates.toText(row[self.dates.name]),
 				"open": row["open"],
 				"high": row["high"],
 				"low": row["low"],
@@ -327,20 +559,70 @@ class StockData:
 		
 		return ret
 
-	def getPrice(self, ticker, date):
-		where = {"ticker": ticker.upper(), "date": date.strftime("%Y-%m-%d 00:00:00")}
-		res = self.db.select("stockData", where = where)
-		row = res.fetchone()
-		if not row:
-			return False
+	def getRowsAt(self, table, ticker, dates, tolerance):
+		'''Return the row of table nearest each date, or False, as a dictionary indexed by date.
+		Reads every row within tolerance days of the dates with one range query.'''
+		ret = {}
+		if not dates:
+			return ret
+		
+		first = min(dates) - datetime.timedelta(days = tolerance)
+		last = max(dates) + datetime.timedelta(days = tolerance)
+		where = {
+			"ticker": ticker.upper(),
+			self.dates.name + " >=": self.dates.fromDate(first),
+			self.dates.name + " <=": self.dates.fromDate(last, endOfDay = True)}
+		cursor = self.db.select(table, where = where, orderBy = self.dates.name + " asc")
+		
+		# Index rows by day number, keeping the first row of each day
+		rows = {}
+		for row in cursor.fetchall():
+			day = self.dates.toDay(row[self.dates.name])
+			if not day in rows:
+				rows[day] = row
+		
+		return nearestRows(rows, dates, tolerance)
+
+	def getPricesAt(self, ticker, dates, tolerance = 0):
+		'''Return the price nearest each date within tolerance days as a dictionary indexed by date.
+		Dates without a price map to False.'''
+		if self.priceStore:
+			if not dates:
+				return {}
+			bars = self.getPriceBars(ticker, min(dates).toordinal() - tolerance, max(dates).toordinal() + tolerance)
+			ret = nearestRows(dict((bar[0], bar) for bar in bars), dates, tolerance)
+			for date in ret:
+				if ret[date]:
+					ret[date] = barToPrice(ret[date])
+			return ret
+		
+		ret = self.getRowsAt("stockData", ticker, dates, tolerance)
+		for date in ret:
+			row = ret[date]
+			if row:
+				ret[date] = {
+					"date": self.dates.toDate(row[self.dates.name]),
+					"open": float(row["open"]),
+					"high": float(row["high"]),
+					"low": float(row["low"]),
+					"close": float(row["close"]),
+					"volume": float(row["volume"])}
+		return ret
+
+	def getDividendsAt(self, ticker, dates, tolerance = 0):
+		'''Return the dividend nearest each date within tolerance days as a dictionary indexed by date.
+		Dates without a dividend map to False.'''
+		ret = self.getRowsAt("stockDividends", ticker, dates, tolerance)
+		for date in ret:
+			row = ret[date]
+			if row:
+				ret[date] = {
+					"date": self.dates.toDate(row[self.dates.name]),
+					"value": float(row["value"])}
+		return ret
 
-		return {
-			"date": Transaction.parseDate(row["date"]),
-			"open": float(row["open"]),
-			"high": float(row["high"]),
-			"low": float(row["low"]),
-			"close": float(row["close"]),
-			"volume": float(row["volume"])}
+	def getPrice(self, ticker, date):
+		return self.getPricesAt(ticker, [date])[date]
 	
 	def getOptionPrice(self, ticker, expire, strike, date, type):
 		# This function is currently a placeholder until Icarra supports option prices
@@ -348,55 +630,25 @@ class StockData:
 		# Extract first token (incase ticker is "VIX Feb-11 $xxx")
 		if ticker.find(" ") != -1:
 			ticker = ticker[:ticker.find(" ")]
-		transactions = appGlobal.getApp().portfolio.getTransactions(ticker, ascending = True)
-		price = False
-		for t in transactions:
-			if not t.type in [Transaction.buyToOpen, Transaction.buyToClose, Transaction.sellToOpen, Transaction.sellToClose] or t.ticker != ticker or t.optionExpire != expire or t.optionStrike != strike or t.subType != type:
-				continue
-			if t.date > date:
-				break
-			price = t.pricePerShare
-		return price
+		return appGlobal.getApp().portfolio.getOptionPrices().getPrice(ticker, expire, strike, date, type)
 
 	def getNearestPrice(self, ticker, date):
 		'''Return price closest to date.  Checks within +/- 7 days.'''
-		for d in [0, -1, 1, -2, 2, -3, 3, -4, 4, -5, 5, -6, 6, -7, 7]:
-			where = {"ticker": ticker.upper(), "date": (date + datetime.timedelta(days = d)).strftime("%Y-%m-%d 00:00:00")}
-			res = self.db.select("stockData", where = where)
-			row = res.fetchone()
-			if row:
-				return {
-					"date": Transaction.parseDate(row["date"]),
-					"open": float(row["open"]),
-					"high": float(row["high"]),
-					"low": float(row["low"]),
-					"close": float(row["close"]),
-					"volume": float(row["volume"])}
-		
-		return False
+		return self.getPricesAt(ticker, [date], 7)[date]
 
 	def getDividend(self, ticker, date):
-		where = {"ticker": ticker.upper(), "date": date.strftime("%Y-%m-%d 00:00:00")}
-		res = self.db.select("stockDividends", where = where)
-		
-		row = res.fetchone()
-		if not row:
-			return False
-
-		return {
-			"date": Transaction.parseDate(row["date"]),
-			"value": float(row["value"])}
+		return self.getDividendsAt(ticker, [date])[date]
 
 	def getDividends(self, ticker, firstDate = False, desc = False):
 		where = {"ticker": ticker.upper()}
 		if firstDate:
-			where["date >="] = firstDate.strftime("%Y-%m-%d 00:00:00")
-		cursor = self.db.select("stockDividends", where = where, orderBy = "date asc")
+			where[self.dates.name + " >="] = self.dates.fromDate(firstDate)
+		cursor = self.db.select("stockDividends", where = where, orderBy = self.dates.name + " asc")
 		
 		res = []
 		for row in cursor.fetchall():
 			res.append({
-				"date": Transaction.parseDate(row["date"]),
+				"date": self.dates.toDate(row[self.dates.name]),
 				"value": float(row["value"])})
 		
 		if desc:
@@ -407,13 +659,13 @@ class StockData:
 	def getSplits(self, ticker, firstDate = False, lastDate = False, desc = False):
 		where = {"ticker": ticker.upper()}
 		if firstDate:
-			where["date >="] = firstDate.strftime("%Y-%m-%d 00:00:00")
-		cursor = self.db.select("stockSplits", where = where, orderBy = "date asc")
+			where[self.dates.name + " >="] = self.dates.fromDate(firstDate)
+		cursor = self.db.select("stockSplits", where = where, orderBy = self.dates.name + " asc")
 		
 		res = []
 		for row in cursor.fetchall():
 			res.append({
-				"date": Transaction.parseDate(row["date"]),
+				"date": self.dates.toDate(row[self.dates.name]),
 				"value": float(row["value"])})
 		
 		if desc:
@@ -422,24 +674,36 @@ class StockData:
 		return res
 
 	def getPrices(self, ticker, endDate = False, startDate = False, desc = False, limit = False, splitAdjusted = False):
-		where = {"ticker": ticker.upper()}
-		order = "ticker, date asc"
-		if startDate:
-			where["date >="] = datetime.datetime(startDate.year, startDate.month, startDate.day, 0, 0, 0)
-		if endDate:
-			where["date <="] = datetime.datetime(endDate.year, endDate.month, endDate.day, 23, 59, 59)
-		res = self.db.select("stockData", where = where, orderBy = order, limit = limit)
-		
-		ret = []
-		for row in res.fetchall():
-			ticker = row["ticker"].upper()
-			ret.append({
-				"date": Transaction.parseDate(row["date"]),
-				"open": float(row["open"]),
-				"high": float(row["high"]),
-				"low": float(row["low"]),
-				"close": float(row["close"]),
-				"volume": float(row["volume"])})
+		ticker = ticker.upper()
+		if self.priceStore:
+			firstDay = False
+			lastDay = False
+			if startDate:
+				firstDay = startDate.toordinal()
+			if endDate:
+				lastDay = endDate.toordinal()
+			bars = self.getPriceBars(ticker, firstDay, lastDay)
+			if limit:
+				bars = bars[:limit]
+			ret = [barToPrice(bar) for bar in bars]
+		else:
+			where = {"ticker": ticker}
+			order = "ticker, " + self.dates.name + " asc"
+			if startDate:
+				where[self.dates.name + " >="] = self.dates.fromDate(startDate)
+			if endDate:
+				where[self.dates.name + " <="] = self.dates.fromDate(endDate, endOfDay = True)
+			res = self.db.select("stockData", where = where, orderBy = order, limit = limit)
+			
+			ret = []
+			for row in res.fetchall():
+				ret.append({
+					"date": self.dates.toDate(row[self.dates.name]),
+					"open": float(row["open"]),
+					"high": float(row["high"]),
+					"low": float(row["low"]),
+					"close": float(row["close"]),
+					"volume": float(row["volume"])})
 		
 		if splitAdjusted:
 			splitFactor = 1
@@ -465,20 +729,34 @@ class StockData:
 		return ret
 
 	def getLastDate(self, ticker):
-		res = self.db.select("stockData", where = {"ticker": ticker.upper()}, orderBy = "date desc", limit = 1)
+		if self.priceStore:
+			self.checkPriceTicker(ticker)
+			day = self.priceStore.getLastDay(ticker)
+			if day is False:
+				return False
+			return datetime.datetime.fromordinal(day)
+		
+		res = self.db.select("stockData", where = {"ticker": ticker.upper()}, orderBy = self.dates.name + " desc", limit = 1)
 		row = res.fetchone()
 		if not row:
 			return False
 		else:
-			return Transaction.parseDate(row["date"])
+			return self.dates.toDate(row[self.dates.name])
 
 	def getFirstDate(self, ticker):
-		res = self.db.select("stockData", where = {"ticker": ticker.upper()}, orderBy = "date asc", limit = 1)
+		if self.priceStore:
+			self.checkPriceTicker(ticker)
+			day = self.priceStore.getFirstDay(ticker)
+			if day is False:
+				return False
+			return datetime.datetime.fromordinal(day)
+		
+		res = self.db.select("stockData", where = {"ticker": ticker.upper()}, orderBy = self.dates.name + " asc", limit = 1)
 		row = res.fetchone()
 		if not row:
 			return False
 		else:
-			return Transaction.parseDate(row["date"])
+			return self.dates.toDate(row[self.dates.name])
 		
 	def addNews(self, ticker, date, title, summary, url):
 		data = {
@@ -490,12 +768,34 @@ class StockData:
 		}
 		on = {
 			"ticker": ticker,
-			"date": date,
 			"url": url
 		}
 
 		self.db.insertOrUpdate("stockNews", data, on)
 	
+	def saveNews(self, news, feeds):
+		'''Save downloaded news in one transaction.  news is a list of stockNews rows, rows already saved for a ticker and url are skipped.
+		feeds is a dictionary of (etag, modified) indexed by ticker as returned by getNewsFeeds.'''
+		self.db.beginTransaction()
+		self.db.insertMany("stockNews", news, ignore = True)
+		for ticker in feeds:
+			(etag, modified) = feeds[ticker]
+			if modified:
+				modified = ",".join([str(v) for v in modified])
+			self.db.insertOrUpdate("newsFeeds", {"ticker": ticker, "etag": etag, "modified": modified}, {"ticker": ticker})
+		self.db.commitTransaction()
+	
+	def getNewsFeeds(self):
+		'''Return the ETag and Last-Modified time of every downloaded news feed as a dictionary of (etag, modified) indexed by ticker'''
+		ret = {}
+		res = self.db.select("newsFeeds")
+		for row in res.fetchall():
+			modified = row["modified"]
+			if modified:
+				modified = tuple([int(v) for v in modified.split(",")])
+			ret[row["ticker"]] = (row["etag"], modified)
+		return ret
+	
 	def setNewsRating(self, ticker, date, url, rating):
 		where = {
 			"ticker": ticker,
@@ -518,6 +818,11 @@ class StockData:
 		return ret
 
 if __name__ == "__main__":
+	# Copy all prices to the binary PriceStore
+	if "convert" in sys.argv[1:]:
+		StockData(True).convertToPriceStore()
+		sys.exit()
+	
 	s = StockData()
 	s.getFromServer("agg")
 	s.readFromDb()
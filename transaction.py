@@ -817,20 +817,25 @@ class Transaction:
 		'''Return this transaction's total + fee value'''
 		return self.getTotal() + self.getFee()
 
+	def getDisplayTotal(self):
+		'''Return this transaction's total with the sign it is displayed with'''
+		if self.type in [Transaction.sell, Transaction.deposit, Transaction.dividend, Transaction.dividendReinvest]:
+			# Always positive
+			return abs(self.total)
+		elif self.type in [Transaction.buy, Transaction.withdrawal, Transaction.expense]:
+			# Always negative
+			return -abs(self.total)
+		else:
+			return self.total
+
 	def formatTotal(self):
 		'''Format this transaction's total for display purposes'''
 		if not self.total:
 			return ""
 		elif self.type in [Transaction.split]:
 			return self.splitValueToString(self.total)
-		elif self.type in [Transaction.sell, Transaction.deposit, Transaction.dividend, Transaction.dividendReinvest]:
-			# Always positive
-			return self.formatDollar(abs(self.total))
-		elif self.type in [Transaction.buy, Transaction.withdrawal, Transaction.expense]:
-			# Always negative
-			return self.formatDollar(-abs(self.total))
 		else:
-			return self.formatDollar(self.total)
+			return self.formatDollar(self.getDisplayTotal())
 	
 	def formatStrike(self):
 		'''Format this transaction's option strike for display purposes'''
@@ -10,6 +10,10 @@ class Twrr:
 		self.shares = {}
 		self.sharesShort = {}
 		self.prices = {}
+		
+		# Value of each long holding and their running total, see updateValue
+		self.values = {}
+		self.longValue = 0.0
 		self.yesterdayPrices = {}
 		self.basis = Basis()
 		self.adjustBasises = {}
@@ -22,8 +26,7 @@ class Twrr:
 		self.stockDividend = {}
 		self.dividendMod = 1.0
 		self.feeMod = 1.0
-
-	def beginTransactions(self):
+		
 		# cashIn and sharesIn are keyed by ticker
 		self.cashIn = {}
 		self.sharesIn = {}
@@ -35,8 +38,36 @@ class Twrr:
 		self.sharesOutShort = {}
 		self.dividends = 0.0
 		self.fees = 0.0
+		
+		# Totals of today's cashIn, cashOut, cashInShort and cashOutShort
+		# traded is True if any shares were added or removed today
+		self.todayCashIn = 0.0
+		self.todayCashOut = 0.0
+		self.todayNetCashIn = 0.0
+		self.traded = False
+
+	def beginTransactions(self):
+		# The per ticker dictionaries are only reset if shares were traded
+		if self.traded:
+			self.clearTrades()
+		self.dividends = 0.0
+		self.fees = 0.0
 		self.adjustment = 0
 	
+	def clearTrades(self):
+		self.cashIn = {}
+		self.sharesIn = {}
+		self.cashOut = {}
+		self.sharesOut = {}
+		self.cashInShort = {}
+		self.sharesInShort = {}
+		self.cashOutShort = {}
+		self.sharesOutShort = {}
+		self.todayCashIn = 0.0
+		self.todayCashOut = 0.0
+		self.todayNetCashIn = 0.0
+		self.traded = False
+	
 	def endTransactions(self):
 		self.day += 1
 		
@@ -44,22 +75,10 @@ class Twrr:
 		# Twrr(1) = 1
 		# Twrr(n) = Twrr(n-1) * Performance(n-1)
 		
-		# Compute cashIn
-		todayNetCashIn = 0.0
-		todayCashIn = 0.0
-		todayCashOut = 0.0
-		for t in self.cashIn:
-			todayNetCashIn += abs(self.cashIn[t])
-			todayCashIn += abs(self.cashIn[t])
-		for t in self.cashOut:
-			todayNetCashIn -= abs(self.cashOut[t])
-			todayCashOut += abs(self.cashOut[t])
-		for t in self.cashInShort:
-			todayNetCashIn += abs(self.cashInShort[t])
-			todayCashIn += abs(self.cashInShort[t])
-		for t in self.cashOutShort:
-			todayNetCashIn -= abs(self.cashOutShort[t])
-			todayCashOut += abs(self.cashOutShort[t])
+		# Cash in and out are totaled as shares are added and removed
+		todayNetCashIn = self.todayNetCashIn
+		todayCashIn = self.todayCashIn
+		todayCashOut = self.todayCashOut
 		
 		# Handle splits
 		'''for t in self.sharesIn.keys():
@@ -78,11 +97,13 @@ class Twrr:
 				self.shares[t] -= self.sharesOut[t]
 				del self.sharesOut[t]
 				del self.cashOut[t]'''
-		for t in self.stockDividend:
-			if not t in self.shares:
-				self.shares[t] = 0.0
-			self.shares[t] += self.stockDividend[t]
-		self.stockDividend = {}
+		if self.stockDividend:
+			for t in self.stockDividend:
+				if not t in self.shares:
+					self.shares[t] = 0.0
+				self.shares[t] += self.stockDividend[t]
+				self.updateValue(t)
+			self.stockDividend = {}
 		
 		# Compute yesterday's holdings at today's prices
 		todaysStartValue = self.getTotalValue()
@@ -102,104 +123,105 @@ class Twrr:
 			#todo adjust basis
 		self.adjustBasises = {}
 
-		# Now add shares
-		#if self.sharesIn or self.sharesOut:
-		#	print self.day, "sharesIn", self.sharesIn, "sharesOut", self.sharesOut
-		for t in self.sharesIn:
-			if self.sharesIn[t] != 0:
-				thisPrice = self.cashIn[t] / self.sharesIn[t]
-				self.basis.add(t, self.day, self.sharesIn[t], thisPrice)
+		# Shares are only added or removed if there were trades today
+		tradedToday = self.traded
+		if tradedToday:
+			# Now add shares
+			#if self.sharesIn or self.sharesOut:
+			#	print self.day, "sharesIn", self.sharesIn, "sharesOut", self.sharesOut
+			for t in self.sharesIn:
+				if self.sharesIn[t] != 0:
+					thisPrice = self.cashIn[t] / self.sharesIn[t]
+					self.basis.add(t, self.day, self.sharesIn[t], thisPrice)
 				
-				if self.prices[t] != 0 and thisPrice != 0:
-					returnsToday.append((self.cashIn[t], self.prices[t] / thisPrice))
-				else:
-					returnsToday.append((self.cashIn[t], 1.0))
+					if self.prices[t] != 0 and thisPrice != 0:
+						returnsToday.append((self.cashIn[t], self.prices[t] / thisPrice))
+					else:
+						returnsToday.append((self.cashIn[t], 1.0))
 
-			if not t in self.shares:
-				self.shares[t] = 0
-			self.shares[t] += self.sharesIn[t]
-		self.cashIn = {}
-		self.sharesIn = {}
+				if not t in self.shares:
+					self.shares[t] = 0
+				self.shares[t] += self.sharesIn[t]
+				self.updateValue(t)
 		
-		# Now add shares (short)
-		#if self.sharesInShort or self.sharesOutShort:
-		#	print self.day, "sharesInShort", self.sharesInShort, "sharesOutShort", self.sharesOutShort
-		for t in self.sharesInShort:
-			if self.sharesInShort[t] != 0:
-				# Short
-				thisPrice = self.cashInShort[t] / self.sharesInShort[t]
-				self.basis.add(t, self.day, self.sharesInShort[t], thisPrice)
+			# Now add shares (short)
+			#if self.sharesInShort or self.sharesOutShort:
+			#	print self.day, "sharesInShort", self.sharesInShort, "sharesOutShort", self.sharesOutShort
+			for t in self.sharesInShort:
+				if self.sharesInShort[t] != 0:
+					# Short
+					thisPrice = self.cashInShort[t] / self.sharesInShort[t]
+					self.basis.add(t, self.day, self.sharesInShort[t], thisPrice)
 				
-				# Calculate return from these shares
-				if thisPrice < self.prices[t]:
-					# Loss
-					thisReturn = thisPrice / self.prices[t]
-				else:
-					# Gain or same price
-					# 10 -> 9 = 1.1 = 1 + (10 - 9) / 10
-					thisReturn = 1.0 + (self.prices[t] - thisPrice) / self.prices[t]
-				returnsToday.append((self.cashInShort[t], thisReturn))
-			if not t in self.sharesShort:
-				self.sharesShort[t] = 0
-			self.sharesShort[t] += self.sharesInShort[t]
-		self.cashInShort = {}
-		self.sharesInShort = {}
-
-		# Now remove shares
-		for t in self.sharesOut:
-			if self.sharesOut[t] != 0:
-				thisPrice = self.cashOut[t] / self.sharesOut[t]
-				if self.cashOut[t] == 0:
-					cashOut = self.basis.getBasis(t)
-				else:
-					cashOut = self.cashOut[t]
+					# Calculate return from these shares
+					if thisPrice < self.prices[t]:
+						# Loss
+						thisReturn = thisPrice / self.prices[t]
+					else:
+						# Gain or same price
+						# 10 -> 9 = 1.1 = 1 + (10 - 9) / 10
+						thisReturn = 1.0 + (self.prices[t] - thisPrice) / self.prices[t]
+					returnsToday.append((self.cashInShort[t], thisReturn))
+				if not t in self.sharesShort:
+					self.sharesShort[t] = 0
+				self.sharesShort[t] += self.sharesInShort[t]
+
+			# Now remove shares
+			for t in self.sharesOut:
+				if self.sharesOut[t] != 0:
+					thisPrice = self.cashOut[t] / self.sharesOut[t]
+					if self.cashOut[t] == 0:
+						cashOut = self.basis.getBasis(t)
+					else:
+						cashOut = self.cashOut[t]
 				
-				if t in self.yesterdayPrices and self.yesterdayPrices[t] != 0:
-					returnsToday.append((cashOut, thisPrice / self.yesterdayPrices[t]))
-				elif self.prices[t] != 0:
-					returnsToday.append((cashOut, thisPrice / self.prices[t]))
-				else:
-					returnsToday.append((cashOut, 1.0))
-				#print returnsToday
-
-			self.basis.remove(t, abs(self.sharesOut[t]))
+					if t in self.yesterdayPrices and self.yesterdayPrices[t] != 0:
+						returnsToday.append((cashOut, thisPrice / self.yesterdayPrices[t]))
+					elif self.prices[t] != 0:
+						returnsToday.append((cashOut, thisPrice / self.prices[t]))
+					else:
+						returnsToday.append((cashOut, 1.0))
+					#print returnsToday
 
-			if not t in self.shares:
-				self.shares[t] = 0
-			self.shares[t] -= self.sharesOut[t]
-		self.cashOut = {}
-		self.sharesOut = {}
+				self.basis.remove(t, abs(self.sharesOut[t]))
 
-		# Now remove shares (short)
-		for t in self.sharesOutShort:
-			if self.sharesOutShort[t] != 0:
-				salePrice = self.cashOutShort[t] / self.sharesOutShort[t]
-				todayPrice = False
-				if t in self.yesterdayPrices and self.yesterdayPrices[t] != 0:
-					yesterdayPrice = self.yesterdayPrices[t]
-				else:
-					yesterdayPrice = self.prices[t]
+				if not t in self.shares:
+					self.shares[t] = 0
+				self.shares[t] -= self.sharesOut[t]
+				self.updateValue(t)
+
+			# Now remove shares (short)
+			for t in self.sharesOutShort:
+				if self.sharesOutShort[t] != 0:
+					salePrice = self.cashOutShort[t] / self.sharesOutShort[t]
+					todayPrice = False
+					if t in self.yesterdayPrices and self.yesterdayPrices[t] != 0:
+						yesterdayPrice = self.yesterdayPrices[t]
+					else:
+						yesterdayPrice = self.prices[t]
 				
-				# Return = today's value / yesterday's value
-				basis = self.basis.getBasis(t)
-				yesterdayValue = self.shortValue(self.sharesOutShort[t], basis, yesterdayPrice, basis * self.sharesOutShort[t])
-				todayValue = self.shortValue(self.sharesOutShort[t], basis, self.prices[t], basis * self.sharesOutShort[t])
+					# Return = today's value / yesterday's value
+					basis = self.basis.getBasis(t)
+					yesterdayValue = self.shortValue(self.sharesOutShort[t], basis, yesterdayPrice, basis * self.sharesOutShort[t])
+					todayValue = self.shortValue(self.sharesOutShort[t], basis, self.prices[t], basis * self.sharesOutShort[t])
 				
-				if yesterdayValue and todayValue:
-					returnsToday.append((basis, todayValue / yesterdayValue))
+					if yesterdayValue and todayValue:
+						returnsToday.append((basis, todayValue / yesterdayValue))
 
-			self.basis.remove(t, self.sharesOutShort[t])
+				self.basis.remove(t, self.sharesOutShort[t])
 
-			if not t in self.sharesShort:
-				self.sharesShort[t] = 0
-			self.sharesShort[t] -= self.sharesOutShort[t]
-			if abs(self.sharesShort[t]) < 1.0e-6:
-				del self.sharesShort[t]
-		self.cashOutShort = {}
-		self.sharesOutShort = {}
+				if not t in self.sharesShort:
+					self.sharesShort[t] = 0
+				self.sharesShort[t] -= self.sharesOutShort[t]
+				if abs(self.sharesShort[t]) < 1.0e-6:
+					del self.sharesShort[t]
+			self.clearTrades()
 
-		# Compute today's value
-		todaysValue = self.getTotalValue()
+		# Compute today's value.  Holdings only change if there were trades.
+		if tradedToday:
+			todaysValue = self.getTotalValue()
+		else:
+			todaysValue = todaysStartValue
 		
 		# Update returns
 		#print self.day, "ydayValue", self.yesterdayValue, "tdaysStartValue", todaysStartValue, "tdayNetCashIn", todayNetCashIn, "tdaysValue", todaysValue
@@ -270,12 +292,15 @@ class Twrr:
 		
 		#print self.day, "return", self.lastReturn
 		
-		for t in self.prices:
-			self.yesterdayPrices[t] = self.prices[t]
+		self.yesterdayPrices.update(self.prices)
 		self.yesterdayValue = todaysValue
 		if todaysValue:
 			self.lastValue = todaysValue
 
+	def skipDays(self, days):
+		'''Advance past days with no transactions and no price changes.  Returns are unchanged on those days.'''
+		self.day += days
+
 	def addShares(self, ticker, shares, price):
 		if shares < 0:
 			raise Exception("Shares must be >= 0 for %s" % ticker)
@@ -286,15 +311,19 @@ class Twrr:
 		if not self.ticker:
 			self.ticker = ticker
 		if price != 0 or not ticker in self.prices:
-			self.prices[ticker] = price
+			self.setPrice(ticker, price)
 		if not ticker in self.yesterdayPrices:
 			self.yesterdayPrices[ticker] = price
+		cash = float(shares) * price
 		if not ticker in self.cashIn:
-			self.cashIn[ticker] = float(shares) * price
+			self.cashIn[ticker] = cash
 			self.sharesIn[ticker] = float(shares)
 		else:
-			self.cashIn[ticker] += float(shares) * price
+			self.cashIn[ticker] += cash
 			self.sharesIn[ticker] += float(shares)
+		self.todayCashIn += cash
+		self.todayNetCashIn += cash
+		self.traded = True
 
 	def removeShares(self, ticker, shares, price):
 		if shares < 0:
@@ -303,13 +332,17 @@ class Twrr:
 			raise Exception("Price must be >= 0 for %s" % ticker)
 		if shares == 0:
 			return
-		self.prices[ticker] = price
+		self.setPrice(ticker, price)
+		cash = float(shares) * price
 		if not ticker in self.cashOut:
-			self.cashOut[ticker] = float(shares) * price
+			self.cashOut[ticker] = cash
 			self.sharesOut[ticker] = float(shares)
 		else:
-			self.cashOut[ticker] += float(shares) * price
+			self.cashOut[ticker] += cash
 			self.sharesOut[ticker] += float(shares)
+		self.todayCashOut += cash
+		self.todayNetCashIn -= cash
+		self.traded = True
 
 	def stockDividendShares(self, ticker, shares):
 		if shares == 0:
@@ -333,26 +366,34 @@ class Twrr:
 		if not self.ticker:
 			self.ticker = ticker
 		if price != 0:
-			self.prices[ticker] = price
+			self.setPrice(ticker, price)
 		# Pass a date of 1
 		if not ticker in self.cashInShort:
 			self.cashInShort[ticker] = 0.0
 			self.sharesInShort[ticker] = 0.0
-		self.cashInShort[ticker] += float(shares) * price
+		cash = float(shares) * price
+		self.cashInShort[ticker] += cash
 		self.sharesInShort[ticker] += float(shares)
+		self.todayCashIn += cash
+		self.todayNetCashIn += cash
+		self.traded = True
 
 	def coverShares(self, ticker, shares, price):
 		if shares < 0:
 			raise Exception("Shares must be >= 0 for %s" % ticker)
 		if price < 0:
 			raise Exception("Price must be >= 0 for %s" % ticker)
-		self.prices[ticker] = price
+		self.setPrice(ticker, price)
 		basis = self.basis.getBasis(ticker)
 		if not ticker in self.cashOutShort:
 			self.cashOutShort[ticker] = 0.0
 			self.sharesOutShort[ticker] = 0.0
-		self.cashOutShort[ticker] += float(shares) * price
+		cash = float(shares) * price
+		self.cashOutShort[ticker] += cash
 		self.sharesOutShort[ticker] += float(shares)
+		self.todayCashOut += cash
+		self.todayNetCashIn -= cash
+		self.traded = True
 		#print self.day + 1, "cover at", price, "basis", basis, "cashOut", self.cashOut, self.shares
 
 	def addDividend(self, amount):
@@ -389,7 +430,19 @@ class Twrr:
 		if price < 0:
 			raise Exception("Price must be >= 0 for %s" % ticker)
 		#print self.day + 1, "value", ticker, price
+		self.setPrice(ticker, price)
+	
+	def setPrice(self, ticker, price):
 		self.prices[ticker] = price
+		self.updateValue(ticker)
+	
+	def updateValue(self, ticker):
+		'''Update the running total of long holdings after the shares or price of ticker changed'''
+		if ticker in self.shares:
+			value = self.shares[ticker] * self.prices[ticker]
+			# Subtract first so a single holding's total is exactly its value
+			self.longValue = self.longValue - self.values.get(ticker, 0.0) + value
+			self.values[ticker] = value
 	
 	def shortValue(self, shares, basis, price, totalBasis):
 		if price <= basis:
@@ -400,9 +453,8 @@ class Twrr:
 			return shares * basis * (basis / price)			
 
 	def getTotalValue(self):
-		v = 0
-		for t in self.shares:
-			v += self.shares[t] * self.prices[t]
+		# Long holdings are totaled as shares and prices change
+		v = self.longValue
 		for t in self.sharesShort:
 			
 			v += self.shortValue(self.sharesShort[t], self.basis.getBasis(t), self.prices[t], self.basis.getTotalBasis(t))
@@ -440,7 +492,37 @@ def checkTotalValue(r, check):
 	if abs(r.getTotalValue() - check) >= 1.0e-6:
 		print "FAIL total value:", r.getTotalValue(), "total value should be", check
 
+def benchmark(years = 20):
+	"""Time a daily simulation of a synthetic position with regular buys, sells, reinvested dividends and fees"""
+	import random
+	import time
+
+	random.seed(1)
+	r = Twrr()
+	price = 50.0
+	start = time.time()
+	for day in range(years * 365):
+		r.beginTransactions()
+		if day % 90 == 0:
+			r.addShares("A", 10, price)
+		if day % 91 == 45:
+			r.addDividendReinvest("A", 0.5, price)
+		if day % 365 == 200:
+			r.removeShares("A", 5, price)
+		if day % 30 == 0:
+			r.addFee(1.0)
+		price *= 1 + random.gauss(0.0003, 0.01)
+		r.setValue("A", price)
+		r.endTransactions()
+		r.getReturnFee()
+	print "%d years in %.3f seconds, return %f" % (years, time.time() - start, r.getReturnFee())
+
 if __name__ == "__main__":
+	import sys
+	if "benchmark" in sys.argv[1:]:
+		benchmark()
+		sys.exit()
+
 	print "test1 - basic dividends"
 	r = Twrr()
 
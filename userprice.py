@@ -23,6 +23,8 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import bisect
+
 class UserPrice:
 	def __init__(self, date, ticker, price):
 		self.date = date
@@ -41,3 +43,31 @@ class UserPrice:
 		on = {"date": self.date, "ticker": self.ticker}
 
 		db.insertOrUpdate("userPrices", data, on)
+
+class OptionPrices:
+	'''Option prices indexed by contract.  A contract is its underlying ticker,
+	expiration, strike and put or call.  Each contract keeps its prices in date order.'''
+	def __init__(self):
+		self.dates = {}
+		self.prices = {}
+	
+	def add(self, ticker, expire, strike, type, date, price):
+		'''Add a price.  A later price on the same date replaces an earlier one.'''
+		key = (ticker.upper(), expire, strike, type)
+		if not key in self.dates:
+			self.dates[key] = []
+			self.prices[key] = []
+		dates = self.dates[key]
+		i = bisect.bisect_right(dates, date)
+		dates.insert(i, date)
+		self.prices[key].insert(i, price)
+	
+	def getPrice(self, ticker, expire, strike, date, type):
+		'''Return the last price on or before date, or False'''
+		key = (ticker.upper(), expire, strike, type)
+		if not key in self.dates:
+			return False
+		i = bisect.bisect_right(self.dates[key], date)
+		if i == 0:
+			return False
+		return self.prices[key][i - 1]